@@ -0,0 +1,351 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the strongly connected components (SCC) of the road network and a reachability
+index over them.
+
+The road network is directed and not fully connected, and a search for an unreachable vertex explores the whole
+component of its source before it gives up. With the SCC labels and an index of the condensation DAG (the graph of the
+components), most unreachable queries are rejected in O(1):
+
+- two vertices of the same component reach each other;
+- the components are labelled by the iterative Tarjan algorithm, in reverse topological order, so a component only
+  reaches components with a smaller label;
+- every component has NUM_INTERVALS post-order intervals of randomized DFS traversals of the DAG (GRAIL), and a
+  component only reaches the components whose intervals lie inside its own.
+
+The remaining queries are answered exactly by a DFS of the DAG pruned by the same two tests.
+
+=== Constants ===
+COMPONENT_DIR: str
+    The name of the directory of the component index, inside the road-network snapshot (see snapshot.py).
+COMPONENT_VERSION: int
+    The version of the saved format of the component index.
+NUM_INTERVALS: int
+    The default number of DAG traversals of the interval labels.
+"""
+
+
+import random
+
+import numpy as np
+
+from road_network import RoadNetwork, Path, construct_path
+from snapshot import save_arrays, load_arrays, load_or_build_arrays
+
+
+COMPONENT_DIR = "components"
+COMPONENT_VERSION = 1
+NUM_INTERVALS = 2
+
+
+class ComponentIndex:
+    """
+    The strongly connected components of a road network and the reachability index of their condensation DAG.
+
+    labels[v] is the component of vertex v (-1 if there is no vertex v), sizes[c] the number of vertices of component
+    c. The DAG is stored in CSR form: the components reached by an edge from component c are
+    dag_targets[dag_offsets[c]:dag_offsets[c + 1]]. low[c, k] and post[c, k] are the interval of component c in the
+    k-th traversal.
+
+    Two one-way rings 0 -> 1 -> 2 -> 3 -> 0 and 4 -> 5 -> 6 -> 4, joined by a bridge 3 -> 4, with a dead end 6 -> 8
+    and an isolated vertex 7. The rings are labelled after the components they reach, and the bridge only goes one
+    way:
+
+    >>> road_network = RoadNetwork()
+    >>> road_network.add_vertices(range(9), [39.9] * 4 + [39.901] * 3 + [39.902, 39.903],
+    ...                           [116.3 + 0.001 * v for v in range(9)])
+    >>> road_network.add_edges(range(9), [0, 1, 2, 3, 4, 5, 6, 3, 6], [1, 2, 3, 0, 5, 6, 4, 4, 8], [100.0] * 9)
+    >>> index = ComponentIndex.build(road_network)
+    >>> index.labels.tolist(), index.sizes.tolist()
+    ([2, 2, 2, 2, 1, 1, 1, 3, 0], [1, 3, 4, 1])
+    >>> [index.is_reachable(s, e) for s, e in [(0, 5), (5, 0), (2, 8), (8, 6), (7, 7), (7, 0), (0, 9)]]
+    [True, False, True, False, True, False, False]
+    >>> np.flatnonzero(index.largest_component()).tolist()
+    [0, 1, 2, 3]
+    """
+
+    ARRAY_NAMES = ('labels', 'sizes', 'dag_offsets', 'dag_targets', 'low', 'post')
+
+    def __init__(self, arrays):
+        """
+        Initialize a ComponentIndex from its arrays, see ComponentIndex.build().
+
+        :param arrays: dict[str, numpy.ndarray]
+        :return: None
+        """
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def __str__(self):
+        return "ComponentIndex:\n- number of components: {}\n- largest component: {} vertexes"\
+            .format(len(self.sizes), int(self.sizes.max()) if len(self.sizes) != 0 else 0)
+
+    @classmethod
+    def build(cls, road_network, num_intervals=NUM_INTERVALS, seed=0):
+        """
+        Compute the strongly connected components of a road network and index their reachability.
+
+        :param road_network: the road network
+        :param num_intervals: the number of DAG traversals of the interval labels
+        :param seed: the seed of the random order of the traversals
+        :type road_network: RoadNetwork
+        :type num_intervals: int
+        :type seed: int
+        :return: ComponentIndex
+        """
+        road_network.pack()
+        arrays = road_network.to_arrays()
+        labels = strongly_connected_components(arrays['offsets'], arrays['targets'], arrays['v_exists'])
+        num_comp = int(labels.max()) + 1 if len(labels) != 0 else 0
+        sizes = np.bincount(labels[labels >= 0], minlength=num_comp).astype(np.int64)
+
+        # The condensation DAG, without parallel edges.
+        e_ids = np.flatnonzero(arrays['e_exists'])
+        tails = labels[arrays['e_start'][e_ids]].astype(np.int64)
+        heads = labels[arrays['e_end'][e_ids]].astype(np.int64)
+        keys = np.unique(tails[tails != heads] * num_comp + heads[tails != heads])
+        tails = keys // num_comp
+        heads = keys % num_comp
+        dag_offsets = np.zeros(num_comp + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=num_comp), out=dag_offsets[1:])
+
+        dag = [heads[dag_offsets[c]:dag_offsets[c + 1]].tolist() for c in range(num_comp)]
+        has_parent = np.zeros(num_comp, dtype=bool)
+        has_parent[heads] = True
+        roots = np.flatnonzero(~has_parent).tolist()
+
+        rng = random.Random(seed)
+        low = np.zeros((num_comp, num_intervals), dtype=np.int64)
+        post = np.zeros((num_comp, num_intervals), dtype=np.int64)
+        for k in range(num_intervals):
+            rng.shuffle(roots)
+            [low[:, k], post[:, k]] = _post_order_intervals(dag, roots, rng)
+
+        return cls({'labels': labels, 'sizes': sizes, 'dag_offsets': dag_offsets, 'dag_targets': heads,
+                    'low': low, 'post': post})
+
+    def save(self, path):
+        """
+        Save the component index to directory path, see snapshot.save_arrays().
+
+        :param path: str
+        :return: None
+        """
+        save_arrays({name: getattr(self, name) for name in self.ARRAY_NAMES}, {'version': COMPONENT_VERSION}, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a component index saved by save(). The arrays are memory-mapped read-only.
+
+        :param path: str
+        :return: ComponentIndex
+        """
+        [arrays, meta] = load_arrays(path, cls.ARRAY_NAMES)
+        if meta['version'] != COMPONENT_VERSION:
+            raise ValueError("incompatible component index: %s" % path)
+        return cls(arrays)
+
+    @classmethod
+    def load_or_build(cls, road_network, path):
+        """
+        Load the component index saved in directory path, building and saving it first if necessary, see
+        snapshot.load_or_build_arrays().
+
+        :param road_network: the road network
+        :param path: the directory of the component index
+        :type road_network: RoadNetwork
+        :type path: str
+        :return: ComponentIndex
+        """
+        def build():
+            index = cls.build(road_network)
+            return {name: getattr(index, name) for name in cls.ARRAY_NAMES}
+
+        return cls(load_or_build_arrays(path, cls.ARRAY_NAMES, COMPONENT_VERSION, build,
+                                        "the strongly connected components"))
+
+    def is_reachable(self, s_vid, e_vid):
+        """
+        Return True if there exist a path from s_vid to e_vid, otherwise return False.
+
+        :param s_vid: int
+        :param e_vid: int
+        :return: bool
+        """
+        if not (0 <= s_vid < len(self.labels) and 0 <= e_vid < len(self.labels)):
+            return False
+        source = int(self.labels[s_vid])
+        target = int(self.labels[e_vid])
+        if source < 0 or target < 0:
+            return False
+        if source == target:
+            return True
+        if not self.__may_reach(source, target):
+            return False
+
+        # A DFS of the DAG, which only enters the components that may still reach the target.
+        visited = {source}
+        stack = [source]
+        while len(stack) != 0:
+            current = stack.pop()
+            for c in self.dag_targets[self.dag_offsets[current]:self.dag_offsets[current + 1]].tolist():
+                if c == target:
+                    return True
+                if c not in visited and self.__may_reach(c, target):
+                    visited.add(c)
+                    stack.append(c)
+        return False
+
+    def __may_reach(self, source, target):
+        """
+        The O(1) tests: False if component source cannot reach component target.
+        """
+        if source < target:
+            return False
+        return bool(np.all(self.low[source] <= self.low[target]) and np.all(self.post[target] <= self.post[source]))
+
+    def largest_component(self):
+        """
+        Return a bool array indexed by vertex id, True for the vertices of the largest strongly connected component,
+        e.g. the vertices that map matching may snap to (see routing.map_match()).
+
+        :return: numpy.ndarray
+        """
+        return self.labels == int(np.argmax(self.sizes))
+
+    def filter_router(self, router):
+        """
+        Return a router which returns an empty Path at once for an unreachable query, and otherwise calls router.
+
+        :param router: a function with the signature of road_network.get_shortest_path()
+        :type router: (RoadNetwork, int, int) -> Path
+        :return: the filtered router
+        :rtype: (RoadNetwork, int, int) -> Path
+        """
+        def filtered_router(road_network, s_vid, e_vid):
+            if not self.is_reachable(s_vid, e_vid):
+                return construct_path(road_network, s_vid, e_vid, {s_vid: None})
+            return router(road_network, s_vid, e_vid)
+
+        return filtered_router
+
+
+def strongly_connected_components(offsets, targets, v_exists):
+    """
+    Label the strongly connected components of a graph in CSR form using Tarjan's algorithm.
+
+    The DFS keeps its own stack of (vertex, next out-edge), so it is safe on graphs of any depth. The components are
+    labelled in the order Tarjan's algorithm completes them, which is a reverse topological order of the condensation
+    DAG: an edge between two components leads to the one with the smaller label.
+
+    :param offsets: the out-edges of vertex v are in targets[offsets[v]:offsets[v + 1]]
+    :param targets: the heads of the edges
+    :param v_exists: v_exists[v] is True if there is a vertex v
+    :type offsets: numpy.ndarray
+    :type targets: numpy.ndarray
+    :type v_exists: numpy.ndarray
+    :return: the component label of every vertex, -1 if there is no vertex
+    :rtype: numpy.ndarray
+    """
+    offsets = offsets.tolist()
+    targets = targets.tolist()
+    num_slot = len(offsets) - 1
+    index = [-1] * num_slot
+    low = [0] * num_slot
+    on_stack = [False] * num_slot
+    labels = [-1] * num_slot
+    stack = []
+    counter = 0
+    num_comp = 0
+
+    for root in np.flatnonzero(v_exists).tolist():
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [[root, offsets[root]]]
+        while len(work) != 0:
+            item = work[-1]
+            v = item[0]
+            hi = offsets[v + 1]
+            descended = False
+            while item[1] < hi:
+                w = targets[item[1]]
+                item[1] += 1
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append([w, offsets[w]])
+                    descended = True
+                    break
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            if descended:
+                continue
+
+            work.pop()
+            if low[v] == index[v]:  # v is the root of a component
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    labels[w] = num_comp
+                    if w == v:
+                        break
+                num_comp += 1
+            if len(work) != 0:
+                u = work[-1][0]
+                if low[v] < low[u]:
+                    low[u] = low[v]
+
+    return np.array(labels, dtype=np.int32)
+
+
+def _post_order_intervals(dag, roots, rng):
+    """
+    Return the interval labels of one randomized DFS traversal of a DAG.
+
+    post[c] is the post-order rank of component c, low[c] the smallest post-order rank among the components it
+    reaches, so [low[c], post[c]] contains the interval of every component reachable from c.
+
+    :param dag: the children of each component
+    :param roots: the components without a parent
+    :param rng: the random number generator of the order of the children
+    :type dag: list[list[int]]
+    :type roots: list[int]
+    :type rng: random.Random
+    :return: low, post
+    :rtype: [list[int], list[int]]
+    """
+    num_comp = len(dag)
+    low = [0] * num_comp
+    post = [-1] * num_comp
+    visited = [False] * num_comp
+    counter = 0
+    for root in roots:
+        visited[root] = True
+        children = dag[root][:]
+        rng.shuffle(children)
+        work = [[root, children, 0]]
+        while len(work) != 0:
+            item = work[-1]
+            [c, children, i] = item
+            if i < len(children):
+                item[2] += 1
+                child = children[i]
+                if not visited[child]:
+                    visited[child] = True
+                    grandchildren = dag[child][:]
+                    rng.shuffle(grandchildren)
+                    work.append([child, grandchildren, 0])
+                continue
+            work.pop()
+            post[c] = counter
+            low[c] = min([counter] + [low[child] for child in children])
+            counter += 1
+    return [low, post]
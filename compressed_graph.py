@@ -0,0 +1,383 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the road network with its degree-2 chains compressed, a reduced graph on which the
+point-to-point searches settle far fewer vertices.
+
+Most vertices of the road data are shape points along a road: they are only entered from one neighbor and left to the
+other one. A maximal run of such vertices between two other ("kept") vertices is a chain, and it is replaced by one
+super-edge, which carries the total weight and the sequence of the original edges. A two-way road becomes two
+super-edges, one per direction. The searches run on the kept vertices and the super-edges only; a source or target
+inside a chain is attached to the ends of its super-edges. The path found is expanded back into the original edges of
+its super-edges, so a taxi still drives along the real edges.
+
+The super-edges are stored in CSR form: the original edges of super-edge k are se_edges[se_offsets[k]:se_offsets[k+1]]
+with the distances from its tail to the end of each of them in se_prefix at the same positions.
+
+=== Constants ===
+COMPRESSED_GRAPH_DIR: str
+    The name of the directory of the compressed graph, inside the road-network snapshot (see snapshot.py).
+COMPRESSED_GRAPH_VERSION: int
+    The version of the saved format of the compressed graph.
+"""
+
+
+import numpy as np
+
+from location import great_circle_distance_many
+from road_network import RoadNetwork, Path, construct_path_by_edges
+from container import IndexedPriorityQueue
+from snapshot import save_arrays, load_arrays, load_or_build_arrays
+
+
+COMPRESSED_GRAPH_DIR = "compressed_graph"
+COMPRESSED_GRAPH_VERSION = 1
+
+
+class CompressedGraph:
+    """
+    The road network with its degree-2 chains replaced by super-edges.
+
+    For a kept vertex v, super_ids[offsets[v]:offsets[v + 1]] are the super-edges leaving v, and targets and weights at
+    the same positions their heads and total weights. Super-edge k runs from se_tail[k] to se_head[k]. A vertex inside a
+    chain lies on one super-edge per direction of the road, listed in on_super[on_offsets[v]:on_offsets[v + 1]], and
+    on_pos at the same positions is the position (in se_edges) of the original edge which ends at the vertex.
+
+    A two-way road 0 - 1 - 2 - 3 - 4, dearer westwards, and a one-way bypass 4 -> 5 -> 6 -> 0 keep only 0 and 4. A
+    path with both ends inside the same chain stays on it when that is shortest, or leaves it and comes round through
+    the kept vertices:
+
+    >>> road_network = RoadNetwork()
+    >>> road_network.add_vertices(range(7), [39.9] * 5 + [39.899, 39.899],
+    ...                           [116.3 + 0.001 * v for v in range(5)] + [116.303, 116.301])
+    >>> road_network.add_edges(range(11), range(4) + range(1, 5) + [4, 5, 6], range(1, 5) + range(4) + [5, 6, 0],
+    ...                        [100.0] * 4 + [300.0] * 4 + [10.0] * 3)
+    >>> compressed = CompressedGraph.build(road_network)
+    >>> np.flatnonzero(compressed.kept).tolist(), zip(compressed.se_tail.tolist(), compressed.se_head.tolist())
+    ([0, 4], [(0, 4), (4, 0), (4, 0)])
+    >>> for s, e in [(1, 3), (3, 2), (3, 1), (5, 6), (6, 5)]:
+    ...     path = compressed.get_shortest_path(road_network, s, e)
+    ...     print((path.vertex_list, path.edge_list, path.distance))
+    ((1, 2, 3), (1, 2), 200.0)
+    ((3, 2), (6,), 300.0)
+    ((3, 4, 5, 6, 0, 1), (3, 8, 9, 10, 0), 230.0)
+    ((5, 6), (9,), 10.0)
+    ((6, 0, 1, 2, 3, 4, 5), (10, 0, 1, 2, 3, 8), 420.0)
+
+    A loop of chain vertices, here a ring road in both directions, keeps one of its vertices:
+
+    >>> from road_network import single_source_dijkstra_distance
+    >>> def check(road_network, compressed, pairs, expected):
+    ...     paths = [compressed.get_shortest_path(road_network, s, e) for s, e in pairs]
+    ...     lengths = [path.distance if len(path.vertex_list) != 0 else float('inf') for path in paths]
+    ...     return np.allclose(lengths, expected) and all(
+    ...         road_network.e_start[list(path.edge_list)].tolist() == list(path.vertex_list[:-1]) and
+    ...         road_network.e_end[list(path.edge_list)].tolist() == list(path.vertex_list[1:]) for path in paths)
+    >>> ring = RoadNetwork()
+    >>> ring.add_vertices(range(6), [39.9 + 0.0001 * (v in (1, 2, 3)) for v in range(6)],
+    ...                   [116.3 + 0.0001 * v for v in range(6)])
+    >>> ahead = [(v + 1) % 6 for v in range(6)]
+    >>> ring.add_edges(range(12), range(6) + ahead, ahead + range(6), [100.0 + e for e in range(12)])
+    >>> compressed = CompressedGraph.build(ring)
+    >>> int(np.count_nonzero(compressed.kept))
+    1
+    >>> pairs = [(s, e) for s in range(6) for e in range(6)]
+    >>> check(ring, compressed, pairs, [single_source_dijkstra_distance(ring, s)[e] for s, e in pairs])
+    True
+    """
+
+    ARRAY_NAMES = ('kept', 'offsets', 'targets', 'weights', 'super_ids',
+                   'se_tail', 'se_head', 'se_offsets', 'se_edges', 'se_prefix',
+                   'on_offsets', 'on_super', 'on_pos')
+
+    def __init__(self, arrays):
+        """
+        Initialize a CompressedGraph from its arrays, see CompressedGraph.build().
+
+        :param arrays: dict[str, numpy.ndarray]
+        :return: None
+        """
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def __str__(self):
+        return "CompressedGraph:\n- number of kept vertexes: {}\n- number of super-edges: {}"\
+            .format(int(np.count_nonzero(self.kept)), len(self.se_tail))
+
+    @classmethod
+    def build(cls, road_network):
+        """
+        Compress the degree-2 chains of a road network.
+
+        A vertex is inside a chain if it has exactly two distinct neighbors u and w, and every way into it goes on to
+        the other neighbor: the out-neighbors are exactly the "other" neighbors of the in-neighbors. A loop of such
+        vertices with no kept vertex on it gets one of its vertices kept.
+
+        :param road_network: the road network
+        :type road_network: RoadNetwork
+        :return: CompressedGraph
+        """
+        road_network.pack()
+        arrays = road_network.to_arrays()
+        offsets = arrays['offsets']
+        targets = arrays['targets'].tolist()
+        edge_ids = arrays['edge_ids'].tolist()
+        weights = arrays['weights'].tolist()
+        r_offsets = arrays['r_offsets']
+        sources = arrays['sources'].tolist()
+        num_slot = len(offsets) - 1
+
+        # Only the vertices with one or two in-edges and as many out-edges can be inside a chain.
+        out_degree = np.diff(offsets)
+        in_degree = np.diff(r_offsets)
+        kept = arrays['v_exists'].copy()
+        for v in np.flatnonzero(kept & (out_degree == in_degree) & (out_degree >= 1) & (out_degree <= 2)).tolist():
+            out_nbrs = set(targets[offsets[v]:offsets[v + 1]])
+            in_nbrs = set(sources[r_offsets[v]:r_offsets[v + 1]])
+            nbrs = out_nbrs | in_nbrs
+            if len(nbrs) != 2 or v in nbrs:
+                continue
+            if out_nbrs == set((nbrs - {u}).pop() for u in in_nbrs):
+                kept[v] = False
+
+        se_tail = []
+        se_head = []
+        se_edges = []  # list of the lists of (e_id, prefix)
+        covered = np.zeros(num_slot, dtype=bool)
+
+        def walk(tail):
+            """
+            Add the super-edges which leave kept vertex tail.
+            """
+            for k in range(offsets[tail], offsets[tail + 1]):
+                prev = tail
+                current = targets[k]
+                prefix = weights[k]
+                edges = [(edge_ids[k], prefix)]
+                while not kept[current]:
+                    covered[current] = True
+                    for j in range(offsets[current], offsets[current + 1]):
+                        if targets[j] != prev:
+                            break
+                    prev = current
+                    current = targets[j]
+                    prefix += weights[j]
+                    edges.append((edge_ids[j], prefix))
+                se_tail.append(tail)
+                se_head.append(current)
+                se_edges.append(edges)
+
+        for v in np.flatnonzero(kept).tolist():
+            walk(v)
+        for v in np.flatnonzero(~kept & arrays['v_exists']).tolist():
+            if not covered[v]:  # on a loop of chain vertices
+                kept[v] = True
+                walk(v)
+
+        se_tail = np.array(se_tail, dtype=np.int64)
+        se_head = np.array(se_head, dtype=np.int64)
+        se_lengths = np.array([len(edges) for edges in se_edges], dtype=np.int64)
+        se_offsets = np.concatenate(([0], np.cumsum(se_lengths))).astype(np.int64)
+        flat_edges = np.array([item[0] for edges in se_edges for item in edges], dtype=np.int64)
+        flat_prefix = np.array([item[1] for edges in se_edges for item in edges], dtype=np.float64)
+
+        # The reduced adjacency of the kept vertices, grouped by tail (the loops were walked last).
+        super_ids = np.argsort(se_tail, kind='mergesort')
+        reduced_offsets = np.zeros(num_slot + 1, dtype=np.int64)
+        np.cumsum(np.bincount(se_tail, minlength=num_slot), out=reduced_offsets[1:])
+
+        # The super-edges through each chain vertex, found from the ends of their original edges.
+        positions = np.flatnonzero(~kept[arrays['e_end'][flat_edges]])
+        on_vertex = arrays['e_end'][flat_edges[positions]]
+        order = np.argsort(on_vertex, kind='mergesort')
+        on_offsets = np.zeros(num_slot + 1, dtype=np.int64)
+        np.cumsum(np.bincount(on_vertex, minlength=num_slot), out=on_offsets[1:])
+        on_pos = positions[order]
+        on_super = np.searchsorted(se_offsets, on_pos, side='right') - 1
+
+        return cls({'kept': kept,
+                    'offsets': reduced_offsets,
+                    'targets': se_head[super_ids],
+                    'weights': flat_prefix[se_offsets[1:] - 1][super_ids],
+                    'super_ids': super_ids.astype(np.int64),
+                    'se_tail': se_tail,
+                    'se_head': se_head,
+                    'se_offsets': se_offsets,
+                    'se_edges': flat_edges,
+                    'se_prefix': flat_prefix,
+                    'on_offsets': on_offsets,
+                    'on_super': on_super.astype(np.int64),
+                    'on_pos': on_pos.astype(np.int64)})
+
+    def save(self, path):
+        """
+        Save the compressed graph to directory path, see snapshot.save_arrays().
+
+        :param path: str
+        :return: None
+        """
+        save_arrays({name: getattr(self, name) for name in self.ARRAY_NAMES}, {'version': COMPRESSED_GRAPH_VERSION},
+                    path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a compressed graph saved by save(). The arrays are memory-mapped read-only.
+
+        :param path: str
+        :return: CompressedGraph
+        """
+        [arrays, meta] = load_arrays(path, cls.ARRAY_NAMES)
+        if meta['version'] != COMPRESSED_GRAPH_VERSION:
+            raise ValueError("incompatible compressed graph: %s" % path)
+        return cls(arrays)
+
+    @classmethod
+    def load_or_build(cls, road_network, path):
+        """
+        Load the compressed graph saved in directory path, building and saving it first if necessary, see
+        snapshot.load_or_build_arrays().
+
+        :param road_network: the road network
+        :param path: the directory of the compressed graph
+        :type road_network: RoadNetwork
+        :type path: str
+        :return: CompressedGraph
+        """
+        def build():
+            compressed = cls.build(road_network)
+            return {name: getattr(compressed, name) for name in cls.ARRAY_NAMES}
+
+        return cls(load_or_build_arrays(path, cls.ARRAY_NAMES, COMPRESSED_GRAPH_VERSION, build,
+                                        "the compressed road network"))
+
+    def get_shortest_path(self, road_network, s_vid, e_vid):
+        """
+        Return the shortest path from vertex s_vid to vertex e_vid using A* on the compressed graph.
+
+        The search starts from the kept vertices ahead of s_vid and stops at those behind e_vid, guided by the
+        straight-line distance to e_vid, and the super-edges it takes are expanded back into their original edges. If
+        s_vid-->e_vid is unreachable, the Path is empty.
+
+        :param road_network: the road network the graph was built from
+        :param s_vid: int
+        :param e_vid: int
+        :return: Path
+        """
+        return construct_path_by_edges(road_network, s_vid, self.__search(road_network, s_vid, e_vid))
+
+    def __exits(self, v_id):
+        """
+        Return the ways from vertex v_id to the kept vertices ahead of it, as (kept vertex, cost, super-edge, position
+        of the first original edge to take).
+        """
+        if self.kept[v_id]:
+            return [(v_id, 0.0, -1, 0)]
+        exits = []
+        for k in range(self.on_offsets[v_id], self.on_offsets[v_id + 1]):
+            super_id = self.on_super[k]
+            pos = self.on_pos[k]
+            last = self.se_offsets[super_id + 1] - 1
+            exits.append((int(self.se_head[super_id]), float(self.se_prefix[last] - self.se_prefix[pos]), super_id,
+                          pos + 1))
+        return exits
+
+    def __entries(self, v_id):
+        """
+        Return the ways from the kept vertices behind vertex v_id to it, as (kept vertex, cost, super-edge, position
+        of the last original edge to take).
+        """
+        if self.kept[v_id]:
+            return [(v_id, 0.0, -1, 0)]
+        entries = []
+        for k in range(self.on_offsets[v_id], self.on_offsets[v_id + 1]):
+            super_id = self.on_super[k]
+            pos = self.on_pos[k]
+            entries.append((int(self.se_tail[super_id]), float(self.se_prefix[pos]), super_id, pos))
+        return entries
+
+    def __search(self, road_network, s_vid, e_vid):
+        """
+        The multi-source, multi-target A* on the kept vertices.
+
+        :return: the original edges of the shortest path, None if s_vid-->e_vid is unreachable
+        :rtype: list[int]
+        """
+        if not (road_network.has_vertex(s_vid) and road_network.has_vertex(e_vid)):
+            return None
+        if s_vid == e_vid:
+            return []
+
+        exits = self.__exits(s_vid)
+        entries = self.__entries(e_vid)
+        best = float('inf')
+        best_edges = None
+
+        # Both inside the same chain, s_vid before e_vid.
+        for [_, _, s_super, s_pos] in exits:
+            for [_, _, e_super, e_pos] in entries:
+                if s_super == e_super and s_super != -1 and s_pos <= e_pos:
+                    cost = float(self.se_prefix[e_pos] - self.se_prefix[s_pos - 1])
+                    if cost < best:
+                        best = cost
+                        best_edges = self.se_edges[s_pos:e_pos + 1].tolist()
+
+        [e_lat, e_lon] = [road_network.v_lat[e_vid], road_network.v_lon[e_vid]]
+        v_lat = road_network.v_lat
+        v_lon = road_network.v_lon
+
+        def heuristic(v_ids):
+            return great_circle_distance_many(e_lat, e_lon, v_lat[v_ids], v_lon[v_ids]).tolist()
+
+        cost_so_far = dict()
+        came_from = dict()  # kept vertex: (previous kept vertex, super-edge), or (None, index of the exit)
+        for i, [v, cost, _, _] in enumerate(exits):
+            if cost < cost_so_far.get(v, float('inf')):
+                cost_so_far[v] = cost
+                came_from[v] = (None, i)
+        goals = dict()  # kept vertex: index of the entry with the smallest cost
+        for i, [v, cost, _, _] in enumerate(entries):
+            if v not in goals or cost < entries[goals[v]][1]:
+                goals[v] = i
+
+        frontier = IndexedPriorityQueue()
+        start_vids = list(cost_so_far)
+        for v, estimate in zip(start_vids, heuristic(start_vids)):
+            frontier.put(v, cost_so_far[v] + estimate)
+
+        goal = None
+        while not frontier.empty() and frontier.elements[0][0] < best:
+            current = frontier.get()
+            current_cost = cost_so_far[current]
+            if current in goals and current_cost + entries[goals[current]][1] < best:
+                best = current_cost + entries[goals[current]][1]
+                goal = current
+
+            lo = self.offsets[current]
+            hi = self.offsets[current + 1]
+            relaxed = []
+            for neighbor, weight, super_id in zip(self.targets[lo:hi].tolist(), self.weights[lo:hi].tolist(),
+                                                  self.super_ids[lo:hi].tolist()):
+                new_cost = current_cost + weight
+                if new_cost < cost_so_far.get(neighbor, float('inf')):
+                    cost_so_far[neighbor] = new_cost    # relax
+                    came_from[neighbor] = (current, super_id)
+                    relaxed.append(neighbor)
+            for neighbor, estimate in zip(relaxed, heuristic(relaxed)):
+                frontier.put(neighbor, cost_so_far[neighbor] + estimate)
+
+        if goal is None:
+            return best_edges
+
+        # Expand the super-edges, from the goal back to the exit of s_vid.
+        [_, _, e_super, e_pos] = entries[goals[goal]]
+        pieces = [] if e_super == -1 else [self.se_edges[self.se_offsets[e_super]:e_pos + 1]]
+        current = goal
+        while came_from[current][0] is not None:
+            [current, super_id] = came_from[current]
+            pieces.append(self.se_edges[self.se_offsets[super_id]:self.se_offsets[super_id + 1]])
+        [_, _, s_super, s_pos] = exits[came_from[current][1]]
+        if s_super != -1:
+            pieces.append(self.se_edges[s_pos:self.se_offsets[s_super + 1]])
+        pieces.reverse()
+        return np.concatenate(pieces).tolist() if len(pieces) != 0 else []
@@ -13,12 +13,14 @@ MAX_INT = 0x3f3f3f3f  # the value to represent a very large integer
 # === For GeoComputing ===
 R = 6371.0 * 10**3  # radius of the Earth in meters
 PRECISION = 5     # The precision of GeoHash encoding
+GRID_ROW_CACHE_SIZE = 256  # the number of grid distance matrix rows kept in memory in the lazy mode
 
 
 # === The basic setting of taxi ===
 NUM_TAXI = 2980      # the number of taxis
 AVERAGE_SPEED = 7.0    # average speed of taxis, unit: m/s (7 m/s = 25.2 km/h)
 TAXI_CAPACITY = 1    # maximum number of passengers that a taxi can hold
+ETA_EXPIRY_SLACK = 60  # a taxi not in a grid this long after its ETA leaves the grid's taxi list, unit: s
 
 
 # === The basic setting of passenger ===
@@ -8,6 +8,7 @@ Description: This module contains the customized container used in this project.
 
 import collections
 import heapq
+import sys
 
 
 class Queue:
@@ -38,6 +39,209 @@ class PriorityQueue:
         return heapq.heappop(self.elements)[1]
 
 
+class IndexedPriorityQueue:
+    """
+    A binary min-heap which holds an item at most once and supports decrease-key.
+
+    The position of every item in the heap is kept in a dict, so putting an item which is already in the queue with a
+    smaller priority moves it up in place instead of pushing a duplicate entry. A search which uses it pops each vertex
+    exactly once per (re)insertion, and never has to skip stale entries.
+
+    >>> queue = IndexedPriorityQueue()
+    >>> queue.put('a', 3.0)
+    >>> queue.put('b', 2.0)
+    >>> queue.put('a', 1.0)
+    >>> queue.put('b', 5.0)  # not smaller, ignored
+    >>> len(queue), queue.priority('b')
+    (2, 2.0)
+    >>> queue.get(), queue.get(), queue.empty()
+    ('a', 'b', True)
+    """
+    def __init__(self):
+        self.elements = []  # [priority, item] in heap order
+        self.position = dict()
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __contains__(self, item):
+        return item in self.position
+
+    def empty(self):
+        return len(self.elements) == 0
+
+    def priority(self, item):
+        return self.elements[self.position[item]][0]
+
+    def put(self, item, priority):
+        """
+        Insert item, or decrease its priority if it is already in the queue with a larger one.
+
+        :param item: a hashable item
+        :param priority: the priority
+        :return: None
+        """
+        i = self.position.get(item)
+        if i is None:
+            i = len(self.elements)
+            self.elements.append([priority, item])
+        elif priority < self.elements[i][0]:
+            self.elements[i][0] = priority
+        else:
+            return
+        self.__sift_up(i)
+
+    def get(self):
+        """
+        Remove and return the item with the smallest priority.
+        """
+        elements = self.elements
+        [priority, item] = elements[0]
+        del self.position[item]
+        last = elements.pop()
+        if len(elements) != 0:
+            elements[0] = last
+            self.position[last[1]] = 0
+            self.__sift_down(0)
+        return item
+
+    def __sift_up(self, i):
+        elements = self.elements
+        position = self.position
+        entry = elements[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if elements[parent][0] <= entry[0]:
+                break
+            elements[i] = elements[parent]
+            position[elements[i][1]] = i
+            i = parent
+        elements[i] = entry
+        position[entry[1]] = i
+
+    def __sift_down(self, i):
+        elements = self.elements
+        position = self.position
+        size = len(elements)
+        entry = elements[i]
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and elements[child + 1][0] < elements[child][0]:
+                child += 1
+            if entry[0] <= elements[child][0]:
+                break
+            elements[i] = elements[child]
+            position[elements[i][1]] = i
+            i = child
+        elements[i] = entry
+        position[entry[1]] = i
+
+
+class LRUCache:
+    """
+    A dict-like cache which holds at most capacity items. When it is full, the least recently used item is evicted.
+
+    If max_size is given, the items are also evicted while the total sizeof(value) of the items is beyond it, e.g. to
+    bound the memory of the cache rather than the number of items. The numbers of hits, misses and evictions are kept
+    in the attributes of the same names.
+    """
+    def __init__(self, capacity, max_size=None, sizeof=sys.getsizeof):
+        self.capacity = capacity
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0  # the total sizeof(value), if max_size is given
+        self.elements = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __contains__(self, key):
+        return key in self.elements
+
+    def get(self, key, default=None):
+        if key not in self.elements:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self.elements.pop(key)
+        self.elements[key] = value  # mark as the most recently used
+        return value
+
+    def put(self, key, value):
+        if key in self.elements:
+            self.__discard(self.elements.pop(key))
+        self.elements[key] = value
+        if self.max_size is not None:
+            self.size += self.sizeof(value)
+        while len(self.elements) > self.capacity or (self.max_size is not None and self.size > self.max_size):
+            self.__discard(self.elements.popitem(last=False)[1])
+            self.evictions += 1
+
+    def clear(self):
+        self.elements.clear()
+        self.size = 0
+
+    def __discard(self, value):
+        if self.max_size is not None:
+            self.size -= self.sizeof(value)
+
+
+class TimingWheel:
+    """
+    A hashed timing wheel.
+
+    An item is scheduled at an integer time and put into the slot (time mod num_slots). advance() walks the slots
+    passed since the last call and collects the items that are due, so scheduling is O(1) and expiring is proportional
+    to the number of slots passed plus the number of items in them.
+    """
+    def __init__(self, num_slots):
+        self.slots = [[] for _ in range(num_slots)]
+        self.current_time = None  # the earliest time whose slot has not been collected yet
+
+    def schedule(self, time, item):
+        time = int(time)
+        if self.current_time is not None and time < self.current_time:
+            time = self.current_time  # already due, collected by the next advance()
+        self.slots[time % len(self.slots)].append((time, item))
+
+    def advance(self, now):
+        """
+        Return the items scheduled at or before now, and remove them from the wheel.
+
+        :param now: int
+        :return: list
+
+        An item is collected at its time, also if it was scheduled more than num_slots ticks ahead or if advance()
+        skips a few rounds of the wheel at once:
+
+        >>> wheel = TimingWheel(4)
+        >>> for time, item in [(2, 'a'), (3, 'b'), (9, 'c'), (13, 'd'), (30, 'e')]:
+        ...     wheel.schedule(time, item)
+        >>> [wheel.advance(now) for now in [1, 2, 5, 8, 9]]
+        [[], ['a'], ['b'], [], ['c']]
+        >>> wheel.schedule(7, 'f')
+        >>> wheel.advance(10), wheel.advance(29), wheel.advance(30), wheel.advance(100)
+        (['f'], ['d'], ['e'], [])
+        """
+        if self.current_time is None:
+            self.current_time = min(item[0] for slot in self.slots for item in slot) if any(self.slots) else now
+        due = []
+        num_slots = min(now - self.current_time + 1, len(self.slots))
+        for k in range(num_slots):
+            slot = self.slots[(self.current_time + k) % len(self.slots)]
+            if len(slot) == 0:
+                continue
+            due.extend(item for (time, item) in slot if time <= now)
+            slot[:] = [(time, item) for (time, item) in slot if time > now]
+        self.current_time = max(self.current_time, now + 1)
+        return due
+
+
 class _LinkedListNode:
     """
     Class for a node in the LinkedList.
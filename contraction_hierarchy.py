@@ -0,0 +1,410 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the Contraction Hierarchies (CH) routing engine, an alternative to the A* search of
+road_network.get_shortest_path() for point-to-point queries.
+
+In the offline preprocessing, the vertices are contracted one by one in the order of their importance (edge difference
+plus the number of contracted neighbors). Contracting a vertex v removes it from the graph and adds a shortcut u-->w
+for every pair of neighbors whose shortest path runs through v, which is checked by a bounded "witness" search. The
+result is an upward graph (edges to a higher ranked vertex) and a backward upward graph (edges from a higher ranked
+vertex), both stored in CSR form. A shortcut remembers the contracted vertex it bypasses and an edge of the road network
+its id, so a path is unpacked back into the edges of the road network.
+
+A query is a bidirectional Dijkstra which only goes upward from both ends. It settles a few hundred vertices instead of
+a large part of the city.
+
+=== Constants ===
+CH_DIR: str
+    The name of the directory of the contraction hierarchy, inside the road-network snapshot (see snapshot.py).
+CH_VERSION: int
+    The version of the saved format; a contraction hierarchy saved in another version is built again.
+WITNESS_SETTLE_LIMIT: int
+    The maximum number of vertices settled by a witness search. If it is reached, the shortcut is added anyway, which
+    keeps the hierarchy correct at the cost of a few superfluous shortcuts.
+"""
+
+
+import numpy as np
+
+from road_network import RoadNetwork, Path, construct_path_by_edges
+from container import IndexedPriorityQueue
+from snapshot import save_arrays, load_arrays, load_or_build_arrays
+
+
+CH_DIR = "contraction_hierarchy"
+CH_VERSION = 1
+WITNESS_SETTLE_LIMIT = 500
+
+
+class ContractionHierarchy:
+    """
+    The preprocessed road network of the Contraction Hierarchies engine.
+
+    The edges of the upward graph are indexed by fwd_offsets, the edges of the backward upward graph by bwd_offsets.
+    For a vertex v, fwd_targets[fwd_offsets[v]:fwd_offsets[v + 1]] are the vertices w with an edge v-->w and
+    rank[w] > rank[v], and bwd_targets[bwd_offsets[v]:bwd_offsets[v + 1]] are the vertices u with an edge u-->v and
+    rank[u] > rank[v]. The middle array holds the bypassed vertex of a shortcut, and -1 - e_id for the edge e_id of the
+    road network.
+
+    On a two-way line, a vertex contracted between two neighbors of higher rank has no witness path, so the neighbors
+    are joined by a shortcut which bypasses it, in both directions. The weight of a shortcut is the length of the line
+    between its ends, and an unpacked path runs along the edges of the line:
+
+    >>> from road_network import make_grid_network
+    >>> line = RoadNetwork()
+    >>> line.add_vertices(range(5), [39.9] * 5, [116.3 + 0.001 * v for v in range(5)])
+    >>> line.add_edges(range(8), range(4) + range(1, 5), range(1, 5) + range(4), [100.0] * 8)
+    >>> ch = ContractionHierarchy.build(line)
+    >>> def shortcuts(offsets, targets, middle, weights):
+    ...     lower = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    ...     k = middle >= 0
+    ...     return zip(lower[k].tolist(), targets[k].tolist(), middle[k].tolist(), weights[k].tolist())
+    >>> found = (shortcuts(ch.fwd_offsets, ch.fwd_targets, ch.fwd_middle, ch.fwd_weights) +
+    ...          shortcuts(ch.bwd_offsets, ch.bwd_targets, ch.bwd_middle, ch.bwd_weights))
+    >>> len(found) == ch.num_shortcuts() > 0
+    True
+    >>> all(ch.rank[m] < ch.rank[v] < ch.rank[w] and weight == 100.0 * abs(v - w) for v, w, m, weight in found)
+    True
+    >>> path = ch.get_shortest_path(line, 4, 0)
+    >>> path.vertex_list, path.edge_list, path.distance
+    ((4, 3, 2, 1, 0), (7, 6, 5, 4), 400.0)
+
+    A witness search that gives up early only adds superfluous shortcuts, the distances stay the same:
+
+    >>> road_network = make_grid_network(6, 6, shape_points=1)
+    >>> ch = ContractionHierarchy.build(road_network)
+    >>> hasty = ContractionHierarchy.build(road_network, witness_settle_limit=2)
+    >>> ch.num_shortcuts() < hasty.num_shortcuts()
+    True
+    >>> pairs = [(s, e) for s in range(0, road_network.num_vertex, 7) for e in range(road_network.num_vertex)]
+    >>> np.allclose([hasty.get_distance(s, e) for s, e in pairs], [ch.get_distance(s, e) for s, e in pairs])
+    True
+    """
+
+    ARRAY_NAMES = ('rank',
+                   'fwd_offsets', 'fwd_targets', 'fwd_weights', 'fwd_middle',
+                   'bwd_offsets', 'bwd_targets', 'bwd_weights', 'bwd_middle')
+
+    def __init__(self, arrays):
+        """
+        Initialize a ContractionHierarchy from its arrays, see ContractionHierarchy.build().
+
+        :param arrays: dict[str, numpy.ndarray]
+        :return: None
+        """
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def __str__(self):
+        return "ContractionHierarchy:\n- number of vertexes: {}\n- number of upward edges: {}"\
+            .format(int(np.sum(self.rank >= 0)), len(self.fwd_targets) + len(self.bwd_targets))
+
+    @classmethod
+    def build(cls, road_network, witness_settle_limit=WITNESS_SETTLE_LIMIT):
+        """
+        Preprocess a road network.
+
+        This runs once per road network and takes a while (tens of minutes on the full city), so the result is meant
+        to be saved, see load_or_build().
+
+        :param road_network: the road network
+        :param witness_settle_limit: the maximum number of vertices settled by a witness search
+        :type road_network: RoadNetwork
+        :type witness_settle_limit: int
+        :return: ContractionHierarchy
+        """
+        road_network.pack()
+        arrays = road_network.to_arrays()
+        offsets = arrays['offsets']
+        targets = arrays['targets'].tolist()
+        edge_ids = arrays['edge_ids'].tolist()
+        weights = arrays['weights'].tolist()
+        num_slot = len(offsets) - 1
+
+        # The remaining graph, as adjacency dicts of (neighbor: [weight, middle]).
+        out_adj = [dict() for _ in range(num_slot)]
+        in_adj = [dict() for _ in range(num_slot)]
+        for v in np.flatnonzero(arrays['v_exists']).tolist():
+            for k in range(offsets[v], offsets[v + 1]):
+                w = targets[k]
+                if w != v:
+                    out_adj[v][w] = [weights[k], -1 - edge_ids[k]]
+                    in_adj[w][v] = [weights[k], -1 - edge_ids[k]]
+
+        rank = np.full(num_slot, -1, dtype=np.int64)
+        deleted_neighbors = [0] * num_slot
+        fwd_edges = [[] for _ in range(num_slot)]  # (w, weight, middle) for the upward edges v-->w
+        bwd_edges = [[] for _ in range(num_slot)]  # (u, weight, middle) for the upward edges u-->v
+
+        def find_shortcuts(v):
+            """
+            Return the shortcuts (u, w, weight) needed if vertex v is contracted.
+            """
+            shortcuts = []
+            out_items = [(w, item[0]) for w, item in out_adj[v].items()]
+            for u, in_item in in_adj[v].items():
+                candidates = [(w, in_item[0] + weight) for w, weight in out_items if w != u]
+                if len(candidates) == 0:
+                    continue
+                max_cost = max(cost for w, cost in candidates)
+                cost_so_far = witness_search(u, v, max_cost)
+                for w, cost in candidates:
+                    if cost_so_far.get(w, float('inf')) > cost:
+                        shortcuts.append((u, w, cost))
+            return shortcuts
+
+        def witness_search(source, avoid, max_cost):
+            """
+            A Dijkstra from source which skips vertex avoid and stops beyond max_cost or witness_settle_limit.
+            """
+            cost_so_far = {source: 0.0}
+            num_settled = 0
+            frontier = IndexedPriorityQueue()
+            frontier.put(source, 0.0)
+            while not frontier.empty() and num_settled < witness_settle_limit:
+                current = frontier.get()
+                num_settled += 1
+                current_cost = cost_so_far[current]
+                if current_cost > max_cost:
+                    break
+                for neighbor, item in out_adj[current].items():
+                    if neighbor == avoid:
+                        continue
+                    new_cost = current_cost + item[0]
+                    if new_cost < cost_so_far.get(neighbor, float('inf')):
+                        cost_so_far[neighbor] = new_cost
+                        frontier.put(neighbor, new_cost)
+            return cost_so_far
+
+        def importance(v):
+            num_shortcuts = len(find_shortcuts(v))
+            return num_shortcuts - len(in_adj[v]) - len(out_adj[v]) + deleted_neighbors[v]
+
+        # Order the vertices with lazy updates: a popped vertex is re-evaluated and contracted only if it is still the
+        # least important one.
+        queue = IndexedPriorityQueue()
+        for v in np.flatnonzero(arrays['v_exists']).tolist():
+            queue.put(v, importance(v))
+
+        next_rank = 0
+        while not queue.empty():
+            v = queue.get()
+            priority = importance(v)
+            if not queue.empty() and priority > queue.elements[0][0]:
+                queue.put(v, priority)
+                continue
+
+            for u, w, cost in find_shortcuts(v):
+                if w not in out_adj[u] or cost < out_adj[u][w][0]:
+                    out_adj[u][w] = [cost, v]
+                    in_adj[w][u] = [cost, v]
+
+            # The remaining edges of v all lead to vertices of a higher rank.
+            for w, item in out_adj[v].items():
+                fwd_edges[v].append((w, item[0], item[1]))
+                del in_adj[w][v]
+                deleted_neighbors[w] += 1
+            for u, item in in_adj[v].items():
+                bwd_edges[v].append((u, item[0], item[1]))
+                del out_adj[u][v]
+                deleted_neighbors[u] += 1
+            out_adj[v] = dict()
+            in_adj[v] = dict()
+
+            rank[v] = next_rank
+            next_rank += 1
+
+        arrays = {'rank': rank}
+        for prefix, edges in (('fwd', fwd_edges), ('bwd', bwd_edges)):
+            arrays[prefix + '_offsets'] = np.concatenate(([0], np.cumsum([len(item) for item in edges])))\
+                .astype(np.int64)
+            flat = [edge for item in edges for edge in item]
+            arrays[prefix + '_targets'] = np.array([edge[0] for edge in flat], dtype=np.int64)
+            arrays[prefix + '_weights'] = np.array([edge[1] for edge in flat], dtype=np.float64)
+            arrays[prefix + '_middle'] = np.array([edge[2] for edge in flat], dtype=np.int64)
+        return cls(arrays)
+
+    def num_shortcuts(self):
+        """
+        Return the number of shortcuts, i.e. the upward edges which are not edges of the road network.
+
+        :return: int
+        """
+        return int(np.count_nonzero(self.fwd_middle >= 0) + np.count_nonzero(self.bwd_middle >= 0))
+
+    def save(self, path):
+        """
+        Save the contraction hierarchy to directory path, see snapshot.save_arrays().
+
+        :param path: str
+        :return: None
+        """
+        save_arrays({name: getattr(self, name) for name in self.ARRAY_NAMES}, {'version': CH_VERSION}, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a contraction hierarchy saved by save(). The arrays are memory-mapped read-only.
+
+        :param path: str
+        :return: ContractionHierarchy
+        """
+        [arrays, meta] = load_arrays(path, cls.ARRAY_NAMES)
+        if meta['version'] != CH_VERSION:
+            raise ValueError("incompatible contraction hierarchy: %s" % path)
+        return cls(arrays)
+
+    @classmethod
+    def load_or_build(cls, road_network, path):
+        """
+        Load the contraction hierarchy saved in directory path, building and saving it first if necessary, see
+        snapshot.load_or_build_arrays().
+
+        :param road_network: the road network
+        :param path: the directory of the contraction hierarchy
+        :type road_network: RoadNetwork
+        :type path: str
+        :return: ContractionHierarchy
+        """
+        def build():
+            ch = cls.build(road_network)
+            return {name: getattr(ch, name) for name in cls.ARRAY_NAMES}
+
+        return cls(load_or_build_arrays(path, cls.ARRAY_NAMES, CH_VERSION, build,
+                                        "the contraction hierarchy (will take a while)"))
+
+    def get_shortest_path(self, road_network, s_vid, e_vid):
+        """
+        Return the shortest path from vertex s_vid to vertex e_vid.
+
+        The upward searches from both ends meet at the highest ranked vertex of the path, and every shortcut on the way
+        is unpacked through its middle vertex down to the edges of the road network. If s_vid-->e_vid is unreachable,
+        the Path is empty.
+
+        :param road_network: the road network the hierarchy was built from
+        :param s_vid: int
+        :param e_vid: int
+        :return: Path
+        """
+        [v_meet, distance, fwd_came_from, bwd_came_from] = self.__search(s_vid, e_vid)
+        if v_meet is None:
+            return construct_path_by_edges(road_network, s_vid, None)
+
+        # The up-down sequence of the (possibly shortcut) edges, as (u, w, middle).
+        up_down = []
+        current = v_meet
+        while fwd_came_from[current] is not None:
+            [parent, middle] = fwd_came_from[current]
+            up_down.append((parent, current, middle))
+            current = parent
+        up_down.reverse()
+        current = v_meet
+        while bwd_came_from[current] is not None:
+            [child, middle] = bwd_came_from[current]
+            up_down.append((current, child, middle))
+            current = child
+
+        return construct_path_by_edges(road_network, s_vid, self.__unpack(up_down))
+
+    def get_distance(self, s_vid, e_vid):
+        """
+        Return the length of the shortest path from vertex s_vid to vertex e_vid, without unpacking it.
+
+        :param s_vid: int
+        :param e_vid: int
+        :return: the length, float('inf') if s_vid-->e_vid is unreachable
+        :rtype: float
+        """
+        return self.__search(s_vid, e_vid)[1]
+
+    def __search(self, s_vid, e_vid):
+        """
+        The bidirectional upward Dijkstra.
+
+        A direction stops once the smallest key of its queue is not smaller than the best meeting cost found so far,
+        since no path through the vertices left in that queue can be shorter.
+
+        :param s_vid: int
+        :param e_vid: int
+        :return: the meeting vertex (None if unreachable), the distance and the (parent, middle) dicts of the two
+        directions
+        :rtype: [int, float, dict, dict]
+        """
+        costs = [{s_vid: 0.0}, {e_vid: 0.0}]
+        came_from = [{s_vid: None}, {e_vid: None}]
+        graphs = [(self.fwd_offsets, self.fwd_targets, self.fwd_weights, self.fwd_middle),
+                  (self.bwd_offsets, self.bwd_targets, self.bwd_weights, self.bwd_middle)]
+        frontiers = [IndexedPriorityQueue(), IndexedPriorityQueue()]
+        frontiers[0].put(s_vid, 0.0)
+        frontiers[1].put(e_vid, 0.0)
+
+        best = float('inf')
+        v_meet = None
+        if s_vid == e_vid:
+            best = 0.0
+            v_meet = s_vid
+
+        while True:
+            active = [k for k in (0, 1) if not frontiers[k].empty() and frontiers[k].elements[0][0] < best]
+            if len(active) == 0:
+                break
+            # Advance the direction with the smaller key.
+            k = min(active, key=lambda item: frontiers[item].elements[0][0])
+            current = frontiers[k].get()
+
+            current_cost = costs[k][current]
+            other_cost = costs[1 - k].get(current)
+            if other_cost is not None and current_cost + other_cost < best:
+                best = current_cost + other_cost
+                v_meet = current
+
+            [offsets, targets, weights, middles] = graphs[k]
+            lo = offsets[current]
+            hi = offsets[current + 1]
+            for neighbor, weight, middle in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist(),
+                                                middles[lo:hi].tolist()):
+                new_cost = current_cost + weight
+                if new_cost < costs[k].get(neighbor, float('inf')):
+                    costs[k][neighbor] = new_cost    # relax
+                    came_from[k][neighbor] = [current, middle]
+                    frontiers[k].put(neighbor, new_cost)
+                    other_cost = costs[1 - k].get(neighbor)
+                    if other_cost is not None and new_cost + other_cost < best:
+                        best = new_cost + other_cost
+                        v_meet = neighbor
+
+        return [v_meet, best, came_from[0], came_from[1]]
+
+    def __find_middle(self, offsets, targets, middles, v, target):
+        """
+        Return the middle of the upward edge between v and target, stored at v.
+        """
+        lo = offsets[v]
+        hi = offsets[v + 1]
+        k = targets[lo:hi].tolist().index(target)
+        return int(middles[lo + k])
+
+    def __unpack(self, up_down):
+        """
+        Expand the shortcuts of a sequence of edges into the edges of the road network.
+
+        A shortcut u-->w bypassing the middle vertex m stands for u-->m, which is stored in the backward upward graph of
+        m, followed by m-->w, which is stored in the upward graph of m.
+
+        :param up_down: list[(int, int, int)]
+        :return: the ids of the edges
+        :rtype: list[int]
+        """
+        edges = []
+        stack = list(reversed(up_down))
+        while len(stack) != 0:
+            [u, w, middle] = stack.pop()
+            if middle < 0:
+                edges.append(-1 - middle)
+                continue
+            first = self.__find_middle(self.bwd_offsets, self.bwd_targets, self.bwd_middle, middle, u)
+            second = self.__find_middle(self.fwd_offsets, self.fwd_targets, self.fwd_middle, middle, w)
+            stack.append((middle, w, second))
+            stack.append((u, middle, first))
+        return edges
@@ -9,13 +9,15 @@ Description: This module contains the interfaces for taxi dispatching.
 """
 
 
-from location import get_distance
-from road_network import RoadNetwork
+import numpy as np
+
+from location import get_distance, great_circle_distance_many
+from road_network import RoadNetwork, one_to_many_distance
 from spatio_temporal_index import SpatioTemporalDatabase
 from query import Query
 # from taxi import Taxi
 from container import Queue
-from constants import MAX_INT
+from constants import MAX_INT, AVERAGE_SPEED
 
 
 class Dispatcher:
@@ -24,7 +26,9 @@ class Dispatcher:
                  failed_queries=None,
                  waiting_queries=None,
                  completed_queries=None,
-                 cancelled_queries=None):
+                 cancelled_queries=None,
+                 road_distance=False,
+                 distance_oracle=None):
         """
         Initialize a Dispatcher.
 
@@ -33,10 +37,15 @@ class Dispatcher:
         :param waiting_queries: a dict stores the queries that are dispatched a taxi and under waiting
         :param completed_queries: a list stores successfully completed queries
         :param cancelled_queries: a list stores cancelled queries
+        :param road_distance: if the nearest taxi is picked by road distance, otherwise by straight-line distance
+        :param distance_oracle: the oracle of the road distance between two vertices (e.g. HubLabels); if None, the
+        road distances are found by a bounded search from the pickup location, see road_network.one_to_many_distance()
         :type failed_queries: Queue[Query]
         :type waiting_queries: dict[int, Query]
         :type completed_queries: list[Query]
         :type cancelled_queries: list[Query]
+        :type road_distance: bool
+        :type distance_oracle: HubLabels
         :return: None
         """
 
@@ -60,6 +69,9 @@ class Dispatcher:
         else:
             self.cancelled_queries = cancelled_queries
 
+        self.road_distance = road_distance
+        self.distance_oracle = distance_oracle
+
     def dispatch_taxi(self, timestamp, query, database, taxi_set, road_network):
         """
         Respond to the query and try to dispatch a taxi for the query.
@@ -79,7 +91,7 @@ class Dispatcher:
         """
 
         candi_taxi_list = self.__single_side_search(timestamp, query, database)
-        if self.__schedule(query, candi_taxi_list, taxi_set, road_network):
+        if self.__schedule(timestamp, query, candi_taxi_list, taxi_set, road_network):
             self.add_waiting_query(query)
         else:
             self.add_failed_query(query)
@@ -131,6 +143,10 @@ class Dispatcher:
         """
         Single-side taxi searching.
 
+        With a GeoHashHierarchy in the database, the candidates are the taxis within the straight-line distance that
+        a taxi can drive at AVERAGE_SPEED before the end of the pickup window, closest first. Otherwise, they are the
+        taxis of the grid cells of the temporal grid list of the origin that arrive in time.
+
         :param timestamp: current time of the simulation system
         :param query: the query
         :param database: the spatio-temporal database
@@ -141,34 +157,41 @@ class Dispatcher:
         :rtype: list[int]
         """
 
-        o_grid = query.o_geohash
+        if database.hierarchy is not None:
+            radius = (query.pickup_window.late - timestamp) * AVERAGE_SPEED
+            return database.hierarchy.search(query.origin.lat, query.origin.lon, radius)[0]
+
+        o_grid = database.get_geohash(query.origin)
         candi_taxi_list = []
 
-        for item in database.grid[o_grid].temporal_grid_list:
+        for item in database.get_temporal_grid_list(o_grid):
             if item[1] + timestamp > query.pickup_window.late:
                 break
 
             grid_id = item[0]
             grid = database.grid[grid_id]
 
-            # scan the taxi list of the grid and filter the taxis that satisfies the pickup time window
-            for taxi_id in grid.taxi_list:
-                eta = grid.taxi_list[taxi_id]  # arrival time of the taxi that comes into the gird in the near future
-                if item[1] + eta <= query.pickup_window.late:
-                    candi_taxi_list.append(taxi_id)
+            # The taxi list is ordered by the arrival time of the taxis, so only the taxis that satisfy the pickup time
+            # window are touched.
+            candi_taxi_list.extend(grid.taxi_list.arriving_before(query.pickup_window.late - item[1]))
         return candi_taxi_list
 
-    def __schedule(self, query, candi_taxi_list, taxi_set, road_network):
+    def __schedule(self, timestamp, query, candi_taxi_list, taxi_set, road_network):
         """
         Taxi scheduling.
 
         The purpose of scheduling is to insert the origin and destination (ScheduleNode) of the query into the schedule
         of the taxi which satisfies the query with minimum additional travel distance.
 
+        With a road distance, the query is not dispatched if no taxi can reach the origin before the end of the pickup
+        window.
+
+        :param timestamp: current time of the simulation system
         :param query: the query
         :param candi_taxi_list: list of taxi id
         :param taxi_set: the taxi set
         :param road_network: the road network
+        :type timestamp: int
         :type query: Query
         :type candi_taxi_list: list[int]
         :type taxi_set: dict[int, Taxi]
@@ -180,15 +203,27 @@ class Dispatcher:
             return False
 
         picked_taxi_id = candi_taxi_list[0]
-        min_dis = MAX_INT
-        for taxi_id in candi_taxi_list:
-            taxi = taxi_set[taxi_id]
-            if not taxi.is_available():
-                continue
-            dis = get_distance(taxi.location, query.origin)
-            if dis < min_dis:
-                picked_taxi_id = taxi_id
-                min_dis = dis
+        available_taxi_list = [taxi_id for taxi_id in candi_taxi_list if taxi_set[taxi_id].is_available()]
+        if self.road_distance:
+            # A taxi which cannot be at the origin before the end of the pickup window is out of the question, even
+            # when no taxi is available.
+            if len(available_taxi_list) == 0:
+                available_taxi_list = candi_taxi_list
+            max_distance = (query.pickup_window.late - timestamp) * AVERAGE_SPEED
+            dis = self.__road_distances([taxi_set[taxi_id] for taxi_id in available_taxi_list],
+                                        query.o_schedule_node.matched_vid, road_network, max_distance)
+            k = int(np.argmin(dis))
+            if not dis[k] <= max_distance:
+                return False
+            picked_taxi_id = available_taxi_list[k]
+        elif len(available_taxi_list) > 0:
+            # Score all the available taxis at once.
+            lats = [taxi_set[taxi_id].location.lat for taxi_id in available_taxi_list]
+            lons = [taxi_set[taxi_id].location.lon for taxi_id in available_taxi_list]
+            dis = great_circle_distance_many(query.origin.lat, query.origin.lon, lats, lons)
+            k = int(np.argmin(dis))
+            if dis[k] < MAX_INT:
+                picked_taxi_id = available_taxi_list[k]
 
         picked_taxi = taxi_set[picked_taxi_id]
         query.matched_taxi = picked_taxi_id
@@ -197,3 +232,41 @@ class Dispatcher:
         picked_taxi.update_route(road_network)
 
         return True
+
+    def __road_distances(self, taxis, v_id, road_network, max_distance):
+        """
+        Return the road distances from taxis to vertex v_id.
+
+        A taxi on its route, or standing in the middle of an edge (see Taxi.parked_offset), is somewhere on edge
+        taxi.e_id, so its distance is taken from the end of that edge. Other taxis stand on vertex taxi.v_id.
+
+        :param taxis: the taxis
+        :param v_id: the id of the vertex
+        :param road_network: the road network
+        :param max_distance: the distances beyond it are not needed
+        :type taxis: list[Taxi]
+        :type v_id: int
+        :type road_network: RoadNetwork
+        :type max_distance: float
+        :return: the road distances, float('inf') if v_id is unreachable or beyond max_distance
+        :rtype: numpy.ndarray
+        """
+        start_vids = []
+        rests = []
+        for taxi in taxis:
+            if (taxi.route is None or len(taxi.route.edge_list) == 0) and taxi.parked_offset is None:
+                start_vids.append(taxi.v_id)
+                rests.append(0.0)
+            else:
+                end_vid = road_network.get_edge(taxi.e_id).end_vid
+                start_vids.append(end_vid)
+                rests.append(get_distance(taxi.location, road_network.get_location(end_vid)))
+
+        if self.distance_oracle is not None:
+            dis = np.array([self.distance_oracle.road_distance(start_vid, v_id) for start_vid in start_vids])
+        else:
+            # One search backwards from v_id reaches all the taxis.
+            dis = one_to_many_distance(road_network, v_id, start_vids, max_distance, reverse=True)
+        dis = dis + np.array(rests)
+        dis[dis > max_distance] = float('inf')
+        return dis
@@ -0,0 +1,223 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the parallel, resumable builder of the grid distance matrix.
+
+The anchors of the grid cells are split into shards, and the shards are processed by a pool of worker processes. Each
+worker runs a distance-only Dijkstra per anchor, which stops once all the anchors are settled (see
+one_to_many_distance()), so no path is ever reconstructed. The road network is handed to the workers through the fork
+of the pool, so its (possibly memory-mapped) arrays are shared instead of copied.
+
+Every finished shard is written to disk at once. If the computation is interrupted, running it again skips the shards
+that have been completed. The shards are kept until the caller has saved the matrix. The shard directory is keyed by a
+hash of the anchors and of the adjacency arrays of the road network (its topology and its weights), so shards of an
+outdated road network are never reused.
+"""
+
+
+import hashlib
+import os
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from road_network import one_to_many_distance
+from location import great_circle_distance_many
+from spatio_temporal_index import GridDistanceMatrix
+from constants import AVERAGE_SPEED
+
+
+# The state shared with the worker processes, set by _init_worker().
+_road_network = None
+_anchors = None
+
+
+def _init_worker(road_network, anchors):
+    global _road_network, _anchors
+    _road_network = road_network
+    _anchors = anchors
+
+
+def compute_rows(road_network, anchors, rows):
+    """
+    Compute the rows of the grid distance matrix.
+
+    :param road_network: the road network
+    :param anchors: the anchors of the grid cells, in the order of the rows
+    :param rows: the row indexes
+    :type road_network: RoadNetwork
+    :type anchors: numpy.ndarray
+    :type rows: list[int]
+    :return: the spatial distance rows and the temporal distance rows
+    :rtype: [numpy.ndarray, numpy.ndarray]
+    """
+    road_network.pack()
+    lats = road_network.v_lat[anchors]
+    lons = road_network.v_lon[anchors]
+
+    d = np.zeros((len(rows), len(anchors)), dtype=np.float32)
+    t = np.zeros((len(rows), len(anchors)), dtype=np.float32)
+    for k, i in enumerate(rows):
+        cost_so_far = one_to_many_distance(road_network, anchors[i], anchors)
+        d_row = great_circle_distance_many(lats[i], lons[i], lats, lons)
+        # If the anchor of grid[j] is unreachable, the temporal distance falls back to the spatial distance.
+        t_row = np.where(np.isinf(cost_so_far), d_row, cost_so_far) / AVERAGE_SPEED
+        d[k] = d_row
+        t[k] = t_row
+    return [d, t]
+
+
+def _run_shard(args):
+    """
+    Compute a shard and save it to disk.
+
+    :param args: the shard file and the row indexes of the shard
+    :type args: (str, list[int])
+    :return: the shard file
+    :rtype: str
+    """
+    [shard_file, rows] = args
+    [d, t] = compute_rows(_road_network, _anchors, rows)
+    tmp_file = shard_file + ".tmp.npz"
+    np.savez(tmp_file, rows=np.array(rows), d=d, t=t)
+    os.rename(tmp_file, shard_file)
+    return shard_file
+
+
+def shard_key(road_network, geohash_list, anchors):
+    """
+    Return the key of the shards of a grid distance matrix.
+
+    :param road_network: RoadNetwork
+    :param geohash_list: list[str]
+    :param anchors: list[int]
+    :return: str
+
+    The key covers the adjacency of the road network, so rewiring the edges changes it even if the weights stay the
+    same:
+
+    >>> from road_network import RoadNetwork
+    >>> [forward, rewired] = [RoadNetwork(), RoadNetwork()]
+    >>> for road_network, [starts, ends] in [(forward, [[0, 1], [1, 2]]), (rewired, [[0, 2], [2, 1]])]:
+    ...     road_network.add_vertices(range(3), [39.9] * 3, [116.3, 116.301, 116.302])
+    ...     road_network.add_edges([0, 1], starts, ends, [100.0, 100.0])
+    >>> np.array_equal(forward.to_arrays()['weights'], rewired.to_arrays()['weights'])
+    True
+    >>> shard_key(forward, ['wx4g0'], [0]) == shard_key(rewired, ['wx4g0'], [0])
+    False
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(",".join(geohash_list).encode('ascii'))
+    sha1.update(np.asarray(anchors, dtype=np.int64).tobytes())
+    arrays = road_network.to_arrays()
+    for name in ('offsets', 'targets', 'edge_ids', 'weights'):
+        sha1.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return sha1.hexdigest()[:16]
+
+
+def build_grid_distance_matrix(database, road_network, shard_dir, num_processes=None, shard_size=16):
+    """
+    Compute the grid distance matrix of a database in parallel.
+
+    The shards are left in shard_dir, so the caller removes them only once the matrix has been saved.
+
+    :param database: the spatio-temporal database, whose anchors have been determined
+    :param road_network: the road network
+    :param shard_dir: the directory in which the shards are saved
+    :param num_processes: the number of worker processes, all the CPU cores by default
+    :param shard_size: the number of anchors per shard
+    :type database: SpatioTemporalDatabase
+    :type road_network: RoadNetwork
+    :type shard_dir: str
+    :type num_processes: int
+    :type shard_size: int
+    :return: GridDistanceMatrix
+
+    The rows are the distance-only Dijkstra distances between the anchors, divided by AVERAGE_SPEED:
+
+    >>> import shutil
+    >>> import tempfile
+    >>> from road_network import RoadNetwork, make_grid_network, single_source_dijkstra_distance
+    >>> from spatio_temporal_index import SpatioTemporalDatabase, GridCell
+    >>> road_network = make_grid_network(4, 5, one_way=0.0)
+    >>> database = SpatioTemporalDatabase()
+    >>> for k, v_id in enumerate(range(0, road_network.num_vertex, 3)):
+    ...     grid_cell = GridCell('wx4g%d' % k)
+    ...     grid_cell.anchor = v_id
+    ...     database.grid[grid_cell.geohash] = grid_cell
+    >>> geohash_list = sorted(database.grid.keys())
+    >>> anchors = [database.grid[geohash].anchor for geohash in geohash_list]
+    >>> shard_dir = tempfile.mkdtemp()
+    >>> matrix = build_grid_distance_matrix(database, road_network, shard_dir, num_processes=2, shard_size=3)
+    ... # doctest: +ELLIPSIS
+    0 of 3 shards have been computed before.
+    ...
+    >>> all(np.allclose(matrix.t[i], single_source_dijkstra_distance(road_network, anchor)[anchors] / AVERAGE_SPEED)
+    ...     for i, anchor in enumerate(anchors))
+    True
+
+    The shards stay on disk, and a run interrupted before its last shard only computes that one again. Here the
+    temporal distances of the first shard are doubled on disk, to tell it apart:
+
+    >>> key = shard_key(road_network, geohash_list, anchors)
+    >>> sorted(os.listdir(os.path.join(shard_dir, key)))
+    ['shard_00000.npz', 'shard_00001.npz', 'shard_00002.npz']
+    >>> os.remove(os.path.join(shard_dir, key, "shard_00002.npz"))
+    >>> [d, t] = compute_rows(road_network, np.array(anchors), [0, 1, 2])
+    >>> np.savez(os.path.join(shard_dir, key, "shard_00000.npz"), rows=np.array([0, 1, 2]), d=d, t=2 * t)
+    >>> resumed = build_grid_distance_matrix(database, road_network, shard_dir, num_processes=2, shard_size=3)
+    ... # doctest: +ELLIPSIS
+    2 of 3 shards have been computed before.
+    ...
+    >>> np.array_equal(resumed.t[:3], 2 * matrix.t[:3]), np.array_equal(resumed.t[3:], matrix.t[3:])
+    (True, True)
+
+    Once the edge weights change, the shards of the former road network are not reused:
+
+    >>> arrays = dict(road_network.to_arrays())
+    >>> arrays['weights'] = arrays['weights'] * 2
+    >>> slower_network = RoadNetwork.from_arrays(arrays)
+    >>> shard_key(slower_network, geohash_list, anchors) != key
+    True
+    >>> slower = build_grid_distance_matrix(database, slower_network, shard_dir, num_processes=2, shard_size=3)
+    ... # doctest: +ELLIPSIS
+    0 of 3 shards have been computed before.
+    ...
+    >>> np.allclose(slower.t, 2 * matrix.t)
+    True
+    >>> shutil.rmtree(shard_dir)
+    """
+    import time
+
+    geohash_list = sorted(database.grid.keys())
+    anchors = [database.grid[geohash].anchor for geohash in geohash_list]
+    shard_dir = os.path.join(shard_dir, shard_key(road_network, geohash_list, anchors))
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+
+    shards = []
+    for k, lo in enumerate(range(0, len(anchors), shard_size)):
+        shard_file = os.path.join(shard_dir, "shard_%05d.npz" % k)
+        shards.append((shard_file, list(range(lo, min(lo + shard_size, len(anchors))))))
+    todo = [shard for shard in shards if not os.path.isfile(shard[0])]
+    print("%d of %d shards have been computed before." % (len(shards) - len(todo), len(shards)))
+
+    if len(todo) != 0:
+        if num_processes is None:
+            num_processes = cpu_count()
+        start_time = time.time()
+        pool = Pool(num_processes, initializer=_init_worker, initargs=(road_network, np.array(anchors)))
+        try:
+            for cnt, shard_file in enumerate(pool.imap_unordered(_run_shard, todo)):
+                print("Shard %d/%d done (%s). Elapsed time is %f seconds."
+                      % (cnt + 1, len(todo), os.path.basename(shard_file), time.time() - start_time))
+        finally:
+            pool.close()
+            pool.join()
+
+    matrix = GridDistanceMatrix(geohash_list)
+    for [shard_file, rows] in shards:
+        shard = np.load(shard_file)
+        matrix.d[shard['rows']] = shard['d']
+        matrix.t[shard['rows']] = shard['t']
+    return matrix
@@ -0,0 +1,329 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the nearest-edge index of the road network, which snaps a location to the closest
+point of the closest road segment (edge-level map matching).
+
+A pickup on a long arterial is then served where it is, instead of at an intersection which may be hundreds of meters
+away. The edges are straight segments between their end vertices, projected to meters like in VertexIndex, and their
+bounding boxes are bulk-loaded into an R-tree by Sort-Tile-Recursive (STR) packing: the boxes are sorted into
+vertical slices by the x of their centers, each slice is sorted by y, and every run of NODE_CAPACITY boxes becomes a
+node; the nodes are packed the same way, level by level, up to the root. The tree is balanced and the packing is
+a few sorts, so it is built in about a second on the whole road network.
+
+A batch of locations is searched level by level with arrays of (location, node) pairs, all in numpy. A first descent
+into the closest box of each level gives every location a segment close to it, and the search then prunes every node
+whose MINDIST to the location (the distance to its box) is beyond the distance of that segment, or beyond the smallest
+MINMAXDIST of the location (a distance within which a segment is guaranteed, since every side of a tight box touches a
+segment inside it). At the leaves, the locations are projected onto the remaining segments and the closest one is
+kept.
+
+=== Constants ===
+NODE_CAPACITY: int
+    The default maximum number of children of a node of the R-tree.
+CHUNK_SIZE: int
+    The number of locations searched together by EdgeIndex.nearest_edges(), which bounds the size of the pair arrays.
+"""
+
+
+import math
+
+import numpy as np
+
+from road_network import RoadNetwork
+from vertex_index import project_to_meters
+
+
+NODE_CAPACITY = 8
+CHUNK_SIZE = 16384
+
+
+class EdgeIndex:
+    """
+    An STR-packed R-tree of the edges of a road network, in projected meters.
+
+    The segment of the edge at position i is (x0[i], y0[i]) --> (x1[i], y1[i]), e_ids[i] is its id and weights[i] its
+    weight. The nodes of level k (0 for the leaves, len(boxes) - 1 for the root) have the boxes boxes[k] (rows min x,
+    min y, max x, max y), and the children of node j are the positions lo[k][j]:hi[k][j] of the segments (k = 0) or of
+    the nodes of level k - 1.
+
+    The points found are as close as those of a scan of all the edges, also with a mask and for the locations outside
+    the city, and lie at their offsets along their edges:
+
+    >>> from road_network import make_grid_network
+    >>> road_network = make_grid_network(6, 6, shape_points=1)
+    >>> rng = np.random.RandomState(0)
+    >>> lats = rng.uniform(39.895, 39.91, 500)
+    >>> lons = rng.uniform(116.295, 116.31, 500)
+    >>> for vertex_mask in (None, np.arange(road_network.num_vertex) % 3 != 0):
+    ...     index = EdgeIndex(road_network, vertex_mask, node_capacity=2)
+    ...     e_ids = np.flatnonzero(road_network.e_exists)
+    ...     if vertex_mask is not None:
+    ...         e_ids = e_ids[vertex_mask[road_network.e_start[e_ids]] & vertex_mask[road_network.e_end[e_ids]]]
+    ...     [x0, y0] = index.project(road_network.v_lat[road_network.e_start[e_ids]],
+    ...                              road_network.v_lon[road_network.e_start[e_ids]])
+    ...     [x1, y1] = index.project(road_network.v_lat[road_network.e_end[e_ids]],
+    ...                              road_network.v_lon[road_network.e_end[e_ids]])
+    ...     [qx, qy] = [item[:, None] for item in index.project(lats, lons)]
+    ...     ts = np.clip(((qx - x0) * (x1 - x0) + (qy - y0) * (y1 - y0)) / ((x1 - x0) ** 2 + (y1 - y0) ** 2), 0, 1)
+    ...     expected = np.hypot(x0 + ts * (x1 - x0) - qx, y0 + ts * (y1 - y0) - qy).min(axis=1)
+    ...     [found, offsets, distances] = index.nearest_edges(lats, lons)
+    ...     k = np.searchsorted(e_ids, found)
+    ...     ts = offsets / road_network.e_weight[found]
+    ...     points = np.hypot(x0[k] + ts * (x1[k] - x0[k]) - qx[:, 0], y0[k] + ts * (y1[k] - y0[k]) - qy[:, 0])
+    ...     print(bool(np.isin(found, e_ids).all()) and np.allclose(distances, expected) and
+    ...           np.allclose(points, distances))
+    True
+    True
+    """
+
+    def __init__(self, road_network, vertex_mask=None, node_capacity=NODE_CAPACITY):
+        """
+        Build the index of the edges of a road network.
+
+        Only the edges of the CSR adjacency are indexed (one per pair of end vertices, see RoadNetwork.pack()), and
+        only one of the two edges of a two-way road, since they have the same segment.
+
+        :param road_network: the road network
+        :param vertex_mask: if given, only the edges between two vertices v with vertex_mask[v] are indexed, e.g. the
+        vertices of the largest strongly connected component, see ComponentIndex.largest_component()
+        :param node_capacity: the maximum number of children of a node
+        :type road_network: RoadNetwork
+        :type vertex_mask: numpy.ndarray
+        :type node_capacity: int
+        :return: None
+        """
+        road_network.pack()
+        e_ids = np.unique(road_network.edge_ids).astype(np.int64)
+        s_vids = road_network.e_start[e_ids]
+        e_vids = road_network.e_end[e_ids]
+        keep = ~np.isnan(road_network.v_lat[s_vids]) & ~np.isnan(road_network.v_lon[s_vids]) & \
+            ~np.isnan(road_network.v_lat[e_vids]) & ~np.isnan(road_network.v_lon[e_vids])
+        if vertex_mask is not None:
+            keep = keep & vertex_mask[s_vids] & vertex_mask[e_vids]
+        # A two-way road is indexed once, by its edge from the smaller vertex id.
+        num_slot = len(road_network.v_exists)
+        keep = keep & ~((s_vids > e_vids) & np.isin(e_vids.astype(np.int64) * num_slot + s_vids,
+                                                   s_vids.astype(np.int64) * num_slot + e_vids))
+        e_ids = e_ids[keep]
+        s_vids = s_vids[keep]
+        e_vids = e_vids[keep]
+
+        self.node_capacity = int(node_capacity)
+        self.lat0 = float(np.mean(road_network.v_lat[s_vids])) if len(e_ids) != 0 else 0.0
+        self.lon0 = float(np.mean(road_network.v_lon[s_vids])) if len(e_ids) != 0 else 0.0
+        [x0, y0] = self.project(road_network.v_lat[s_vids], road_network.v_lon[s_vids])
+        [x1, y1] = self.project(road_network.v_lat[e_vids], road_network.v_lon[e_vids])
+
+        order = _str_order((x0 + x1) / 2, (y0 + y1) / 2, self.node_capacity)
+        self.e_ids = e_ids[order]
+        self.weights = road_network.e_weight[self.e_ids]
+        self.x0 = x0[order]
+        self.y0 = y0[order]
+        self.x1 = x1[order]
+        self.y1 = y1[order]
+
+        # The boxes of the segments, then of the nodes, packed level by level.
+        boxes = np.array([np.minimum(self.x0, self.x1), np.minimum(self.y0, self.y1),
+                          np.maximum(self.x0, self.x1), np.maximum(self.y0, self.y1)])
+        self.boxes = []
+        self.lo = []
+        self.hi = []
+        while len(self.e_ids) != 0:
+            lo = np.arange(0, boxes.shape[1], self.node_capacity)
+            hi = np.minimum(lo + self.node_capacity, boxes.shape[1])
+            boxes = np.array([np.minimum.reduceat(boxes[0], lo), np.minimum.reduceat(boxes[1], lo),
+                              np.maximum.reduceat(boxes[2], lo), np.maximum.reduceat(boxes[3], lo)])
+            if len(lo) > 1:
+                # The nodes are packed by STR for the next level; their children stay where they are.
+                order = _str_order((boxes[0] + boxes[2]) / 2, (boxes[1] + boxes[3]) / 2, self.node_capacity)
+                [boxes, lo, hi] = [boxes[:, order], lo[order], hi[order]]
+            self.boxes.append(boxes)
+            self.lo.append(lo)
+            self.hi.append(hi)
+            if len(lo) == 1:
+                break
+
+    def __str__(self):
+        return "EdgeIndex:\n- number of edges: {}\n- levels: {}\n- node capacity: {}"\
+            .format(len(self.e_ids), len(self.boxes), self.node_capacity)
+
+    def __len__(self):
+        return len(self.e_ids)
+
+    def project(self, lats, lons):
+        """
+        Project locations to meters around the center of the indexed edges, see vertex_index.project_to_meters().
+
+        :param lats: numpy.ndarray | float
+        :param lons: numpy.ndarray | float
+        :return: x (to the east) and y (to the north) in meters
+        :rtype: [numpy.ndarray, numpy.ndarray]
+        """
+        return project_to_meters(lats, lons, self.lat0, self.lon0)
+
+    def nearest_edge(self, lat, lon):
+        """
+        Return the closest point of the road network to location (lat, lon).
+
+        :param lat: float
+        :param lon: float
+        :return: the id of the edge and the offset of the point from the start of the edge, in the unit of the edge
+        weight; None if the index is empty
+        :rtype: (int, float)
+        """
+        [e_ids, offsets, distances] = self.nearest_edges([lat], [lon])
+        return (int(e_ids[0]), float(offsets[0])) if e_ids[0] >= 0 else None
+
+    def nearest_edges(self, lats, lons):
+        """
+        Return the closest points of the road network to many locations at once.
+
+        :param lats: the latitudes of the locations
+        :param lons: the longitudes of the locations
+        :type lats: list[float] | numpy.ndarray
+        :type lons: list[float] | numpy.ndarray
+        :return: the ids of the edges (-1 if the index is empty), the offsets of the points from the start of the
+        edges (in the unit of the edge weight), and the distances from the locations to the points in meters
+        :rtype: [numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        """
+        [xs, ys] = self.project(lats, lons)
+        xs = np.atleast_1d(xs)
+        ys = np.atleast_1d(ys)
+        e_ids = np.full(len(xs), -1, dtype=np.int64)
+        offsets = np.zeros(len(xs))
+        distances = np.full(len(xs), float('inf'))
+        if len(self.e_ids) == 0:
+            return [e_ids, offsets, distances]
+
+        for start in range(0, len(xs), CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            [positions, ts, distances[chunk]] = self.__search(xs[chunk], ys[chunk])
+            e_ids[chunk] = self.e_ids[positions]
+            offsets[chunk] = ts * self.weights[positions]
+        return [e_ids, offsets, distances]
+
+    def __search(self, xs, ys):
+        """
+        The level-by-level search for the projected locations (xs, ys).
+
+        :return: the positions of the closest segments, the relative positions (0 to 1) of the closest points on them,
+        and the distances
+        :rtype: [numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        """
+        # A first descent into the closest box of each level finds a segment near each location, whose distance
+        # bounds the search.
+        points = np.arange(len(xs))
+        nodes = np.zeros(len(xs), dtype=np.int64)  # the root
+        for k in range(len(self.boxes) - 1, 0, -1):
+            [points, children] = self.__expand(k, points, nodes)
+            dis = _min_dist2(xs[points], ys[points], self.boxes[k - 1][:, children])
+            best = _group_first_min(dis, points)
+            [points, nodes] = [points[best], children[best]]
+        [points, children] = self.__expand(0, points, nodes)
+        bound = _group_min(self.__project(xs, ys, points, children)[1], points)[_group_starts(points)]
+
+        points = np.arange(len(xs))
+        nodes = np.zeros(len(xs), dtype=np.int64)
+        for k in range(len(self.boxes) - 1, 0, -1):
+            [points, children] = self.__expand(k, points, nodes)
+            boxes = self.boxes[k - 1][:, children]
+            px = xs[points]
+            py = ys[points]
+            bound = np.minimum(bound, np.minimum.reduceat(_min_max_dist2(px, py, boxes), _group_starts(points)))
+            keep = _min_dist2(px, py, boxes) <= bound[points]
+            [points, nodes] = [points[keep], children[keep]]
+        [points, children] = self.__expand(0, points, nodes)
+        [ts, dis] = self.__project(xs, ys, points, children)
+        best = _group_first_min(dis, points)
+        return [children[best], ts[best], np.sqrt(dis[best])]
+
+    def __expand(self, k, points, nodes):
+        """
+        Expand the pairs (location, node of level k) to the pairs (location, child). The pairs stay grouped by
+        location.
+
+        :rtype: [numpy.ndarray, numpy.ndarray]
+        """
+        lo = self.lo[k][nodes]
+        lengths = self.hi[k][nodes] - lo
+        starts = np.cumsum(lengths) - lengths
+        return [np.repeat(points, lengths), np.arange(lengths.sum()) - np.repeat(starts - lo, lengths)]
+
+    def __project(self, xs, ys, points, positions):
+        """
+        Project the locations of the pairs (location, segment) onto the segments.
+
+        :return: the relative positions (0 to 1) of the projections on the segments, and their squared distances to the
+        locations
+        :rtype: [numpy.ndarray, numpy.ndarray]
+        """
+        px = xs[points]
+        py = ys[points]
+        x0 = self.x0[positions]
+        y0 = self.y0[positions]
+        dx = self.x1[positions] - x0
+        dy = self.y1[positions] - y0
+        length2 = dx * dx + dy * dy
+        ts = np.clip(((px - x0) * dx + (py - y0) * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        return [ts, (x0 + ts * dx - px) ** 2 + (y0 + ts * dy - py) ** 2]
+
+
+def _str_order(cx, cy, capacity):
+    """
+    Return the Sort-Tile-Recursive order of boxes with centers (cx, cy): ceil(sqrt(P)) vertical slices of the boxes
+    sorted by cx, where P is the number of nodes of capacity boxes, each sorted by cy.
+
+    :rtype: numpy.ndarray
+    """
+    num_node = -(-len(cx) // capacity)
+    slice_size = int(math.ceil(math.sqrt(num_node))) * capacity
+    slices = np.empty(len(cx), dtype=np.int64)
+    slices[np.argsort(cx, kind='mergesort')] = np.arange(len(cx)) // slice_size
+    return np.lexsort((cy, slices))
+
+
+def _min_dist2(xs, ys, boxes):
+    """
+    Return the squared distances from the points to the boxes (rows min x, min y, max x, max y), 0 inside.
+    """
+    dx = np.maximum(np.maximum(boxes[0] - xs, xs - boxes[2]), 0.0)
+    dy = np.maximum(np.maximum(boxes[1] - ys, ys - boxes[3]), 0.0)
+    return dx * dx + dy * dy
+
+
+def _min_max_dist2(xs, ys, boxes):
+    """
+    Return the squared MINMAXDIST from the points to the boxes: the smallest, over the sides of a box, of the
+    distance to the farthest point of the side nearer to the point. Every side of a tight box touches a segment inside
+    it, so some segment is at most this far.
+    """
+    near_x = np.where(xs <= (boxes[0] + boxes[2]) / 2, boxes[0], boxes[2])
+    near_y = np.where(ys <= (boxes[1] + boxes[3]) / 2, boxes[1], boxes[3])
+    far_x = np.where(xs >= (boxes[0] + boxes[2]) / 2, boxes[0], boxes[2])
+    far_y = np.where(ys >= (boxes[1] + boxes[3]) / 2, boxes[1], boxes[3])
+    return np.minimum((xs - near_x) ** 2 + (ys - far_y) ** 2, (ys - near_y) ** 2 + (xs - far_x) ** 2)
+
+
+def _group_starts(groups):
+    """
+    Return the positions where the groups of contiguous items start.
+    """
+    return np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+
+
+def _group_min(values, groups):
+    """
+    Return, for each item, the smallest of the values of its group; the items of a group are contiguous.
+    """
+    starts = _group_starts(groups)
+    lengths = np.diff(np.append(starts, len(groups)))
+    return np.repeat(np.minimum.reduceat(values, starts), lengths)
+
+
+def _group_first_min(values, groups):
+    """
+    Return the position of the first smallest value of each group; the items of a group are contiguous.
+    """
+    best = np.flatnonzero(values == _group_min(values, groups))
+    return best[_group_starts(groups[best])]
@@ -5,54 +5,323 @@ Date: 2016/12/09
 
 Description: This module contains the utilities for the encoding and decoding of GeoHash.
 
+A GeoHash of precision p is a code of 5p bits, whose bits alternately halve the longitude interval and the latitude
+interval (the first bit halves the longitude interval). geo_encode_int() computes the code as an integer: it finds the
+longitude cell and the latitude cell directly by quantization, then interleaves their bits with a lookup table. The
+base32 str representation is only built on demand, by geohash_to_str().
+
 === Constants ===
 BASE32: list
     A list used for base32 encoding and decoding of GeoHash
+BASE32_INDEX: dict
+    The inverse of BASE32, from a character to its value
+MAX_PRECISION: int
+    The maximum precision of an integer GeoHash (60 bits)
 """
 
+import math
+
+import numpy as np
+
 BASE32 = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'b', 'c', 'd', 'e', 'f', 'g',
           'h', 'j', 'k', 'm', 'n', 'p', 'q', 'r', 's', 't', 'u', 'v', 'w', 'x', 'y', 'z']
+BASE32_INDEX = {char: i for i, char in enumerate(BASE32)}
+MAX_PRECISION = 12
 
+# _SPREAD[x] holds the 8 bits of x spread to the even bits of a 16-bit integer, e.g. 0b1011 --> 0b01000101.
+_SPREAD = [sum(((x >> b) & 1) << (2 * b) for b in range(8)) for x in range(256)]
+_SPREAD_ARRAY = np.array(_SPREAD, dtype=np.int64)
 
-def geo_encode(lat, lon, precision):
-    global BASE32
 
-    lat_interval = [-90.0, 90.0]
-    lon_interval = [-180.0, 180.0]
-    length = precision * 5  # the demand length of binary code
+def _num_bits(precision):
+    """
+    Return the number of longitude bits and latitude bits of a GeoHash.
+
+    :param precision: int
+    :return: [int, int]
+    """
+    if not 0 < precision <= MAX_PRECISION:
+        raise ValueError("precision must be in [1, %d]" % MAX_PRECISION)
+    length = precision * 5
+    return [(length + 1) // 2, length // 2]
+
+
+# _LAYOUT[precision] = [lon_bits, lat_bits] for all the valid precisions, to save the checks of _num_bits() per call.
+_LAYOUT = {precision: _num_bits(precision) for precision in range(1, MAX_PRECISION + 1)}
+
+# _BASE32_PAIRS[x] is the base32 representation of the 10-bit integer x, i.e. two characters.
+_BASE32_PAIRS = [BASE32[x >> 5] + BASE32[x & 31] for x in range(1024)]
+
+
+def _quantize(value, lo, hi, bits):
+    """
+    Return the index of the cell containing value, when [lo, hi] is split into 2**bits cells.
+
+    A value on the boundary of two cells belongs to the lower one, as in the bisection of GeoHash (value > mid goes to
+    the upper half). The boundaries lo + k * width are exact in floating point, so the estimate from the division is
+    corrected against them.
+
+    :param value: float
+    :param lo: float
+    :param hi: float
+    :param bits: int
+    :return: int
+    """
+    if value != value:  # NaN is never greater than mid
+        return 0
+    num_cell = 1 << bits
+    width = (hi - lo) / num_cell
+    k = int(min(max(math.ceil((value - lo) / width) - 1, 0), num_cell - 1))
+    if k < num_cell - 1 and value > lo + (k + 1) * width:
+        k += 1
+    elif k > 0 and value <= lo + k * width:
+        k -= 1
+    return k
+
+
+def _quantize_many(values, lo, hi, bits):
+    """
+    Vectorized version of _quantize().
+
+    :param values: numpy.ndarray
+    :param lo: float
+    :param hi: float
+    :param bits: int
+    :return: numpy.ndarray
+    """
+    num_cell = 1 << bits
+    width = (hi - lo) / num_cell
+    with np.errstate(invalid='ignore'):
+        k = np.clip(np.ceil((values - lo) / width) - 1, 0, num_cell - 1)
+        k = np.where(np.isnan(k), 0, k).astype(np.int64)
+        k = np.where((k < num_cell - 1) & (values > lo + (k + 1) * width), k + 1, k)
+        k = np.where((k > 0) & (values <= lo + k * width), k - 1, k)
+    return k
+
+
+def _spread(x):
+    """
+    Spread the (up to 32) bits of x to the even bits of an integer.
+
+    :param x: int
+    :return: int
+    """
+    if x < 0x10000:
+        return _SPREAD[x & 0xff] | _SPREAD[x >> 8] << 16
+    return (_SPREAD[x & 0xff] | _SPREAD[(x >> 8) & 0xff] << 16 |
+            _SPREAD[(x >> 16) & 0xff] << 32 | _SPREAD[(x >> 24) & 0xff] << 48)
+
+
+def _spread_many(x):
+    """
+    Vectorized version of _spread().
+
+    :param x: numpy.ndarray
+    :return: numpy.ndarray
+    """
+    return (_SPREAD_ARRAY[x & 0xff] | _SPREAD_ARRAY[(x >> 8) & 0xff] << 16 |
+            _SPREAD_ARRAY[(x >> 16) & 0xff] << 32 | _SPREAD_ARRAY[(x >> 24) & 0xff] << 48)
+
+
+def _compact_many(x):
+    """
+    The inverse of _spread_many(): gather the even bits of x.
+
+    :param x: numpy.ndarray
+    :return: numpy.ndarray
+    """
+    x = x & 0x5555555555555555
+    x = (x | x >> 1) & 0x3333333333333333
+    x = (x | x >> 2) & 0x0f0f0f0f0f0f0f0f
+    x = (x | x >> 4) & 0x00ff00ff00ff00ff
+    x = (x | x >> 8) & 0x0000ffff0000ffff
+    return (x | x >> 16) & 0x00000000ffffffff
+
+
+def geo_encode_int(lat, lon, precision):
+    """
+    Return the GeoHash of (lat, lon) as an integer cell id.
+
+    :param lat: float
+    :param lon: float
+    :param precision: the length of the GeoHash
+    :type precision: int
+    :return: int
+
+    >>> print(geo_encode_int(39.564540, 115.739662, 5))
+    30314593
+    """
+    if precision not in _LAYOUT:
+        _num_bits(precision)  # raise the error
+    [lon_bits, lat_bits] = _LAYOUT[precision]
+    lon_cell = _spread(_quantize(lon, -180.0, 180.0, lon_bits))
+    lat_cell = _spread(_quantize(lat, -90.0, 90.0, lat_bits))
+    if lon_bits == lat_bits:  # the last bit is a latitude bit
+        return lon_cell << 1 | lat_cell
+    return lon_cell | lat_cell << 1
+
+
+def geo_encode_many(lats, lons, precision):
+    """
+    Encode arrays of latitudes and longitudes at once.
+
+    This is the vectorized version of geo_encode_int(); use geohash_to_str_many() to get the str representation.
+
+    :param lats: array of latitudes
+    :param lons: array of longitudes
+    :param precision: the length of the GeoHash
+    :type lats: numpy.ndarray
+    :type lons: numpy.ndarray
+    :type precision: int
+    :return: array of integer GeoHash
+    :rtype: numpy.ndarray
+
+    >>> print(geohash_to_str_many(geo_encode_many([39.564540, 39.533867], [115.739662, 115.746735], 5), 5).tolist())
+    [u'wx431', u'wx42c']
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    [lon_bits, lat_bits] = _num_bits(precision)
+    lon_cells = _spread_many(_quantize_many(lons, -180.0, 180.0, lon_bits))
+    lat_cells = _spread_many(_quantize_many(lats, -90.0, 90.0, lat_bits))
+    if lon_bits == lat_bits:
+        return lon_cells << 1 | lat_cells
+    return lon_cells | lat_cells << 1
+
+
+def geohash_to_str(code, precision):
+    """
+    Return the base32 str representation of an integer GeoHash.
+
+    :param code: int
+    :param precision: int
+    :return: str
+
+    >>> print(geohash_to_str(30314593, 5))
+    wx431
+    """
     geohash = ""
-    bits = 0
-    for i in range(1, length + 1):
-        if not(i % 2 == 0):  # odd: lon
-            mid = (lon_interval[0] + lon_interval[1]) / 2
-            if lon > mid:
-                bits = bits * 2 + 1  # binary code is set to 1
-                lon_interval[0] = mid  # update the corresponding interval
-            else:
-                bits *= 2  # binary code is set to 0
-                lon_interval[1] = mid
-        else:
-            mid = (lat_interval[0] + lat_interval[1]) / 2
-            if lat > mid:
-                bits = bits * 2 + 1
-                lat_interval[0] = mid
-            else:
-                bits *= 2
-                lat_interval[1] = mid
-        if i % 5 == 0:
-            geohash += BASE32[bits]
-            bits = 0  # reset binary code
+    if precision % 2 == 1:
+        geohash = BASE32[code & 31]
+        code >>= 5
+    for i in range(precision // 2):
+        geohash = _BASE32_PAIRS[code & 1023] + geohash
+        code >>= 10
     return geohash
 
 
-def geo_decode(geohash):
-    global BASE32
+def geohash_to_str_many(codes, precision):
+    """
+    Vectorized version of geohash_to_str().
 
+    :param codes: numpy.ndarray
+    :param precision: int
+    :return: array of GeoHash str
+    :rtype: numpy.ndarray
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    shifts = 5 * np.arange(precision - 1, -1, -1)
+    chars = np.array(BASE32, dtype="U1")[(codes[..., np.newaxis] >> shifts) & 31]
+    return np.ascontiguousarray(chars).view('U%d' % precision).reshape(codes.shape)
+
+
+def geohash_to_int(geohash):
+    """
+    Return the integer representation of a base32 GeoHash.
+
+    :param geohash: str
+    :return: int
+
+    >>> print(geohash_to_int('wx431'))
+    30314593
+    """
+    code = 0
+    for char in geohash:
+        code = code << 5 | BASE32_INDEX[char]
+    return code
+
+
+def geo_encode(lat, lon, precision):
+    """
+    Return the GeoHash of (lat, lon) as a base32 str.
+
+    :param lat: float
+    :param lon: float
+    :param precision: the length of the GeoHash
+    :type precision: int
+    :return: str
+
+    >>> print(geo_encode(39.564540, 115.739662, 5))
+    wx431
+    """
+    return geohash_to_str(geo_encode_int(lat, lon, precision), precision)
+
+
+def geo_decode_many(codes, precision):
+    """
+    Return the centers of the cells of integer GeoHashes, as geo_decode() does for a base32 GeoHash.
+
+    :param codes: array of integer GeoHash
+    :param precision: the length of the GeoHash
+    :type codes: numpy.ndarray
+    :type precision: int
+    :return: the latitudes and the longitudes of the centers
+    :rtype: [numpy.ndarray, numpy.ndarray]
+
+    >>> [lats, lons] = geo_decode_many(geo_encode_many([39.564540], [115.739662], 5), 5)
+    >>> [float(lats[0]), float(lons[0])] == geo_decode('wx431')
+    True
+    """
+    [lon_cells, lat_cells, lon_bits, lat_bits] = _cells_many(codes, precision)
+    lats = -90.0 + (lat_cells + 0.5) * (180.0 / (1 << lat_bits))
+    lons = -180.0 + (lon_cells + 0.5) * (360.0 / (1 << lon_bits))
+    return [lats, lons]
+
+
+def geo_bounds_many(codes, precision):
+    """
+    Return the bounding boxes of the cells of integer GeoHashes.
+
+    :param codes: array of integer GeoHash
+    :param precision: the length of the GeoHash
+    :type codes: numpy.ndarray
+    :type precision: int
+    :return: the south, north, west and east bounds of the cells
+    :rtype: [numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]
+
+    >>> [south, north, west, east] = geo_bounds_many([geohash_to_int('wx431')], 5)
+    >>> print([float(south[0]), float(north[0]), float(west[0]), float(east[0])])
+    [39.55078125, 39.5947265625, 115.7080078125, 115.751953125]
+    """
+    [lon_cells, lat_cells, lon_bits, lat_bits] = _cells_many(codes, precision)
+    lat_width = 180.0 / (1 << lat_bits)
+    lon_width = 360.0 / (1 << lon_bits)
+    south = -90.0 + lat_cells * lat_width
+    west = -180.0 + lon_cells * lon_width
+    return [south, south + lat_width, west, west + lon_width]
+
+
+def _cells_many(codes, precision):
+    """
+    Return the longitude cells and the latitude cells of integer GeoHashes, and their numbers of bits.
+
+    :param codes: numpy.ndarray
+    :param precision: int
+    :return: [numpy.ndarray, numpy.ndarray, int, int]
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    [lon_bits, lat_bits] = _num_bits(precision)
+    if lon_bits == lat_bits:
+        return [_compact_many(codes >> 1), _compact_many(codes), lon_bits, lat_bits]
+    return [_compact_many(codes), _compact_many(codes >> 1), lon_bits, lat_bits]
+
+
+def geo_decode(geohash):
     odd = True
     lat_interval = [-90.0, 90.0]
     lon_interval = [-180.0, 180.0]
     for char in geohash:
-        bits = BASE32.index(char)
+        bits = BASE32_INDEX[char]
         for j in range(4, -1, -1):
             bit = (bits >> j) & 1
             if odd:
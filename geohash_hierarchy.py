@@ -0,0 +1,308 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the multi-resolution GeoHash hierarchy of the taxi locations, used by the
+SpatioTemporalDatabase to find the candidate taxis of a query.
+
+With a single GeoHash precision, a downtown grid cell holds hundreds of taxis while a suburban one holds almost none.
+The hierarchy adapts the cells to the density instead, like a quadtree over the GeoHash prefixes: a cell is a leaf
+holding its taxis as long as they are at most leaf_capacity, and splits into its 32 children (the GeoHashes one
+character longer) beyond that, down to max_precision. A cell whose subtree drops to half of leaf_capacity taxis is
+merged back into a leaf, so sparse areas stay aggregated at the coarse levels.
+
+The candidate search descends level by level, from the cells of min_precision: every cell is pruned as soon as the
+distance from the query to its bounding box (a lower bound of the distance to any taxi in it) is beyond the search
+radius, and only the leaves that survive are opened.
+
+=== Constants ===
+MIN_PRECISION: int
+    The default precision of the coarsest level.
+MAX_PRECISION: int
+    The default precision of the finest level.
+LEAF_CAPACITY: int
+    The default maximum number of taxis in a leaf above the finest level.
+BOUND_SLACK: float
+    The factor applied to the distance from a location to a bounding box, which measures the distance to the point of
+    the box closest in latitude and longitude; this overestimates the distance across a meridian by far less than
+    0.1% at the scale of a city, so the scaled distance is a safe lower bound.
+"""
+
+
+import numpy as np
+
+from geohash import geo_encode_int, geo_bounds_many
+from location import great_circle_distance_many
+
+
+MIN_PRECISION = 4
+MAX_PRECISION = 7
+LEAF_CAPACITY = 32
+BOUND_SLACK = 0.999
+
+
+class _HierarchyCell:
+    """
+    A cell of the hierarchy: a leaf holds the set of its taxis, an inner cell the set of the codes of its non-empty
+    children.
+    """
+    def __init__(self):
+        self.count = 0  # the number of taxis in the subtree
+        self.items = set()
+        self.children = None
+
+
+class GeoHashHierarchy:
+    """
+    An adaptive hierarchy of GeoHash cells between min_precision and max_precision, indexing the locations of items
+    (e.g. taxi ids).
+
+    A cell is identified by (precision, code), where code is its integer GeoHash; the code of the ancestor of precision
+    p of a cell of precision q is code >> 5 * (q - p).
+
+    The search finds the items of a scan of all the locations, also after the cells have been split and merged:
+
+    >>> rng = np.random.RandomState(0)
+    >>> hierarchy = GeoHashHierarchy(leaf_capacity=4)
+    >>> locations = dict()
+    >>> for item in range(600):
+    ...     locations[item] = (39.9 + rng.normal(0, 0.01 if item % 2 else 0.1), 116.4 + rng.normal(0, 0.01))
+    ...     hierarchy.move(item, locations[item][0], locations[item][1])
+    >>> for item in rng.permutation(600)[:400].tolist():
+    ...     if item % 4 == 0:
+    ...         hierarchy.remove(item)
+    ...         del locations[item]
+    ...     else:
+    ...         locations[item] = (39.9 + rng.normal(0, 0.002), 116.4 + rng.normal(0, 0.002))
+    ...         hierarchy.move(item, locations[item][0], locations[item][1])
+    >>> items = sorted(locations)
+    >>> lats = np.array([locations[item][0] for item in items])
+    >>> lons = np.array([locations[item][1] for item in items])
+    >>> matches = []
+    >>> for [lat, lon, radius] in zip(39.9 + rng.normal(0, 0.02, 50), 116.4 + rng.normal(0, 0.02, 50),
+    ...                               rng.uniform(0, 3000, 50)):
+    ...     [found, distances] = hierarchy.search(lat, lon, radius)
+    ...     dis = great_circle_distance_many(lat, lon, lats, lons)
+    ...     matches.append(sorted(found) == [items[k] for k in np.flatnonzero(dis <= radius).tolist()] and
+    ...                    np.allclose(distances, np.sort(dis[dis <= radius])))
+    >>> all(matches) and len(hierarchy) == len(locations)
+    True
+
+    A leaf splits once it holds more than leaf_capacity items, except at max_precision, and a cell is merged back into
+    a leaf once its subtree holds at most half of leaf_capacity:
+
+    >>> hierarchy = GeoHashHierarchy(min_precision=4, max_precision=6, leaf_capacity=4)
+    >>> def leaves():  # the precision and the number of items of each leaf
+    ...     return sorted((key[0], len(cell.items)) for (key, cell) in hierarchy.cells.items() if cell.children is None)
+    >>> for item in range(4):
+    ...     hierarchy.move(item, 39.91 + 0.01 * item, 116.41)
+    >>> leaves()
+    [(4, 4)]
+    >>> hierarchy.move(4, 39.95, 116.41)
+    >>> leaves()
+    [(5, 1), (5, 4)]
+    >>> hierarchy.remove(4)
+    >>> hierarchy.remove(3)
+    >>> leaves()
+    [(5, 3)]
+    >>> hierarchy.remove(2)
+    >>> leaves()
+    [(4, 2)]
+    >>> for item in range(10, 20):
+    ...     hierarchy.move(item, 40.1, 116.3)
+    >>> leaves()
+    [(4, 2), (6, 10)]
+    """
+
+    def __init__(self, min_precision=MIN_PRECISION, max_precision=MAX_PRECISION, leaf_capacity=LEAF_CAPACITY):
+        """
+        Initialize an empty GeoHashHierarchy.
+
+        :param min_precision: the precision of the coarsest level
+        :param max_precision: the precision of the finest level
+        :param leaf_capacity: the maximum number of items in a leaf above the finest level
+        :type min_precision: int
+        :type max_precision: int
+        :type leaf_capacity: int
+        :return: None
+        """
+        if not 0 < min_precision <= max_precision:
+            raise ValueError("invalid precisions: %d, %d" % (min_precision, max_precision))
+        self.min_precision = min_precision
+        self.max_precision = max_precision
+        self.leaf_capacity = leaf_capacity
+        self.cells = dict()  # (precision, code) --> _HierarchyCell
+        self.roots = set()  # the codes of the non-empty cells of min_precision
+        self.codes = dict()  # item --> the code of its location at max_precision
+        self.locations = dict()  # item --> (lat, lon)
+
+    def __str__(self):
+        leaves = [key[0] for (key, cell) in self.cells.items() if cell.children is None]
+        return "GeoHashHierarchy:\n- items: {}\n- leaves per precision: {}"\
+            .format(len(self.codes), {p: leaves.count(p) for p in sorted(set(leaves))})
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, item):
+        return item in self.codes
+
+    def move(self, item, lat, lon):
+        """
+        Insert item at location (lat, lon), or move it there if it is already in the hierarchy.
+
+        :param item: a hashable item
+        :param lat: float
+        :param lon: float
+        :return: None
+        """
+        self.locations[item] = (lat, lon)
+        code = geo_encode_int(lat, lon, self.max_precision)
+        old_code = self.codes.get(item)
+        if old_code == code:
+            return
+        if old_code is not None:
+            self.__remove(item, old_code)
+        self.codes[item] = code
+        self.__insert(item, code)
+
+    def remove(self, item):
+        """
+        Remove item from the hierarchy, if it is in it.
+
+        :param item: a hashable item
+        :return: None
+        """
+        code = self.codes.pop(item, None)
+        if code is not None:
+            self.locations.pop(item)
+            self.__remove(item, code)
+
+    def search(self, lat, lon, radius):
+        """
+        Return the items within radius meters (straight-line distance) of location (lat, lon), closest first.
+
+        :param lat: float
+        :param lon: float
+        :param radius: float
+        :return: the items and their distances
+        :rtype: [list, numpy.ndarray]
+        """
+        candidates = []
+        precision = self.min_precision
+        codes = np.fromiter(self.roots, dtype=np.int64, count=len(self.roots))
+        while len(codes) != 0:
+            codes = codes[self.__lower_bounds(lat, lon, codes, precision) <= radius]
+            children = []
+            for code in codes.tolist():
+                cell = self.cells[(precision, code)]
+                if cell.children is None:
+                    candidates.extend(cell.items)
+                else:
+                    children.extend(cell.children)
+            codes = np.array(children, dtype=np.int64)
+            precision += 1
+
+        if len(candidates) == 0:
+            return [[], np.zeros(0)]
+        locations = np.array([self.locations[item] for item in candidates])
+        dis = great_circle_distance_many(lat, lon, locations[:, 0], locations[:, 1])
+        order = np.argsort(dis, kind='mergesort')
+        order = order[dis[order] <= radius]
+        return [[candidates[k] for k in order.tolist()], dis[order]]
+
+    @staticmethod
+    def __lower_bounds(lat, lon, codes, precision):
+        """
+        Return the lower bounds of the distances from location (lat, lon) to the cells of the given precision.
+        """
+        [south, north, west, east] = geo_bounds_many(codes, precision)
+        return great_circle_distance_many(lat, lon, np.clip(lat, south, north), np.clip(lon, west, east)) * BOUND_SLACK
+
+    def __insert(self, item, code):
+        """
+        Add item (whose code is already recorded) to the cells on the path to its leaf, splitting the leaf if it is
+        full.
+        """
+        parent = None
+        for precision in range(self.min_precision, self.max_precision + 1):
+            prefix = code >> 5 * (self.max_precision - precision)
+            cell = self.cells.get((precision, prefix))
+            if cell is None:
+                cell = self.cells[(precision, prefix)] = _HierarchyCell()
+                if parent is None:
+                    self.roots.add(prefix)
+                else:
+                    parent.children.add(prefix)
+            cell.count += 1
+            if cell.children is None:
+                cell.items.add(item)
+                if cell.count > self.leaf_capacity:
+                    self.__split(precision, prefix, cell)
+                return
+            parent = cell
+
+    def __split(self, precision, prefix, cell):
+        """
+        Turn a full leaf into an inner cell, and its children into leaves (splitting them again while they are full).
+        """
+        if precision == self.max_precision:
+            return
+        shift = 5 * (self.max_precision - precision - 1)
+        cell.children = set()
+        for item in cell.items:
+            child_prefix = self.codes[item] >> shift
+            child = self.cells.get((precision + 1, child_prefix))
+            if child is None:
+                child = self.cells[(precision + 1, child_prefix)] = _HierarchyCell()
+                cell.children.add(child_prefix)
+            child.count += 1
+            child.items.add(item)
+        cell.items = None
+        for child_prefix in list(cell.children):
+            child = self.cells[(precision + 1, child_prefix)]
+            if child.count > self.leaf_capacity:
+                self.__split(precision + 1, child_prefix, child)
+
+    def __remove(self, item, code):
+        """
+        Remove item from the cells on the path to its leaf: the empty cells are dropped, and the highest inner cell
+        with at most half of leaf_capacity items left is merged into a leaf.
+        """
+        path = []
+        for precision in range(self.min_precision, self.max_precision + 1):
+            prefix = code >> 5 * (self.max_precision - precision)
+            cell = self.cells[(precision, prefix)]
+            cell.count -= 1
+            path.append((precision, prefix, cell))
+            if cell.children is None:
+                cell.items.discard(item)
+                break
+
+        for i, (precision, prefix, cell) in enumerate(path):
+            if cell.count == 0:  # and so are all the cells below it
+                if precision == self.min_precision:
+                    self.roots.discard(prefix)
+                else:
+                    self.cells[(precision - 1, prefix >> 5)].children.discard(prefix)
+                for (lower_precision, lower_prefix, lower_cell) in path[i:]:
+                    del self.cells[(lower_precision, lower_prefix)]
+                return
+            if cell.children is not None and cell.count <= self.leaf_capacity // 2:
+                self.__merge(precision, prefix, cell)
+                return
+
+    def __merge(self, precision, prefix, cell):
+        """
+        Turn an inner cell into a leaf holding all the items of its subtree, and drop the cells below it.
+        """
+        items = set()
+        stack = [(precision + 1, child_prefix) for child_prefix in cell.children]
+        while len(stack) != 0:
+            key = stack.pop()
+            child = self.cells.pop(key)
+            if child.children is None:
+                items.update(child.items)
+            else:
+                stack.extend((key[0] + 1, grandchild) for grandchild in child.children)
+        cell.children = None
+        cell.items = items
@@ -0,0 +1,254 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the hub-label distance oracle, which answers the exact network distance between two
+vertices in microseconds.
+
+Every vertex v has a forward label, a list of hubs h with the distance d(v, h), and a backward label, a list of hubs h
+with the distance d(h, v). The labels cover every pair: some hub on a shortest path u-->v is in the forward label of u
+and in the backward label of v, so
+
+    d(u, v) = min(d(u, h) + d(h, v)) over the hubs h in both labels,
+
+which is found by merging the two labels, sorted by hub.
+
+The labels are derived from the contraction hierarchy (see contraction_hierarchy.py): the label of a vertex is its
+upward search space, computed from the labels of its upward neighbors in descending order of rank, and pruned of the
+hubs that another hub already covers with a shorter distance. They are stored in CSR form, so a table for the whole city
+is a handful of memory-mapped arrays.
+
+=== Constants ===
+HUB_LABEL_DIR: str
+    The name of the directory of the hub labels, inside the road-network snapshot (see snapshot.py).
+HUB_LABEL_VERSION: int
+    The version of the saved format of the hub labels.
+"""
+
+
+import numpy as np
+
+from road_network import RoadNetwork
+from contraction_hierarchy import ContractionHierarchy
+from snapshot import save_arrays, load_arrays, load_or_build_arrays
+
+
+HUB_LABEL_DIR = "hub_labels"
+HUB_LABEL_VERSION = 1
+
+
+class HubLabels:
+    """
+    The hub labels of a road network.
+
+    The forward label of vertex v is f_hubs[f_offsets[v]:f_offsets[v + 1]] (sorted by hub id) with the distances
+    f_dists at the same positions; the backward label is stored the same way in b_offsets, b_hubs and b_dists.
+
+    On a two-way line, the labels follow the ranks of the contraction hierarchy: the top vertex 1 is a hub of every
+    label, at its distance along the line, and every pair of vertices meets at a common hub:
+
+    >>> from road_network import make_grid_network
+    >>> line = RoadNetwork()
+    >>> line.add_vertices(range(5), [39.9] * 5, [116.3 + 0.001 * v for v in range(5)])
+    >>> line.add_edges(range(8), range(4) + range(1, 5), range(1, 5) + range(4), [100.0] * 8)
+    >>> ch = ContractionHierarchy.build(line)
+    >>> labels = HubLabels.build(line, ch)
+    >>> ch.rank.tolist()
+    [0, 4, 2, 3, 1]
+    >>> [dict(zip(labels.f_hubs[labels.f_offsets[v]:labels.f_offsets[v + 1]].tolist(),
+    ...           labels.f_dists[labels.f_offsets[v]:labels.f_offsets[v + 1]].tolist())) for v in range(5)]
+    [{0: 0.0, 1: 100.0}, {1: 0.0}, {1: 100.0, 2: 0.0, 3: 100.0}, {1: 200.0, 3: 0.0}, {1: 300.0, 3: 100.0, 4: 0.0}]
+    >>> np.array_equal([[labels.road_distance(s, e) for e in range(5)] for s in range(5)],
+    ...                100.0 * np.abs(np.subtract.outer(range(5), range(5))))
+    True
+
+    On a grid with one-way streets, the pruning leaves only the hubs whose label distance is the distance of the
+    hierarchy, so a label is smaller than the upward search space it comes from:
+
+    >>> road_network = make_grid_network(6, 6, shape_points=1)
+    >>> ch = ContractionHierarchy.build(road_network)
+    >>> labels = HubLabels.build(road_network, ch)
+    >>> v_ids = range(road_network.num_vertex)
+    >>> expected = np.array([[ch.get_distance(s, e) for e in v_ids] for s in v_ids])
+    >>> all(np.allclose(labels.f_dists[labels.f_offsets[v]:labels.f_offsets[v + 1]],
+    ...                 expected[v, labels.f_hubs[labels.f_offsets[v]:labels.f_offsets[v + 1]]]) and
+    ...     np.allclose(labels.b_dists[labels.b_offsets[v]:labels.b_offsets[v + 1]],
+    ...                 expected[labels.b_hubs[labels.b_offsets[v]:labels.b_offsets[v + 1]], v]) for v in v_ids)
+    True
+    >>> def search_space_size(v):
+    ...     reached = set([v])
+    ...     stack = [v]
+    ...     while len(stack) != 0:
+    ...         u = stack.pop()
+    ...         for w in ch.fwd_targets[ch.fwd_offsets[u]:ch.fwd_offsets[u + 1]].tolist():
+    ...             if w not in reached:
+    ...                 reached.add(w)
+    ...                 stack.append(w)
+    ...     return len(reached)
+    >>> len(labels.f_hubs) < sum(search_space_size(v) for v in v_ids)
+    True
+    """
+
+    ARRAY_NAMES = ('f_offsets', 'f_hubs', 'f_dists', 'b_offsets', 'b_hubs', 'b_dists')
+
+    def __init__(self, arrays):
+        """
+        Initialize HubLabels from its arrays, see HubLabels.build().
+
+        :param arrays: dict[str, numpy.ndarray]
+        :return: None
+        """
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def __str__(self):
+        num_vertex = int(np.count_nonzero(np.diff(self.f_offsets)))
+        return "HubLabels:\n- number of vertexes: {}\n- average label size: {}"\
+            .format(num_vertex, float(len(self.f_hubs) + len(self.b_hubs)) / max(2 * num_vertex, 1))
+
+    @classmethod
+    def build(cls, road_network, ch=None):
+        """
+        Compute the hub labels of a road network.
+
+        :param road_network: the road network
+        :param ch: the contraction hierarchy of the road network, built if None
+        :type road_network: RoadNetwork
+        :type ch: ContractionHierarchy
+        :return: HubLabels
+        """
+        if ch is None:
+            ch = ContractionHierarchy.build(road_network)
+
+        rank = ch.rank
+        num_slot = len(rank)
+        order = np.argsort(-rank, kind='mergesort')
+        order = order[rank[order] >= 0]
+
+        labels = [[None] * num_slot, [None] * num_slot]  # the (hubs, dists) arrays of the forward/backward labels
+        graphs = [(ch.fwd_offsets, ch.fwd_targets, ch.fwd_weights), (ch.bwd_offsets, ch.bwd_targets, ch.bwd_weights)]
+
+        # From the highest rank down, so the labels of the upward neighbors are final when a label is computed.
+        for v in order.tolist():
+            for k in (0, 1):
+                [offsets, targets, weights] = graphs[k]
+                lo = offsets[v]
+                hi = offsets[v + 1]
+                hubs = [np.array([v], dtype=np.int64)]
+                dists = [np.zeros(1)]
+                for w, weight in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+                    hubs.append(labels[k][w][0])
+                    dists.append(labels[k][w][1] + weight)
+                hubs = np.concatenate(hubs)
+                dists = np.concatenate(dists)
+
+                # Keep the shortest distance of every hub.
+                idx = np.lexsort((dists, hubs))
+                hubs = hubs[idx]
+                dists = dists[idx]
+                first = np.ones(len(hubs), dtype=bool)
+                first[1:] = hubs[1:] != hubs[:-1]
+                hubs = hubs[first]
+                dists = dists[first]
+
+                # Prune a hub h if the label already reaches it by a shorter way through another hub, using the
+                # final labels of h (whose rank is higher than v).
+                keep = np.ones(len(hubs), dtype=bool)
+                for i, h in enumerate(hubs.tolist()):
+                    if h == v:
+                        continue
+                    if k == 0:
+                        d = _merge(hubs, dists, labels[1][h][0], labels[1][h][1])
+                    else:
+                        d = _merge(labels[0][h][0], labels[0][h][1], hubs, dists)
+                    if d < dists[i]:
+                        keep[i] = False
+                labels[k][v] = (hubs[keep], dists[keep])
+
+        arrays = dict()
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        for prefix, k in (('f', 0), ('b', 1)):
+            items = [empty if item is None else item for item in labels[k]]
+            arrays[prefix + '_offsets'] = np.concatenate(([0], np.cumsum([len(item[0]) for item in items])))\
+                .astype(np.int64)
+            arrays[prefix + '_hubs'] = np.concatenate([item[0] for item in items]).astype(np.int32)
+            arrays[prefix + '_dists'] = np.concatenate([item[1] for item in items])
+        return cls(arrays)
+
+    def save(self, path):
+        """
+        Save the hub labels to directory path, see snapshot.save_arrays().
+
+        :param path: str
+        :return: None
+        """
+        save_arrays({name: getattr(self, name) for name in self.ARRAY_NAMES}, {'version': HUB_LABEL_VERSION}, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load hub labels saved by save(). The arrays are memory-mapped read-only.
+
+        :param path: str
+        :return: HubLabels
+        """
+        [arrays, meta] = load_arrays(path, cls.ARRAY_NAMES)
+        if meta['version'] != HUB_LABEL_VERSION:
+            raise ValueError("incompatible hub labels: %s" % path)
+        return cls(arrays)
+
+    @classmethod
+    def load_or_build(cls, road_network, path, ch=None):
+        """
+        Load the hub labels saved in directory path, building and saving them first if necessary, see
+        snapshot.load_or_build_arrays().
+
+        :param road_network: the road network
+        :param path: the directory of the hub labels
+        :param ch: the contraction hierarchy of the road network, built if None and needed
+        :type road_network: RoadNetwork
+        :type path: str
+        :type ch: ContractionHierarchy
+        :return: HubLabels
+        """
+        def build():
+            labels = cls.build(road_network, ch)
+            return {name: getattr(labels, name) for name in cls.ARRAY_NAMES}
+
+        return cls(load_or_build_arrays(path, cls.ARRAY_NAMES, HUB_LABEL_VERSION, build,
+                                        "the hub labels (will take a while)"))
+
+    def road_distance(self, u, v):
+        """
+        Return the length of the shortest path from vertex u to vertex v.
+
+        :param u: int
+        :param v: int
+        :return: the length, float('inf') if u-->v is unreachable
+        :rtype: float
+        """
+        f_lo = self.f_offsets[u]
+        f_hi = self.f_offsets[u + 1]
+        b_lo = self.b_offsets[v]
+        b_hi = self.b_offsets[v + 1]
+        return _merge(self.f_hubs[f_lo:f_hi], self.f_dists[f_lo:f_hi], self.b_hubs[b_lo:b_hi], self.b_dists[b_lo:b_hi])
+
+
+def _merge(f_hubs, f_dists, b_hubs, b_dists):
+    """
+    Merge a forward label and a backward label, both sorted by hub.
+
+    :param f_hubs: numpy.ndarray
+    :param f_dists: numpy.ndarray
+    :param b_hubs: numpy.ndarray
+    :param b_dists: numpy.ndarray
+    :return: the smallest d(u, h) + d(h, v) over the common hubs h, float('inf') if there is none
+    :rtype: float
+    """
+    if len(f_hubs) == 0 or len(b_hubs) == 0:
+        return float('inf')
+    idx = np.searchsorted(b_hubs, f_hubs)
+    idx[idx == len(b_hubs)] = 0
+    common = b_hubs[idx] == f_hubs
+    if not common.any():
+        return float('inf')
+    return float(np.min(f_dists[common] + b_dists[idx[common]]))
@@ -0,0 +1,238 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the landmark tables of the ALT (A*, Landmarks, Triangle inequality) heuristic.
+
+For a few landmark vertices L, the lengths of the shortest paths from L to every vertex and from every vertex to L are
+computed once. By the triangle inequality, the length of the shortest path v-->t is at least
+
+    max(d(L, t) - d(L, v), d(v, L) - d(t, L))
+
+for every landmark L. The largest of these bounds is a consistent A* heuristic, so the search stays exact, and unlike
+the straight-line distance it knows about rivers, ring roads and one-way streets.
+
+The landmarks are picked by farthest selection: each new landmark is the vertex farthest (in network distance) from
+the landmarks chosen so far, which spreads them over the border of the city where they give the best bounds.
+
+=== Constants ===
+LANDMARK_DIR: str
+    The name of the directory of the landmark table, inside the road-network snapshot (see snapshot.py).
+LANDMARK_VERSION: int
+    The version of the saved format of the landmark tables.
+NUM_LANDMARKS: int
+    The default number of landmarks.
+UNREACHABLE: float
+    The landmark distance of an unreachable vertex, see LandmarkTable.
+"""
+
+
+import numpy as np
+
+from road_network import RoadNetwork, Path, get_shortest_path, csr_dijkstra_distance
+from snapshot import save_arrays, load_arrays, load_or_build_arrays
+
+
+LANDMARK_DIR = "landmarks"
+LANDMARK_VERSION = 1
+NUM_LANDMARKS = 16
+UNREACHABLE = 1e18
+
+
+class LandmarkTable:
+    """
+    The landmark distances of a road network.
+
+    dist_from[v, k] is the length of the shortest path from the k-th landmark to vertex v, dist_to[v, k] the length of
+    the shortest path from vertex v to the k-th landmark. A row holds all the landmarks of a vertex, so a bound reads
+    two contiguous rows.
+
+    An unreachable vertex has the distance UNREACHABLE instead of float('inf'), which keeps the bounds free of
+    inf - inf: two unreachable distances cancel out (no bound), and an unreachable distance minus a finite one is a
+    huge bound, which is right, as the target cannot be reached from the vertex in that case.
+
+    The landmarks are picked farthest first. On a two-way line 0-1-2-3-4, with a one-way edge from 4 to the dead end
+    5, they are the two ends, and every bound along the line is the exact distance. Nothing is reachable from 5:
+
+    >>> from road_network import RoadNetwork
+    >>> line = RoadNetwork()
+    >>> line.add_vertices(range(6), [39.9] * 6, [116.3 + 0.001 * v for v in range(6)])
+    >>> line.add_edges(range(9), range(4) + range(1, 5) + [4], range(1, 5) + range(4) + [5], [100.0] * 9)
+    >>> table = LandmarkTable.build(line, num_landmarks=2)
+    >>> table.landmarks.tolist()
+    [5, 0]
+    >>> bounds = np.array([table.lower_bound_to(e)(range(5)) for e in range(5)]).T
+    >>> np.array_equal(bounds, 100.0 * np.abs(np.subtract.outer(range(5), range(5))))
+    True
+    >>> path = table.get_shortest_path(line, 0, 5)
+    >>> path.vertex_list, path.distance
+    ((0, 1, 2, 3, 4, 5), 500.0)
+    >>> table.get_shortest_path(line, 5, 0).vertex_list
+    ()
+
+    On a one-way ring, a landmark only bounds tightly the distances which pass it, but no bound exceeds the distance
+    around the ring, and the paths stay exact:
+
+    >>> ring = RoadNetwork()
+    >>> ring.add_vertices(range(4), [39.9, 39.9, 39.901, 39.901], [116.3, 116.301, 116.301, 116.3])
+    >>> ring.add_edges(range(4), range(4), [1, 2, 3, 0], [100.0] * 4)
+    >>> table = LandmarkTable.build(ring, num_landmarks=2)
+    >>> around = 100.0 * (np.subtract.outer(range(4), range(4)).T % 4)
+    >>> bounds = np.array([table.lower_bound_to(e)(range(4)) for e in range(4)]).T
+    >>> bool((bounds <= around).all()), bool((bounds < around).any())
+    (True, True)
+    >>> np.array_equal([[table.get_shortest_path(ring, s, e).distance for e in range(4)] for s in range(4)], around)
+    True
+    """
+
+    ARRAY_NAMES = ('landmarks', 'dist_from', 'dist_to')
+
+    def __init__(self, arrays):
+        """
+        Initialize a LandmarkTable from its arrays, see LandmarkTable.build().
+
+        :param arrays: dict[str, numpy.ndarray]
+        :return: None
+        """
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def __str__(self):
+        return "LandmarkTable:\n- landmarks: {}".format(self.landmarks.tolist())
+
+    @classmethod
+    def build(cls, road_network, num_landmarks=NUM_LANDMARKS):
+        """
+        Select the landmarks of a road network and compute their distance tables.
+
+        :param road_network: the road network
+        :param num_landmarks: the number of landmarks
+        :type road_network: RoadNetwork
+        :type num_landmarks: int
+        :return: LandmarkTable
+        """
+        road_network.pack()
+        arrays = road_network.to_arrays()
+        offsets = arrays['offsets']
+        targets = arrays['targets']
+        weights = arrays['weights']
+        num_slot = len(offsets) - 1
+
+        v_ids = np.flatnonzero(arrays['v_exists'])
+        num_landmarks = min(num_landmarks, len(v_ids))
+        landmarks = []
+        dist_from = np.full((num_slot, num_landmarks), np.inf)
+        dist_to = np.full((num_slot, num_landmarks), np.inf)
+
+        # Farthest selection, starting from the vertex farthest from an arbitrary vertex.
+        min_dist = csr_dijkstra_distance(offsets, targets, weights, int(v_ids[0]))
+        for k in range(num_landmarks):
+            candidates = np.where(np.isinf(min_dist[v_ids]), -1.0, min_dist[v_ids])
+            if len(landmarks) != 0:
+                candidates[np.searchsorted(v_ids, landmarks)] = -1.0
+            landmark = int(v_ids[np.argmax(candidates)])
+            landmarks.append(landmark)
+
+            dist_from[:, k] = csr_dijkstra_distance(offsets, targets, weights, landmark)
+            dist_to[:, k] = csr_dijkstra_distance(arrays['r_offsets'], arrays['sources'], arrays['r_weights'],
+                                                  landmark)
+            min_dist = dist_from[:, k] if k == 0 else np.minimum(min_dist, dist_from[:, k])
+
+        dist_from[np.isinf(dist_from)] = UNREACHABLE
+        dist_to[np.isinf(dist_to)] = UNREACHABLE
+        return cls({'landmarks': np.array(landmarks, dtype=np.int64), 'dist_from': dist_from, 'dist_to': dist_to})
+
+    def save(self, path):
+        """
+        Save the landmark table to directory path, see snapshot.save_arrays().
+
+        :param path: str
+        :return: None
+        """
+        save_arrays({name: getattr(self, name) for name in self.ARRAY_NAMES}, {'version': LANDMARK_VERSION}, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a landmark table saved by save(). The arrays are memory-mapped read-only.
+
+        :param path: str
+        :return: LandmarkTable
+        """
+        [arrays, meta] = load_arrays(path, cls.ARRAY_NAMES)
+        if meta['version'] != LANDMARK_VERSION:
+            raise ValueError("incompatible landmark table: %s" % path)
+        return cls(arrays)
+
+    @classmethod
+    def load_or_build(cls, road_network, path, num_landmarks=NUM_LANDMARKS):
+        """
+        Load the landmark table saved in directory path, building and saving it first if necessary, see
+        snapshot.load_or_build_arrays().
+
+        :param road_network: the road network
+        :param path: the directory of the landmark table
+        :param num_landmarks: the number of landmarks, if the table is built
+        :type road_network: RoadNetwork
+        :type path: str
+        :type num_landmarks: int
+        :return: LandmarkTable
+        """
+        def build():
+            table = cls.build(road_network, num_landmarks)
+            return {name: getattr(table, name) for name in cls.ARRAY_NAMES}
+
+        return cls(load_or_build_arrays(path, cls.ARRAY_NAMES, LANDMARK_VERSION, build, "the landmark tables"))
+
+    def lower_bound_to(self, e_vid):
+        """
+        Return the ALT heuristic towards vertex e_vid.
+
+        :param e_vid: the target vertex
+        :type e_vid: int
+        :return: a function which maps a list of vertex ids to the lower bounds of their distances to e_vid
+        :rtype: (list[int]) -> list[float]
+        """
+        from_target = self.dist_from[e_vid]
+        to_target = self.dist_to[e_vid]
+        dist_from = self.dist_from
+        dist_to = self.dist_to
+
+        def lower_bound(v_ids):
+            bounds = np.maximum(from_target - dist_from[v_ids], dist_to[v_ids] - to_target).max(axis=1)
+            return np.maximum(bounds, 0.0).tolist()
+
+        return lower_bound
+
+    def lower_bound_from(self, s_vid):
+        """
+        Return the ALT heuristic from vertex s_vid, the counterpart of lower_bound_to() for a backward search.
+
+        :param s_vid: the source vertex
+        :type s_vid: int
+        :return: a function which maps a list of vertex ids to the lower bounds of their distances from s_vid
+        :rtype: (list[int]) -> list[float]
+        """
+        from_source = self.dist_from[s_vid]
+        to_source = self.dist_to[s_vid]
+        dist_from = self.dist_from
+        dist_to = self.dist_to
+
+        def lower_bound(v_ids):
+            bounds = np.maximum(dist_from[v_ids] - from_source, to_source - dist_to[v_ids]).max(axis=1)
+            return np.maximum(bounds, 0.0).tolist()
+
+        return lower_bound
+
+    def get_shortest_path(self, road_network, s_vid, e_vid):
+        """
+        Return the shortest path from vertex s_vid to vertex e_vid using A* with the ALT heuristic.
+
+        The straight-line estimate of the plain A* is replaced by the largest triangle-inequality bound over the
+        landmarks, see lower_bound_to(), which follows the roads and so settles far fewer vertices.
+
+        :param road_network: the road network the table was built from
+        :param s_vid: int
+        :param e_vid: int
+        :return: Path
+        """
+        return get_shortest_path(road_network, s_vid, e_vid, self)
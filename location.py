@@ -12,10 +12,11 @@ GeoComputing.
 from geohash import geo_encode
 from constants import R, PRECISION
 import math
+import numpy as np
 
 
 class Location:
-    def __init__(self, lat, lon):
+    def __init__(self, lat, lon, geohash=None):
         """
         Initialize a location.
 
@@ -25,11 +26,25 @@ class Location:
             latitude of a location
         :param lon: float
             longitude of a location
+        :param geohash: str
+            the pre-computed GeoHash of (lat, lon), computed on first access if None
         :return: None
         """
         self.lat = lat
         self.lon = lon
-        self.geohash = geo_encode(lat, lon, PRECISION)
+        self.__geohash = geohash
+
+    @property
+    def geohash(self):
+        """
+        Return the GeoHash of a location. It is only computed when needed, since most locations (e.g. the intermediate
+        positions of a driving taxi) never need it.
+
+        :return: str
+        """
+        if self.__geohash is None:
+            self.__geohash = geo_encode(self.lat, self.lon, PRECISION)
+        return self.__geohash
 
     def __str__(self):
         """
@@ -76,10 +91,29 @@ def get_distance(pos_a, pos_b):
     >>> print(get_distance(pos_a, pos_c))
     3464.17661119
     """
-    x1 = math.radians(pos_a.lat)
-    y1 = math.radians(pos_a.lon)
-    x2 = math.radians(pos_b.lat)
-    y2 = math.radians(pos_b.lon)
+    return great_circle_distance(pos_a.lat, pos_a.lon, pos_b.lat, pos_b.lon)
+
+
+def great_circle_distance(lat_a, lon_a, lat_b, lon_b):
+    """
+    Compute the distance between two (lat, lon) pairs in meters.
+
+    This is the same computation as get_distance(), but it works on plain floats so that callers holding raw
+    coordinates (e.g. the arrays of RoadNetwork) do not need to create Location instances.
+
+    :param lat_a: float
+    :param lon_a: float
+    :param lat_b: float
+    :param lon_b: float
+    :return: float
+
+    >>> print(great_circle_distance(39.564540, 115.739662, 39.533867, 115.746735))
+    3464.17661119
+    """
+    x1 = math.radians(lat_a)
+    y1 = math.radians(lon_a)
+    x2 = math.radians(lat_b)
+    y2 = math.radians(lon_b)
     temp = math.cos(x1) * math.cos(x2) * math.cos(y1 - y2) + math.sin(x1) * math.sin(x2)
     if temp > 1.000:
         temp = 1.0
@@ -156,3 +190,156 @@ def end_pos(start_pos, theta, d):
                                  math.cos(ad) - math.sin(lat_start) * math.sin(lat))
 
     return Location(math.degrees(lat), math.degrees(lon))
+
+
+def great_circle_distance_many(lat, lon, lats, lons):
+    """
+    Compute the distances in meters from one (lat, lon) pair to each pair of (lats, lons).
+
+    This is the vectorized counterpart of great_circle_distance(), used to score a whole candidate set in one call.
+
+    :param lat: latitude of the source
+    :param lon: longitude of the source
+    :param lats: latitudes of the targets
+    :param lons: longitudes of the targets
+    :type lat: float
+    :type lon: float
+    :type lats: numpy.ndarray | list[float]
+    :type lons: numpy.ndarray | list[float]
+    :return: the distances, in the order of the targets
+    :rtype: numpy.ndarray
+
+    >>> dis = great_circle_distance_many(39.564540, 115.739662, [39.564540, 39.533867], [115.739662, 115.746735])
+    >>> print(dis[0])
+    0.0
+    >>> print(float(dis[1]))
+    3464.17661119
+    """
+    x1 = math.radians(lat)
+    y1 = math.radians(lon)
+    x2 = np.radians(np.asarray(lats, dtype=np.float64))
+    y2 = np.radians(np.asarray(lons, dtype=np.float64))
+    temp = math.cos(x1) * np.cos(x2) * np.cos(y1 - y2) + math.sin(x1) * np.sin(x2)
+    return R * np.arccos(np.clip(temp, -1.0, 1.0))
+
+
+def great_circle_distance_matrix(lats_a, lons_a, lats_b, lons_b):
+    """
+    Compute the distances in meters between every pair of (lats_a, lons_a) and (lats_b, lons_b).
+
+    :param lats_a: latitudes of the sources
+    :param lons_a: longitudes of the sources
+    :param lats_b: latitudes of the targets
+    :param lons_b: longitudes of the targets
+    :type lats_a: numpy.ndarray | list[float]
+    :type lons_a: numpy.ndarray | list[float]
+    :type lats_b: numpy.ndarray | list[float]
+    :type lons_b: numpy.ndarray | list[float]
+    :return: a len(lats_a) x len(lats_b) matrix, the i-th row holds the distances from the i-th source
+    :rtype: numpy.ndarray
+
+    >>> dis = great_circle_distance_matrix([39.564540, 39.533867], [115.739662, 115.746735], [39.533867], [115.746735])
+    >>> dis.shape
+    (2, 1)
+    >>> print(float(dis[0, 0]))
+    3464.17661119
+    """
+    x1 = np.radians(np.asarray(lats_a, dtype=np.float64))[:, np.newaxis]
+    y1 = np.radians(np.asarray(lons_a, dtype=np.float64))[:, np.newaxis]
+    x2 = np.radians(np.asarray(lats_b, dtype=np.float64))[np.newaxis, :]
+    y2 = np.radians(np.asarray(lons_b, dtype=np.float64))[np.newaxis, :]
+    temp = np.cos(x1) * np.cos(x2) * np.cos(y1 - y2) + np.sin(x1) * np.sin(x2)
+    return R * np.arccos(np.clip(temp, -1.0, 1.0))
+
+
+def great_circle_distance_pairs(lats_a, lons_a, lats_b, lons_b):
+    """
+    Compute the distances in meters from each pair of (lats_a, lons_a) to the corresponding pair of (lats_b, lons_b).
+
+    :param lats_a: latitudes of the sources
+    :param lons_a: longitudes of the sources
+    :param lats_b: latitudes of the targets
+    :param lons_b: longitudes of the targets
+    :type lats_a: numpy.ndarray | list[float]
+    :type lons_a: numpy.ndarray | list[float]
+    :type lats_b: numpy.ndarray | list[float]
+    :type lons_b: numpy.ndarray | list[float]
+    :return: the distances
+    :rtype: numpy.ndarray
+
+    >>> print(float(great_circle_distance_pairs([39.564540], [115.739662], [39.533867], [115.746735])[0]))
+    3464.17661119
+    """
+    x1 = np.radians(np.asarray(lats_a, dtype=np.float64))
+    y1 = np.radians(np.asarray(lons_a, dtype=np.float64))
+    x2 = np.radians(np.asarray(lats_b, dtype=np.float64))
+    y2 = np.radians(np.asarray(lons_b, dtype=np.float64))
+    temp = np.cos(x1) * np.cos(x2) * np.cos(y1 - y2) + np.sin(x1) * np.sin(x2)
+    return R * np.arccos(np.clip(temp, -1.0, 1.0))
+
+
+def bearing_many(lats_a, lons_a, lats_b, lons_b):
+    """
+    Compute the bearings in radians from each pair of (lats_a, lons_a) to the corresponding pair of (lats_b, lons_b).
+
+    This is the vectorized counterpart of bearing(). A scalar source (or target) is broadcast against the other side.
+
+    :param lats_a: latitudes of the from locations
+    :param lons_a: longitudes of the from locations
+    :param lats_b: latitudes of the to locations
+    :param lons_b: longitudes of the to locations
+    :type lats_a: numpy.ndarray | list[float] | float
+    :type lons_a: numpy.ndarray | list[float] | float
+    :type lats_b: numpy.ndarray | list[float] | float
+    :type lons_b: numpy.ndarray | list[float] | float
+    :return: the bearings
+    :rtype: numpy.ndarray
+
+    >>> print(float(bearing_many([39.46696], [116.03663], [38.35996], [114.03663])[0]))
+    -2.17808092766
+    """
+    lat_a = np.radians(np.asarray(lats_a, dtype=np.float64))
+    lon_a = np.radians(np.asarray(lons_a, dtype=np.float64))
+    lat_b = np.radians(np.asarray(lats_b, dtype=np.float64))
+    lon_b = np.radians(np.asarray(lons_b, dtype=np.float64))
+
+    d_lon = lon_b - lon_a
+    y = np.cos(lat_b) * np.sin(d_lon)
+    x = np.cos(lat_a) * np.sin(lat_b) - np.sin(lat_a) * np.cos(lat_b) * np.cos(d_lon)
+    return np.arctan2(y, x)
+
+
+def end_pos_many(lats, lons, thetas, ds):
+    """
+    Find out the other points, given the starting points, the bearings and actual distances.
+
+    This is the vectorized counterpart of end_pos(). It returns plain arrays instead of Location instances.
+
+    :param lats: latitudes of the starting points
+    :param lons: longitudes of the starting points
+    :param thetas: the bearings in radians
+    :param ds: the actual distances (whose unit is the same as the radius of the Earth)
+    :type lats: numpy.ndarray | list[float] | float
+    :type lons: numpy.ndarray | list[float] | float
+    :type thetas: numpy.ndarray | list[float] | float
+    :type ds: numpy.ndarray | list[float] | float
+    :return: the latitudes and longitudes of the other points
+    :rtype: [numpy.ndarray, numpy.ndarray]
+
+    >>> [lats, lons] = end_pos_many([39.564540, 40.103722], [115.739662, 116.425209],
+    ...                             [2.96558662977, -3.128233061823583], [3464.17661119, 7])
+    >>> print(Location(float(lats[0]), float(lons[0])))
+    (39.533867, 115.746735)
+    >>> print(Location(float(lats[1]), float(lons[1])))
+    (40.1036590531, 116.4252079)
+    """
+    lat_start = np.radians(np.asarray(lats, dtype=np.float64))
+    lon_start = np.radians(np.asarray(lons, dtype=np.float64))
+    thetas = np.asarray(thetas, dtype=np.float64)
+    ad = np.asarray(ds, dtype=np.float64) / R  # the angular distance
+
+    lat = np.arcsin(np.sin(lat_start) * np.cos(ad) + np.cos(lat_start) * np.sin(ad) * np.cos(thetas))
+    lon = lon_start + np.arctan2(np.sin(thetas) * np.sin(ad) * np.cos(lat_start),
+                                 np.cos(ad) - np.sin(lat_start) * np.sin(lat))
+
+    return [np.degrees(lat), np.degrees(lon)]
@@ -0,0 +1,136 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the cache of the shortest paths, which sits in front of a routing function.
+
+In a busy simulation the taxis route between the same hot vertices again and again (the airport, the stations, the
+matched vertices of popular pickup points), so the result of a query (s_vid, e_vid) is kept and shared. A Path is
+immutable, so all the taxis on the same trip hold the same instance.
+
+The cache is bounded by the number of paths and, optionally, by their approximate memory size, and evicts the least
+recently used path. It is dropped as a whole when the road network changes (see RoadNetwork.version), e.g. when the
+weight of an edge is updated by RoadNetwork.set_weight().
+
+=== Constants ===
+PATH_CACHE_SIZE: int
+    The default maximum number of cached paths.
+"""
+
+
+import sys
+
+from road_network import RoadNetwork, Path, get_shortest_path
+from container import LRUCache
+
+
+PATH_CACHE_SIZE = 100000
+
+
+class PathCache:
+    """
+    A bounded LRU cache of (s_vid, e_vid) --> Path in front of a routing function.
+
+    A repeated query returns the same immutable Path, and the least recently used path is evicted beyond capacity:
+
+    >>> from road_network import make_grid_network
+    >>> road_network = make_grid_network(4, 5, one_way=0.0)
+    >>> cache = PathCache(capacity=2)
+    >>> path = cache.get_shortest_path(road_network, 0, 19)
+    >>> cache.get_shortest_path(road_network, 0, 19) is path
+    True
+    >>> path.distance = 0.0
+    Traceback (most recent call last):
+    ...
+    AttributeError: Path is immutable
+    >>> [cache.get_shortest_path(road_network, s, e).distance > 0 for s, e in [(0, 18), (1, 19), (0, 18)]]
+    [True, True, True]
+    >>> sorted(cache.paths.elements.keys()), cache.paths.hits, cache.paths.misses, cache.paths.evictions
+    ([(0, 18), (1, 19)], 2, 3, 1)
+
+    With max_bytes, the paths are evicted by their total size as well:
+
+    >>> small = PathCache(capacity=100, max_bytes=2 * path_size(path))
+    >>> [small.get_shortest_path(road_network, 0, e).distance > 0 for e in [19, 14, 9, 4]]
+    [True, True, True, True]
+    >>> small.paths.size <= small.paths.max_size, small.paths.evictions > 0
+    (True, True)
+
+    Changing a weight of the road network drops all the cached paths:
+
+    >>> road_network.set_weight(path.edge_list[0], 10000.0)
+    >>> detour = cache.get_shortest_path(road_network, 0, 19)
+    >>> detour is path, path.edge_list[0] in detour.edge_list, len(cache.paths), cache.invalidations
+    (False, False, 1, 1)
+    """
+
+    def __init__(self, router=get_shortest_path, capacity=PATH_CACHE_SIZE, max_bytes=None):
+        """
+        Initialize a PathCache.
+
+        :param router: the routing function whose results are cached, with the signature of get_shortest_path()
+        :param capacity: the maximum number of cached paths
+        :param max_bytes: the maximum approximate memory size of the cached paths, no limit if None
+        :type router: (RoadNetwork, int, int) -> Path
+        :type capacity: int
+        :type max_bytes: int
+        :return: None
+        """
+        self.router = router
+        self.paths = LRUCache(capacity, max_bytes, path_size)
+        self.road_network = None
+        self.version = None  # the version of the road network the cached paths were computed on
+        self.invalidations = 0
+
+    def __str__(self):
+        return "PathCache:\n- paths: {}\n- hits: {}\n- misses: {}\n- evictions: {}\n- invalidations: {}"\
+            .format(len(self.paths), self.paths.hits, self.paths.misses, self.paths.evictions, self.invalidations)
+
+    @property
+    def hit_rate(self):
+        num_lookup = self.paths.hits + self.paths.misses
+        return float(self.paths.hits) / num_lookup if num_lookup != 0 else 0.0
+
+    def get_shortest_path(self, road_network, s_vid, e_vid):
+        """
+        Return the shortest path from vertex s_vid to vertex e_vid, from the cache if possible.
+
+        A miss is routed by the wrapped router and its Path kept under (s_vid, e_vid); all the kept paths are dropped
+        first if road_network is not the one they were computed on, or if its version has changed since.
+
+        :param road_network: RoadNetwork
+        :param s_vid: int
+        :param e_vid: int
+        :return: Path
+        """
+        if road_network is not self.road_network or road_network.version != self.version:
+            self.invalidate()
+            self.road_network = road_network
+            self.version = road_network.version
+
+        path = self.paths.get((s_vid, e_vid))
+        if path is None:
+            path = self.router(road_network, s_vid, e_vid)
+            self.paths.put((s_vid, e_vid), path)
+        return path
+
+    def invalidate(self):
+        """
+        Drop all the cached paths.
+
+        :return: None
+        """
+        if len(self.paths) != 0:
+            self.paths.clear()
+            self.invalidations += 1
+
+
+def path_size(path):
+    """
+    Return the approximate memory size of a Path in bytes, counting its tuples and their int items.
+
+    :param path: Path
+    :return: int
+    """
+    num_item = len(path.vertex_list) + len(path.edge_list)
+    return sys.getsizeof(path) + sys.getsizeof(path.vertex_list) + sys.getsizeof(path.edge_list) + \
+        num_item * sys.getsizeof(0)
@@ -11,13 +11,15 @@ Description: This module contains the abstraction of the Query of the passengers
 
 import os
 
-from geohash import geo_encode
+from geohash import geo_encode_many, geohash_to_str_many
 from constants import PRECISION, PATIENCE, WAITING, CANCELLED, MAX_INT, SIM_START_TIME, SIM_END_TIME
 from location import Location
 from container import PriorityQueue
 from road_network import RoadNetwork
 from spatio_temporal_index import SpatioTemporalDatabase
-from routing import ScheduleNode, map_match
+from routing import ScheduleNode, map_match, map_match_many, map_match_edges
+from vertex_index import VertexIndex
+from edge_index import EdgeIndex
 
 
 class TimeWindow:
@@ -72,8 +74,8 @@ class Query:
         self.origin = origin
         self.destination = destination
 
-        self.o_geohash = geo_encode(origin.lat, origin.lon, PRECISION)
-        self.d_geohash = geo_encode(destination.lat, destination.lon, PRECISION)
+        self.o_geohash = origin.geohash
+        self.d_geohash = destination.geohash
 
         self.o_schedule_node = o_schedule_node
         self.d_schedule_node = d_schedule_node
@@ -92,18 +94,26 @@ class Query:
     def __eq__(self, other):
         return self.id == other.id
 
-    def init_schedule_node(self, road_network, database):
+    def init_schedule_node(self, road_network, database, vertex_mask=None, vertex_index=None, edge_index=None):
         """
         Initialize the two ScheduleNode of a query.
 
         :param road_network: the road network
         :param database: the spatio-temporal database
+        :param vertex_mask: the vertices that may be matched, see routing.map_match()
+        :param vertex_index: the nearest-vertex index, see routing.map_match()
+        :param edge_index: the nearest-edge index, see routing.map_match()
         :type road_network: RoadNetwork
         :type database: SpatioTemporalDatabase
+        :type vertex_mask: numpy.ndarray
+        :type vertex_index: VertexIndex
+        :type edge_index: EdgeIndex
         :return: None
         """
-        self.o_schedule_node = map_match(self.id, self.origin, True, road_network, database)
-        self.d_schedule_node = map_match(self.id, self.destination, False, road_network, database)
+        self.o_schedule_node = map_match(self.id, self.origin, True, road_network, database, vertex_mask, vertex_index,
+                                         edge_index)
+        self.d_schedule_node = map_match(self.id, self.destination, False, road_network, database, vertex_mask,
+                                         vertex_index, edge_index)
 
     def update_status(self, timestamp):
         """
@@ -150,6 +160,7 @@ def load_query():
         i += 1
         print("Loading the %d-th file..." % i)
         cur_file = open("./data/queries/" + file_name)
+        rows = []
         for line in cur_file:
             [time_str, ori_lat, ori_lon, des_lat, des_lon] = line.split(',')
             time_tuple = datetime.strptime(time_str, '%H:%M:%S')
@@ -158,33 +169,53 @@ def load_query():
             if timestamp < SIM_START_TIME or timestamp > SIM_END_TIME:
                 continue
 
-            ori_lat = float(ori_lat)
-            ori_lon = float(ori_lon)
-            des_lat = float(des_lat)
-            des_lon = float(des_lon)
-            origin = Location(ori_lat, ori_lon)
-            destination = Location(des_lat, des_lon)
+            rows.append((timestamp, float(ori_lat), float(ori_lon), float(des_lat), float(des_lon)))
+        cur_file.close()
+        if len(rows) == 0:
+            continue
+
+        # Encode the GeoHash of all the origins and destinations of the file at once.
+        [timestamps, ori_lats, ori_lons, des_lats, des_lons] = zip(*rows)
+        o_geohashes = geohash_to_str_many(geo_encode_many(ori_lats, ori_lons, PRECISION), PRECISION).tolist()
+        d_geohashes = geohash_to_str_many(geo_encode_many(des_lats, des_lons, PRECISION), PRECISION).tolist()
+
+        for k in range(len(rows)):
+            origin = Location(ori_lats[k], ori_lons[k], str(o_geohashes[k]))
+            destination = Location(des_lats[k], des_lons[k], str(d_geohashes[k]))
 
-            query = Query(identifier, timestamp, origin, destination)
+            query = Query(identifier, timestamps[k], origin, destination)
             query_set[identifier] = query
-            query_queue.put(query, timestamp)
+            query_queue.put(query, timestamps[k])
 
             identifier += 1
-        cur_file.close()
     print("Done. Elapsed time is %f seconds" % (time.clock() - start_time))
     return [query_set, query_queue]
 
 
-def init_schedule_node(query_queue, road_network, database):
+def init_schedule_node(query_queue, road_network, database, vertex_mask=None, vertex_index=None, cache_path=None,
+                       edge_index=None):
     """
     Create ScheduleNode of all the queries.
 
+    With a nearest-vertex index, the coordinate columns of all the origins and destinations are matched in one batch,
+    and the matched coordinates are cached in directory cache_path if it is given, see routing.map_match_many(). With
+    a nearest-edge index, they are matched in one batch to the closest points of the edges instead, see
+    routing.map_match_edges().
+
     :param query_queue: query queue
     :param road_network: road network
     :param database: spatio-temporal database
+    :param vertex_mask: the vertices that may be matched, see routing.map_match()
+    :param vertex_index: the nearest-vertex index, see routing.map_match()
+    :param cache_path: the directory of the cache of the matched coordinates
+    :param edge_index: the nearest-edge index, see routing.map_match()
     :type query_queue: PriorityQueue
     :type road_network: RoadNetwork
     :type database: SpatioTemporalDatabase
+    :type vertex_mask: numpy.ndarray
+    :type vertex_index: VertexIndex
+    :type cache_path: str
+    :type edge_index: EdgeIndex
     :return: None
     """
     import time
@@ -192,11 +223,44 @@ def init_schedule_node(query_queue, road_network, database):
     print("Initializing the schedule node of queries (will take about 88 sec)...")
     start_time = time.clock()
 
+    if edge_index is not None or vertex_index is not None:
+        queries = [item[1] for item in query_queue.elements]
+        lats = [query.origin.lat for query in queries] + [query.destination.lat for query in queries]
+        lons = [query.origin.lon for query in queries] + [query.destination.lon for query in queries]
+        if edge_index is not None:
+            [e_ids, offsets] = map_match_edges(lats, lons, edge_index)
+            e_ids = e_ids.tolist()
+            offsets = offsets.tolist()
+            for k, query in enumerate(queries):
+                query.o_schedule_node = _edge_schedule_node(query.id, True, e_ids[k], offsets[k], road_network)
+                query.d_schedule_node = _edge_schedule_node(query.id, False, e_ids[len(queries) + k],
+                                                            offsets[len(queries) + k], road_network)
+        else:
+            matched_vids = map_match_many(lats, lons, vertex_index, cache_path).tolist()
+            for k, query in enumerate(queries):
+                o_vid = matched_vids[k]
+                d_vid = matched_vids[len(queries) + k]
+                query.o_schedule_node = ScheduleNode(query.id, True, o_vid if o_vid >= 0 else None)
+                query.d_schedule_node = ScheduleNode(query.id, False, d_vid if d_vid >= 0 else None)
+        print("Done. Elapsed time is %f seconds" % (time.clock() - start_time))
+        return
+
     cnt = 0
     for item in query_queue.elements:
-        item[1].init_schedule_node(road_network, database)
+        item[1].init_schedule_node(road_network, database, vertex_mask)
         cnt += 1
         if divmod(cnt, 1000)[1] == 0:
             print cnt
 
     print("Done. Elapsed time is %f seconds" % (time.clock() - start_time))
+
+
+def _edge_schedule_node(query_id, is_origin, e_id, offset, road_network):
+    """
+    Create the ScheduleNode of a location matched to the point offset along edge e_id (-1 if it is not matched).
+
+    :rtype: ScheduleNode
+    """
+    if e_id < 0:
+        return ScheduleNode(query_id, is_origin, None)
+    return ScheduleNode(query_id, is_origin, road_network.get_edge(e_id).start_vid, e_id, offset)
@@ -14,9 +14,14 @@ OUT_EDGE: str
 """
 
 
-from location import Location, get_distance
-from container import Queue, PriorityQueue
+from location import Location, get_distance, great_circle_distance
+from geohash import geo_encode_many, geohash_to_str_many
+from container import Queue, PriorityQueue, IndexedPriorityQueue
+from constants import PRECISION
 
+import random
+
+import numpy as np
 import pandas as pd
 
 
@@ -167,25 +172,199 @@ class Edge:
         return self.weight
 
 
-class RoadNetwork:
+def _as_id_array(ids, name):
+    """
+    Convert a sequence of ids to an int64 array, checking that all of them are non-negative integers.
+
+    :param ids: sequence of ids
+    :param name: the name of the ids, used in the error message
+    :type name: str
+    :return: numpy.ndarray
+    """
+    ids = np.asarray(ids)
+    if ids.dtype.kind == 'f':
+        if not np.all(np.mod(ids, 1) == 0):
+            raise ValueError("%s must be integers" % name)
+    elif ids.dtype.kind not in 'iu' and len(ids) != 0:
+        raise ValueError("%s must be integers" % name)
+    ids = ids.astype(np.int64)
+    if len(ids) != 0 and ids.min() < 0:
+        raise ValueError("%s must be non-negative" % name)
+    return ids
+
+
+class _VertexSet:
+    """
+    A read-only, dict-like view of the vertices of a RoadNetwork.
+
+    Iterating the view yields vertex ids and indexing it yields Vertex instances that are built on demand from the
+    arrays of the road network, so code written against the former "vertex_set" dict keeps working.
+    """
+
+    def __init__(self, road_network):
+        self.road_network = road_network
+
+    def __len__(self):
+        return self.road_network.num_vertex
+
+    def __contains__(self, v_id):
+        return self.road_network.has_vertex(v_id)
+
+    def __iter__(self):
+        return iter(self.road_network.get_vertex_ids())
+
+    def __getitem__(self, v_id):
+        vertex = self.road_network.get_vertex(v_id)
+        if vertex is None:
+            raise KeyError(v_id)
+        return vertex
+
+    def keys(self):
+        return self.road_network.get_vertex_ids()
+
+
+class _EdgeSet:
+    """
+    A read-only, dict-like view of the edges of a RoadNetwork. See _VertexSet.
+    """
+
+    def __init__(self, road_network):
+        self.road_network = road_network
+
+    def __len__(self):
+        return self.road_network.num_edge
+
+    def __contains__(self, e_id):
+        return self.road_network.get_edge(e_id) is not None
+
+    def __iter__(self):
+        return iter(self.road_network.get_edge_ids())
+
+    def __getitem__(self, e_id):
+        edge = self.road_network.get_edge(e_id)
+        if edge is None:
+            raise KeyError(e_id)
+        return edge
+
+    def keys(self):
+        return self.road_network.get_edge_ids()
+
+
+class RoadNetwork(object):
     """
     The abstraction data type of the road network.
+
+    The graph is stored in compressed sparse row (CSR) form: the out-edges of vertex v occupy the positions
+    offsets[v]:offsets[v+1] of the arrays targets (end vertex), edge_ids and weights. The reverse adjacency is stored
+    the same way: the in-edges of vertex v occupy the positions r_offsets[v]:r_offsets[v+1] of the arrays sources
+    (start vertex), r_edge_ids and r_weights. The vertex and edge attributes
+    live in arrays indexed directly by id, since both kinds of id are consecutive integers. Vertex and Edge instances
+    are only created on demand, as thin views over these arrays.
+
+    add_vertex() and add_edge() stage their arguments; the staged items are merged into the arrays by pack(), which
+    every accessor calls lazily.
     """
 
+    # names of the arrays that fully describe a packed road network, see to_arrays() and from_arrays()
+    ARRAY_NAMES = ('v_exists', 'v_lat', 'v_lon', 'v_geohash',
+                   'e_exists', 'e_start', 'e_end', 'e_weight',
+                   'offsets', 'targets', 'edge_ids', 'weights',
+                   'r_offsets', 'sources', 'r_edge_ids', 'r_weights')
+
     def __init__(self):
         """
         Initialize a RoadNetwork.
 
         :return: None
         """
-        self.num_vertex = 0
-        self.num_edge = 0
-        self.vertex_set = dict()
-        self.edge_set = dict()
+        # Vertex attributes, indexed by v_id.
+        self.v_exists = np.zeros(0, dtype=bool)
+        self.v_lat = np.zeros(0)
+        self.v_lon = np.zeros(0)
+        self.v_geohash = np.zeros(0, dtype='U%d' % PRECISION)
+
+        # Edge attributes, indexed by e_id.
+        self.e_exists = np.zeros(0, dtype=bool)
+        self.e_start = np.zeros(0, dtype=np.int32)
+        self.e_end = np.zeros(0, dtype=np.int32)
+        self.e_weight = np.zeros(0)
+
+        # CSR adjacency.
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.targets = np.zeros(0, dtype=np.int32)
+        self.edge_ids = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0)
+
+        # Reverse CSR adjacency.
+        self.r_offsets = np.zeros(1, dtype=np.int64)
+        self.sources = np.zeros(0, dtype=np.int32)
+        self.r_edge_ids = np.zeros(0, dtype=np.int32)
+        self.r_weights = np.zeros(0)
+
+        self.vertex_set = _VertexSet(self)
+        self.edge_set = _EdgeSet(self)
+
+        self.__num_vertex = 0
+        self.__num_edge = 0
+        self.__version = 0
+        self.__dirty = False
+        self.__staged_vertices = []    # list of (v_id, lat, lon)
+        self.__staged_edges = []       # list of (e_id, start_vid, end_vid, weight)
+        self.__vertex_chunks = []      # list of (v_ids, lats, lons) arrays
+        self.__edge_chunks = []        # list of (e_ids, start_vids, end_vids, weights) arrays
 
     def __str__(self):
         return "RoadNetwork:\n- num vertex: {}\n- num edge: {}".format(self.num_vertex, self.num_edge)
 
+    def to_arrays(self):
+        """
+        Return the arrays of the packed road network.
+
+        :return: dict[str, numpy.ndarray]
+        """
+        self.pack()
+        return {name: getattr(self, name) for name in self.ARRAY_NAMES}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Create a road network from the arrays returned by to_arrays().
+
+        The arrays are used as they are (not copied), so they may be read-only memory maps; they are only copied if
+        vertices or edges are added afterwards.
+
+        :param arrays: dict[str, numpy.ndarray]
+        :return: RoadNetwork
+        """
+        road_network = cls()
+        for name in cls.ARRAY_NAMES:
+            setattr(road_network, name, arrays[name])
+        road_network.__num_vertex = int(np.count_nonzero(road_network.v_exists))
+        road_network.__num_edge = int(np.count_nonzero(road_network.e_exists))
+        return road_network
+
+    @property
+    def num_vertex(self):
+        if self.__dirty:
+            self.pack()
+        return self.__num_vertex
+
+    @property
+    def num_edge(self):
+        if self.__dirty:
+            self.pack()
+        return self.__num_edge
+
+    @property
+    def version(self):
+        """
+        A counter which changes whenever the edges or their weights change, so the results derived from the road
+        network (e.g. the cached paths of PathCache) can tell if they are stale.
+        """
+        if self.__dirty:
+            self.pack()
+        return self.__version
+
     def add_vertex(self, v_id, lat=None, lon=None):
         """
         Add a vertex.
@@ -195,32 +374,285 @@ class RoadNetwork:
         :param lon: float
         :return: None
         """
-        if v_id not in self.vertex_set:
-            self.num_vertex += 1
-        location = Location(lat, lon)
-        vertex = Vertex(v_id, location)
-        self.vertex_set[v_id] = vertex
+        self.__staged_vertices.append((v_id, lat, lon))
+        self.__dirty = True
 
     def add_edge(self, e_id, start_vid, end_vid, weight):
         """
         Add an edge.
 
+        The end vertices are added (without location) if they do not exist yet.
+
         :param e_id: int
         :param start_vid: int
         :param end_vid: int
         :param weight: float
         :return: None
         """
+        self.__staged_edges.append((e_id, start_vid, end_vid, weight))
+        self.__dirty = True
+
+    def add_vertices(self, v_ids, lats, lons):
+        """
+        Add vertices in bulk.
+
+        This is the vectorized version of add_vertex(), e.g. for the columns of a DataFrame.
+
+        :param v_ids: array of vertex ids
+        :param lats: array of latitudes
+        :param lons: array of longitudes
+        :type v_ids: numpy.ndarray
+        :type lats: numpy.ndarray
+        :type lons: numpy.ndarray
+        :return: None
+        """
+        self.__flush_staged_vertices()
+        chunk = (_as_id_array(v_ids, "v_id"), np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+        self.__vertex_chunks.append(chunk)
+        self.__dirty = True
+
+    def add_edges(self, e_ids, start_vids, end_vids, weights):
+        """
+        Add edges in bulk.
+
+        This is the vectorized version of add_edge(), e.g. for the columns of a DataFrame.
+
+        :param e_ids: array of edge ids
+        :param start_vids: array of start vertex ids
+        :param end_vids: array of end vertex ids
+        :param weights: array of edge lengths
+        :type e_ids: numpy.ndarray
+        :type start_vids: numpy.ndarray
+        :type end_vids: numpy.ndarray
+        :type weights: numpy.ndarray
+        :return: None
+        """
+        self.__flush_staged_edges()
+        chunk = (_as_id_array(e_ids, "e_id"), _as_id_array(start_vids, "start_vid"),
+                 _as_id_array(end_vids, "end_vid"), np.asarray(weights, dtype=float))
+        self.__edge_chunks.append(chunk)
+        self.__dirty = True
+
+    def __flush_staged_vertices(self):
+        """
+        Turn the vertices staged by add_vertex() into a chunk, so that they keep their order relative to the chunks
+        staged by add_vertices().
+
+        :return: None
+        """
+        if len(self.__staged_vertices) == 0:
+            return
+        [v_ids, lats, lons] = zip(*self.__staged_vertices)
+        chunk = (_as_id_array(v_ids, "v_id"), np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+        self.__vertex_chunks.append(chunk)
+        self.__staged_vertices = []
+
+    def __flush_staged_edges(self):
+        """
+        Turn the edges staged by add_edge() into a chunk. See __flush_staged_vertices().
 
-        if e_id not in self.edge_set:
-            self.num_edge += 1
-        if start_vid not in self.vertex_set:
-            self.add_vertex(start_vid)
-        if end_vid not in self.vertex_set:
-            self.add_vertex(end_vid)
-        edge = Edge(e_id, start_vid, end_vid, weight)
-        self.edge_set[edge.id] = edge
-        self.vertex_set[start_vid].add_neighbor(end_vid, e_id)
+        :return: None
+        """
+        if len(self.__staged_edges) == 0:
+            return
+        [e_ids, start_vids, end_vids, weights] = zip(*self.__staged_edges)
+        chunk = (_as_id_array(e_ids, "e_id"), _as_id_array(start_vids, "start_vid"),
+                 _as_id_array(end_vids, "end_vid"), np.asarray(weights, dtype=float))
+        self.__edge_chunks.append(chunk)
+        self.__staged_edges = []
+
+    def pack(self):
+        """
+        Merge the staged vertices and edges into the arrays and rebuild the CSR adjacency.
+
+        Between two vertices, only the shortest edge (the one with the smallest id among equally short ones) is kept in
+        the adjacency, since no shortest path takes a longer parallel edge.
+
+        :return: None
+        """
+        if not self.__dirty:
+            return
+        self.__flush_staged_vertices()
+        self.__flush_staged_edges()
+        for name in self.ARRAY_NAMES:
+            if not getattr(self, name).flags.writeable:  # e.g. memory-mapped from a snapshot
+                setattr(self, name, np.array(getattr(self, name)))
+
+        new_vids = [np.zeros(0, dtype=np.int64)]
+        for [v_ids, lats, lons] in self.__vertex_chunks:
+            if len(v_ids) == 0:
+                continue
+            self.__resize_vertices(v_ids.max() + 1)
+            self.v_exists[v_ids] = True
+            self.v_lat[v_ids] = lats
+            self.v_lon[v_ids] = lons
+            new_vids.append(v_ids)
+
+        for [e_ids, start_vids, end_vids, weights] in self.__edge_chunks:
+            if len(e_ids) == 0:
+                continue
+            self.__resize_edges(e_ids.max() + 1)
+            self.e_exists[e_ids] = True
+            self.e_start[e_ids] = start_vids
+            self.e_end[e_ids] = end_vids
+            self.e_weight[e_ids] = weights
+
+            # Add the end vertices that have not been added explicitly.
+            end_points = np.concatenate((start_vids, end_vids))
+            self.__resize_vertices(end_points.max() + 1)
+            missing = np.unique(end_points[~self.v_exists[end_points]])
+            self.v_exists[missing] = True
+            new_vids.append(missing)
+
+        new_vids = np.unique(np.concatenate(new_vids))
+        self.v_geohash[new_vids] = geohash_to_str_many(
+            geo_encode_many(self.v_lat[new_vids], self.v_lon[new_vids], PRECISION), PRECISION)
+
+        self.__vertex_chunks = []
+        self.__edge_chunks = []
+        self.__num_vertex = int(np.count_nonzero(self.v_exists))
+        self.__num_edge = int(np.count_nonzero(self.e_exists))
+        self.__build_csr()
+        self.__version += 1
+        self.__dirty = False
+
+    def set_weight(self, e_id, weight):
+        """
+        Change the weight of edge e_id, e.g. to reflect the traffic.
+
+        The CSR arrays are updated in place. The preprocessed data of the routing engines (ContractionHierarchy,
+        LandmarkTable, HubLabels) are not, so they should be rebuilt after the weights change.
+
+        :param e_id: int
+        :param weight: float
+        :return: None
+
+        The adjacency keeps the shortest of the parallel edges, also as their weights change:
+
+        >>> road_network = RoadNetwork()
+        >>> road_network.add_vertices([0, 1], [39.9, 39.9], [116.3, 116.301])
+        >>> road_network.add_edges([0, 1, 2], [0, 0, 1], [1, 1, 0], [5.0, 3.0, 4.0])
+        >>> road_network.get_eid(0, 1), road_network.get_weight(0, 1)
+        (1, 3.0)
+        >>> road_network.set_weight(1, 10.0)
+        >>> road_network.get_eid(0, 1), road_network.get_weight(0, 1)
+        (0, 5.0)
+        >>> road_network.set_weight(1, 2.0)
+        >>> road_network.get_eid(0, 1), road_network.get_weight(0, 1), list(road_network.r_edge_ids)
+        (1, 2.0, [2, 1])
+        """
+        if self.__dirty:
+            self.pack()
+        if not (0 <= e_id < len(self.e_exists) and self.e_exists[e_id]):
+            raise ValueError("no edge %d" % e_id)
+        for name in ('e_weight', 'edge_ids', 'weights', 'r_edge_ids', 'r_weights'):
+            if not getattr(self, name).flags.writeable:  # e.g. memory-mapped from a snapshot
+                setattr(self, name, np.array(getattr(self, name)))
+
+        old_weight = self.e_weight[e_id]
+        self.e_weight[e_id] = weight
+        # The adjacency keeps the shortest of the parallel edges from start_vid to end_vid, see pack().
+        [start_vid, end_vid] = [int(self.e_start[e_id]), int(self.e_end[e_id])]
+        lo = self.offsets[start_vid]
+        slot = lo + int(np.flatnonzero(self.targets[lo:self.offsets[start_vid + 1]] == end_vid)[0])
+        kept = int(self.edge_ids[slot])
+        if kept == e_id and weight > old_weight:
+            # A parallel edge may be shorter now.
+            parallel = np.flatnonzero(self.e_exists & (self.e_start == start_vid) & (self.e_end == end_vid))
+            kept = int(parallel[np.lexsort((parallel, self.e_weight[parallel]))[0]])
+        elif kept != e_id and (weight, e_id) < (self.weights[slot], kept):
+            kept = e_id
+        r_lo = self.r_offsets[end_vid]
+        r_slot = r_lo + int(np.flatnonzero(self.sources[r_lo:self.r_offsets[end_vid + 1]] == start_vid)[0])
+        self.edge_ids[slot] = self.r_edge_ids[r_slot] = kept
+        self.weights[slot] = self.r_weights[r_slot] = self.e_weight[kept]
+        self.__version += 1
+
+    def __resize_vertices(self, size):
+        old_size = len(self.v_exists)
+        if size <= old_size:
+            return
+        self.v_exists = np.concatenate((self.v_exists, np.zeros(size - old_size, dtype=bool)))
+        self.v_lat = np.concatenate((self.v_lat, np.full(size - old_size, np.nan)))
+        self.v_lon = np.concatenate((self.v_lon, np.full(size - old_size, np.nan)))
+        self.v_geohash = np.concatenate((self.v_geohash, np.zeros(size - old_size, dtype=self.v_geohash.dtype)))
+
+    def __resize_edges(self, size):
+        old_size = len(self.e_exists)
+        if size <= old_size:
+            return
+        self.e_exists = np.concatenate((self.e_exists, np.zeros(size - old_size, dtype=bool)))
+        self.e_start = np.concatenate((self.e_start, np.zeros(size - old_size, dtype=np.int32)))
+        self.e_end = np.concatenate((self.e_end, np.zeros(size - old_size, dtype=np.int32)))
+        self.e_weight = np.concatenate((self.e_weight, np.zeros(size - old_size)))
+
+    def __build_csr(self):
+        """
+        Build the CSR adjacency and the reverse CSR adjacency from the edge arrays.
+
+        :return: None
+        """
+        e_ids = np.flatnonzero(self.e_exists)
+        start_vids = self.e_start[e_ids]
+        end_vids = self.e_end[e_ids]
+
+        # Sort by (start_vid, end_vid, weight, e_id) and keep the first edge of each (start_vid, end_vid) group.
+        order = np.lexsort((e_ids, self.e_weight[e_ids], end_vids, start_vids))
+        e_ids = e_ids[order]
+        start_vids = start_vids[order]
+        end_vids = end_vids[order]
+        keep = np.ones(len(e_ids), dtype=bool)
+        keep[1:] = (start_vids[1:] != start_vids[:-1]) | (end_vids[1:] != end_vids[:-1])
+        e_ids = e_ids[keep]
+        start_vids = start_vids[keep]
+        end_vids = end_vids[keep]
+
+        counts = np.bincount(start_vids, minlength=len(self.v_exists))
+        self.offsets = np.zeros(len(self.v_exists) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.targets = end_vids.astype(np.int32)
+        self.edge_ids = e_ids.astype(np.int32)
+        self.weights = self.e_weight[e_ids]
+
+        # The same edges, grouped by end_vid.
+        order = np.argsort(end_vids, kind='mergesort')
+        counts = np.bincount(end_vids, minlength=len(self.v_exists))
+        self.r_offsets = np.zeros(len(self.v_exists) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.r_offsets[1:])
+        self.sources = start_vids[order].astype(np.int32)
+        self.r_edge_ids = e_ids[order].astype(np.int32)
+        self.r_weights = self.weights[order]
+
+    def has_vertex(self, v_id):
+        """
+        Return True if vertex v_id exists, otherwise return False.
+
+        :param v_id: int
+        :return: bool
+        """
+        if self.__dirty:
+            self.pack()
+        return 0 <= v_id < len(self.v_exists) and bool(self.v_exists[v_id])
+
+    def get_vertex_ids(self):
+        """
+        Return the ids of all the vertices in ascending order.
+
+        :return: list[int]
+        """
+        if self.__dirty:
+            self.pack()
+        return np.flatnonzero(self.v_exists).tolist()
+
+    def get_edge_ids(self):
+        """
+        Return the ids of all the edges in ascending order.
+
+        :return: list[int]
+        """
+        if self.__dirty:
+            self.pack()
+        return np.flatnonzero(self.e_exists).tolist()
 
     def get_vertex(self, v_id):
         """
@@ -229,11 +661,50 @@ class RoadNetwork:
         :return: Vertex instance
         :rtype: Vertex
         """
-        if v_id in self.vertex_set:
-            return self.vertex_set[v_id]
-        else:
+        if not self.has_vertex(v_id):
             return None
 
+        vertex = Vertex(v_id, self.get_location(v_id))
+        [lo, hi] = self.offsets[v_id:v_id + 2]
+        vertex.connected_to = dict(zip(self.targets[lo:hi].tolist(), self.edge_ids[lo:hi].tolist()))
+        return vertex
+
+    def get_location(self, v_id):
+        """
+        Return the location of vertex v_id, without creating a Vertex.
+
+        :param v_id: int
+        :return: Location
+        """
+        if self.__dirty:
+            self.pack()
+        return Location(float(self.v_lat[v_id]), float(self.v_lon[v_id]), str(self.v_geohash[v_id]))
+
+    def get_coordinates(self, v_ids):
+        """
+        Return the latitudes and longitudes of the vertexes v_ids, for the vectorized kernels of the location module.
+
+        :param v_ids: the vertex ids
+        :type v_ids: numpy.ndarray | list[int]
+        :return: the latitudes and the longitudes, in the order of v_ids
+        :rtype: [numpy.ndarray, numpy.ndarray]
+        """
+        if self.__dirty:
+            self.pack()
+        v_ids = np.asarray(v_ids, dtype=np.int64)
+        return [self.v_lat[v_ids], self.v_lon[v_ids]]
+
+    def get_geohash(self, v_id):
+        """
+        Return the GeoHash of the location of vertex v_id, without creating a Vertex.
+
+        :param v_id: int
+        :return: str
+        """
+        if self.__dirty:
+            self.pack()
+        return str(self.v_geohash[v_id])
+
     def get_edge(self, e_id):
         """
         :param e_id: id of the required edge
@@ -241,12 +712,30 @@ class RoadNetwork:
         :return: required Edge instance
         :rtype: Edge
         """
-
-        if e_id in self.edge_set:
-            return self.edge_set[e_id]
+        if self.__dirty:
+            self.pack()
+        if 0 <= e_id < len(self.e_exists) and self.e_exists[e_id]:
+            return Edge(e_id, int(self.e_start[e_id]), int(self.e_end[e_id]), float(self.e_weight[e_id]))
         else:
             return None
 
+    def get_location_on_edge(self, e_id, offset):
+        """
+        Return the location at offset meters from the start of edge e_id, interpolated on the straight segment of the
+        edge (the offset is scaled from the weight of the edge to the length of the segment).
+
+        :param e_id: int
+        :param offset: float
+        :return: Location
+        """
+        if self.__dirty:
+            self.pack()
+        [s_vid, e_vid] = [int(self.e_start[e_id]), int(self.e_end[e_id])]
+        weight = float(self.e_weight[e_id])
+        t = min(max(offset / weight, 0.0), 1.0) if weight > 0 else 0.0
+        return Location(float(self.v_lat[s_vid] + t * (self.v_lat[e_vid] - self.v_lat[s_vid])),
+                        float(self.v_lon[s_vid] + t * (self.v_lon[e_vid] - self.v_lon[s_vid])))
+
     def get_neighbors(self, s_vid):
         """
         Return the neighbor list of vertex s_vid.
@@ -254,7 +743,22 @@ class RoadNetwork:
         :param s_vid: int
         :return: list[int]
         """
-        return self.vertex_set[s_vid].connected_to.keys()
+        if self.__dirty:
+            self.pack()
+        [lo, hi] = self.offsets[s_vid:s_vid + 2]
+        return self.targets[lo:hi].tolist()
+
+    def get_predecessors(self, e_vid):
+        """
+        Return the list of the vertices which have an edge to vertex e_vid.
+
+        :param e_vid: int
+        :return: list[int]
+        """
+        if self.__dirty:
+            self.pack()
+        [lo, hi] = self.r_offsets[e_vid:e_vid + 2]
+        return self.sources[lo:hi].tolist()
 
     def get_eid(self, start_vid, end_vid):
         """
@@ -264,10 +768,14 @@ class RoadNetwork:
         :param end_vid: int
         :return: int
         """
-        if end_vid not in self.vertex_set[start_vid].connected_to:
+        if self.__dirty:
+            self.pack()
+        [lo, hi] = self.offsets[start_vid:start_vid + 2]
+        targets = self.targets[lo:hi].tolist()
+        if end_vid not in targets:
             return None
 
-        return self.vertex_set[start_vid].connected_to[end_vid]
+        return int(self.edge_ids[lo + targets.index(end_vid)])
 
     def get_weight(self, start_vid, end_vid):
         """
@@ -277,9 +785,12 @@ class RoadNetwork:
         :param end_vid: int
         :return: float
         """
-        if end_vid in self.vertex_set[start_vid].connected_to:
-            e_id = self.vertex_set[start_vid].connected_to[end_vid]
-            return self.edge_set[e_id].weight
+        if self.__dirty:
+            self.pack()
+        [lo, hi] = self.offsets[start_vid:start_vid + 2]
+        targets = self.targets[lo:hi].tolist()
+        if end_vid in targets:
+            return float(self.weights[lo + targets.index(end_vid)])
         else:
             return float('inf')
 
@@ -291,53 +802,122 @@ class RoadNetwork:
         :param end_vid: int
         :return: float
         """
-        v_start = self.get_vertex(start_vid)
-        v_end = self.get_vertex(end_vid)
-        return get_distance(v_start.location, v_end.location)
+        if self.__dirty:
+            self.pack()
+        return great_circle_distance(self.v_lat[start_vid], self.v_lon[start_vid],
+                                     self.v_lat[end_vid], self.v_lon[end_vid])
 
 
-def load_data():
+def load_data(vertices_file="./data/vertices.csv", edges_file="./data/edges.csv"):
     """
     load vertices and edges data from "./data" using Pandas and create the road network.
 
-    It will take about 30 seconds.
+    The vertices and edges are added column-wise with RoadNetwork.add_vertices() and RoadNetwork.add_edges(), which
+    takes a few seconds.
 
+    :param vertices_file: path of the vertices csv file
+    :param edges_file: path of the edges csv file
+    :type vertices_file: str
+    :type edges_file: str
     :return: RoadNetwork
     """
     import time
 
-    print("Loading data and create road network (about 30 sec)...")
+    print("Loading data and create road network (a few seconds)...")
     start_time = time.clock()
 
     road_network = RoadNetwork()
 
-    vertices = pd.read_csv("./data/vertices.csv")
-    edges = pd.read_csv("./data/edges.csv")
+    vertices = pd.read_csv(vertices_file)
+    edges = pd.read_csv(edges_file)
 
     print("Loading vertices...")
-    for index, row in vertices.iterrows():
-        road_network.add_vertex(int(row['v_id']), row['lat'], row['lon'])
+    road_network.add_vertices(vertices['v_id'].values, vertices['lat'].values, vertices['lon'].values)
 
     print("Loading edges...")
-    for index, row in edges.iterrows():
-        road_network.add_edge(int(row['e_id']), int(row['start_vid']), int(row['end_vid']), row['length'])
+    road_network.add_edges(edges['e_id'].values, edges['start_vid'].values, edges['end_vid'].values,
+                           edges['length'].values)
+
+    print("Packing the road network...")
+    road_network.pack()
 
     print("Done. Elapsed time is %f seconds" % (time.clock() - start_time))
 
     return road_network
 
 
-def is_reachable(road_network, s_vid, e_vid):
+def make_grid_network(num_rows, num_cols, one_way=0.5, shape_points=0, seed=0):
+    """
+    Create a small synthetic road network, e.g. for the examples that check the routing engines against Dijkstra's
+    algorithm.
+
+    The crossings are the nodes of a num_rows x num_cols grid, about 100 m apart, and every pair of adjacent crossings
+    is linked by a street whose length is 1 to 1.5 times the straight-line distance, so the straight-line heuristics
+    stay admissible. A fraction one_way of the streets are one-way, so not every vertex reaches every other one. Each
+    street is split into edges of equal length by shape_points vertices along it, which form degree-2 chains.
+
+    :param num_rows: int
+    :param num_cols: int
+    :param one_way: the fraction of one-way streets
+    :param shape_points: the number of shape points on each street
+    :param seed: the seed of the random lengths and directions
+    :type one_way: float
+    :type shape_points: int
+    :type seed: int
+    :return: RoadNetwork
+
+    >>> road_network = make_grid_network(4, 5, shape_points=1)
+    >>> road_network.num_vertex, road_network.num_edge
+    (51, 94)
+    """
+    rng = random.Random(seed)
+    num_vertex = num_rows * num_cols
+    lats = [39.9 + v // num_cols * 0.0009 for v in range(num_vertex)]
+    lons = [116.3 + v % num_cols * 0.0012 for v in range(num_vertex)]
+    streets = [(v, v + 1) for v in range(num_vertex) if (v + 1) % num_cols != 0] + \
+              [(v, v + num_cols) for v in range(num_vertex - num_cols)]
+
+    road_network = RoadNetwork()
+    e_id = 0
+    for v, w in streets:
+        length = great_circle_distance(lats[v], lons[v], lats[w], lons[w]) * (1.0 + 0.5 * rng.random())
+        directions = [(v, w), (w, v)]
+        if rng.random() < one_way:
+            directions = [rng.choice(directions)]
+
+        # The shape points, evenly spaced from v to w.
+        points = [v]
+        for k in range(1, shape_points + 1):
+            lats.append(lats[v] + (lats[w] - lats[v]) * k / (shape_points + 1.0))
+            lons.append(lons[v] + (lons[w] - lons[v]) * k / (shape_points + 1.0))
+            points.append(len(lats) - 1)
+        points.append(w)
+
+        for start_vid, end_vid in directions:
+            chain = points if start_vid == v else points[::-1]
+            for a, b in zip(chain[:-1], chain[1:]):
+                road_network.add_edge(e_id, a, b, length / (shape_points + 1))
+                e_id += 1
+    road_network.add_vertices(range(len(lats)), lats, lons)
+    return road_network
+
+
+def is_reachable(road_network, s_vid, e_vid, components=None):
     """
     Return True if there exist a path from s_vid to e_vid, otherwise return False.
 
-    The algorithm is basic Breadth-First-Search (with early exit).
+    The algorithm is basic Breadth-First-Search (with early exit). If components is given, the answer comes from its
+    reachability index instead, see components.ComponentIndex.
 
     :param road_network: RoadNetwork
     :param s_vid: int
     :param e_vid: int
+    :param components: ComponentIndex
     :return: bool
     """
+    if components is not None:
+        return components.is_reachable(s_vid, e_vid)
+
     frontier = Queue()
     frontier.put(s_vid)
     came_from = dict()
@@ -354,7 +934,13 @@ def is_reachable(road_network, s_vid, e_vid):
     return False
 
 
-class Path:
+class Path(object):
+    """
+    A path of the road network.
+
+    A Path is immutable: the vertex and edge lists are stored as tuples and the attributes cannot be reassigned, so
+    the same instance can be shared, e.g. by the taxis which get it from a PathCache.
+    """
     def __init__(self, vertex_list=None, edge_list=None, distance=0.0):
         """
 
@@ -366,9 +952,12 @@ class Path:
         :type distance: float
         :return: None
         """
-        self.vertex_list = vertex_list
-        self.edge_list = edge_list
-        self.distance = distance
+        object.__setattr__(self, 'vertex_list', tuple(vertex_list or ()))
+        object.__setattr__(self, 'edge_list', tuple(edge_list or ()))
+        object.__setattr__(self, 'distance', distance)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Path is immutable")
 
     def __str__(self):
         return "Path:\n- vertex list: {}\n- edge list: {}\n- distance: {}"\
@@ -412,6 +1001,25 @@ def construct_path(road_network, s_vid, e_vid, came_from):
     return path
 
 
+def construct_path_by_edges(road_network, s_vid, e_list):
+    """
+    Construct the path from vertex s_vid along the edges of e_list, e.g. a path unpacked by a routing engine.
+
+    Unlike construct_path(), the edges are known already, so only their ends and weights are read from the arrays.
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_list: the ids of the edges, in order; None if the path does not exist
+    :type e_list: list[int]
+    :return: Path, empty if e_list is None
+    """
+    if e_list is None:
+        return Path([], [], 0.0)
+    e_list = list(e_list)
+    v_list = [s_vid] + road_network.e_end[e_list].tolist()
+    return Path(v_list, e_list, sum(road_network.e_weight[e_list].tolist(), 0.0))
+
+
 def bfs(road_network, s_vid, e_vid):
     """
     Return the path from vertex s_vid to vertex e_vid using Dijkstra's algorithm.
@@ -444,33 +1052,52 @@ def dijkstra(road_network, s_vid, e_vid):
     """
     Return the exact shortest path from vertex s_vid to vertex e_vid using Dijkstra's algorithm.
 
+    The frontier is an IndexedPriorityQueue, so relaxing a vertex decreases its key instead of pushing a duplicate, and
+    every vertex is settled exactly once.
+
     :param road_network: RoadNetwork
     :param s_vid: int
     :param e_vid: int
     :return: Path
     """
-    frontier = PriorityQueue()
-    frontier.put(s_vid, 0)
-    came_from = dict()
-    cost_so_far = dict()
-    came_from[s_vid] = None
-    cost_so_far[s_vid] = 0
+    [cost_so_far, came_from, came_by] = _search(road_network, s_vid, e_vid)
+    return _construct_path_by_edges(s_vid, e_vid, cost_so_far, came_from, came_by)
 
-    while not frontier.empty():
-        current = frontier.get()
 
-        if current == e_vid:
-            break
+def dijkstra_distance(road_network, s_vid, e_vid):
+    """
+    Return the length of the shortest path from vertex s_vid to vertex e_vid using Dijkstra's algorithm.
 
-        for neighbor in road_network.get_neighbors(current):
-            new_cost = cost_so_far[current] + road_network.get_weight(current, neighbor)
-            if neighbor not in cost_so_far or new_cost < cost_so_far[neighbor]:
-                cost_so_far[neighbor] = new_cost    # relax
-                priority = new_cost
-                frontier.put(neighbor, priority)
-                came_from[neighbor] = current
+    It runs the search of dijkstra() without keeping the "came from" dicts, for the callers which only need the
+    number, e.g. an ETA check.
 
-    return construct_path(road_network, s_vid, e_vid, came_from)
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :return: the length, float('inf') if s_vid-->e_vid is unreachable
+    :rtype: float
+
+    On a small network whose edge ids are not in vertex order, with two parallel edges 0 -> 1 and a direct edge
+    0 -> 2 longer than the way through 1, the searches record the cheaper edges, and the distance-only searches give
+    the lengths of their paths, float('inf') for the unreachable pair:
+
+    >>> road_network = RoadNetwork()
+    >>> road_network.add_vertices(range(4), [39.9, 39.9, 39.901, 39.901], [116.3, 116.301, 116.301, 116.3])
+    >>> road_network.add_edges([7, 2, 5, 0, 3], [0, 0, 1, 0, 2], [1, 1, 2, 2, 3], [300.0, 100.0, 100.0, 250.0, 50.0])
+    >>> pairs = [(0, 3), (0, 1), (3, 0), (2, 2)]
+    >>> for search in [dijkstra, get_shortest_path, bidirectional_dijkstra, bidirectional_astar]:
+    ...     print([(path.edge_list, path.distance) for path in [search(road_network, s, e) for s, e in pairs]])
+    [((2, 5, 3), 250.0), ((2,), 100.0), ((), 0.0), ((), 0.0)]
+    [((2, 5, 3), 250.0), ((2,), 100.0), ((), 0.0), ((), 0.0)]
+    [((2, 5, 3), 250.0), ((2,), 100.0), ((), 0.0), ((), 0.0)]
+    [((2, 5, 3), 250.0), ((2,), 100.0), ((), 0.0), ((), 0.0)]
+    >>> for distance in [dijkstra_distance, get_shortest_path_distance, bidirectional_dijkstra_distance]:
+    ...     print([distance(road_network, s, e) for s, e in pairs])
+    [250.0, 100.0, inf, 0.0]
+    [250.0, 100.0, inf, 0.0]
+    [250.0, 100.0, inf, 0.0]
+    """
+    return _search(road_network, s_vid, e_vid, record_path=False)[0].get(e_vid, float('inf'))
 
 
 def greedy_bfs(road_network, s_vid, e_vid):
@@ -504,23 +1131,91 @@ def greedy_bfs(road_network, s_vid, e_vid):
     return construct_path(road_network, s_vid, e_vid, came_from)
 
 
-def get_shortest_path(road_network, s_vid, e_vid):
+def get_shortest_path(road_network, s_vid, e_vid, landmarks=None):
     """
     Return the shortest path from vertex s_vid to vertex e_vid using A* algorithm.
 
     If s_vid-->e_vid is unreachable, return None.
 
+    The heuristic is the straight-line distance by default. If landmarks is given, it is the ALT lower bound of the
+    landmark distances instead (see landmarks.LandmarkTable), which follows the road network much more closely and
+    lets the search settle far fewer vertices.
+
+    As in dijkstra(), the frontier is an IndexedPriorityQueue and a vertex is settled once while the heuristic is
+    consistent. Should a settled vertex still be reached by a shorter path, it is put back into the frontier, so the
+    path stays exact.
+
     :param road_network: RoadNetwork
     :param s_vid: int
     :param e_vid: int
+    :param landmarks: LandmarkTable
     :return: Path
     """
-    frontier = PriorityQueue()
-    frontier.put(s_vid, 0)
-    came_from = dict()
-    cost_so_far = dict()
-    came_from[s_vid] = None
-    cost_so_far[s_vid] = 0
+    [cost_so_far, came_from, came_by] = _search(road_network, s_vid, e_vid, _heuristic(road_network, e_vid, landmarks))
+    return _construct_path_by_edges(s_vid, e_vid, cost_so_far, came_from, came_by)
+
+
+def get_shortest_path_distance(road_network, s_vid, e_vid, landmarks=None):
+    """
+    Return the length of the shortest path from vertex s_vid to vertex e_vid using A* algorithm.
+
+    It runs the search of get_shortest_path() without keeping the "came from" dicts.
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :param landmarks: LandmarkTable
+    :return: the length, float('inf') if s_vid-->e_vid is unreachable
+    :rtype: float
+    """
+    [cost_so_far, _, _] = _search(road_network, s_vid, e_vid, _heuristic(road_network, e_vid, landmarks),
+                                  record_path=False)
+    return cost_so_far.get(e_vid, float('inf'))
+
+
+def _heuristic(road_network, e_vid, landmarks=None):
+    """
+    Return the A* heuristic towards vertex e_vid: the straight-line distance, or the ALT lower bound if landmarks is
+    given.
+
+    :return: a function which maps a list of vertex ids to the estimates of their distances to e_vid
+    :rtype: (list[int]) -> list[float]
+    """
+    if landmarks is not None:
+        return landmarks.lower_bound_to(e_vid)
+
+    def heuristic(v_ids):
+        return [road_network.get_straight_distance(v_id, e_vid) for v_id in v_ids]
+
+    return heuristic
+
+
+def _search(road_network, s_vid, e_vid, heuristic=None, record_path=True):
+    """
+    The search of dijkstra() (without heuristic) and get_shortest_path() (A*), on the CSR arrays.
+
+    Besides the vertex it came from, the search records the edge a vertex was relaxed by, so the path is rebuilt
+    without looking up the edges again, see _construct_path_by_edges().
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :param heuristic: a function which maps a list of vertex ids to the estimates of their distances to e_vid
+    :param record_path: if the "came from" and "came by" dicts are kept, otherwise they are None
+    :return: the "cost so far", "came from" and "came by" (the edge id) dicts
+    :rtype: [dict[int, float], dict[int, int], dict[int, int]]
+    """
+    road_network.pack()
+    offsets = road_network.offsets
+    targets = road_network.targets
+    edge_ids = road_network.edge_ids
+    weights = road_network.weights
+
+    frontier = IndexedPriorityQueue()
+    frontier.put(s_vid, 0.0)
+    cost_so_far = {s_vid: 0.0}
+    came_from = {s_vid: None} if record_path else None
+    came_by = {s_vid: None} if record_path else None
 
     while not frontier.empty():
         current = frontier.get()
@@ -528,15 +1223,245 @@ def get_shortest_path(road_network, s_vid, e_vid):
         if current == e_vid:
             break
 
-        for neighbor in road_network.get_neighbors(current):
-            new_cost = cost_so_far[current] + road_network.get_weight(current, neighbor)
-            if neighbor not in cost_so_far or new_cost < cost_so_far[neighbor]:
-                cost_so_far[neighbor] = new_cost
-                priority = new_cost + road_network.get_straight_distance(neighbor, e_vid)
-                frontier.put(neighbor, priority)
-                came_from[neighbor] = current
+        lo = offsets[current]
+        hi = offsets[current + 1]
+        current_cost = cost_so_far[current]
+        relaxed = []
+        for neighbor, e_id, weight in zip(targets[lo:hi].tolist(), edge_ids[lo:hi].tolist(), weights[lo:hi].tolist()):
+            new_cost = current_cost + weight
+            if new_cost < cost_so_far.get(neighbor, float('inf')):
+                cost_so_far[neighbor] = new_cost    # relax
+                if record_path:
+                    came_from[neighbor] = current
+                    came_by[neighbor] = e_id
+                relaxed.append(neighbor)
+
+        if heuristic is None:
+            for neighbor in relaxed:
+                frontier.put(neighbor, cost_so_far[neighbor])
+        else:
+            # The heuristic is evaluated once for all the relaxed neighbors.
+            for neighbor, estimate in zip(relaxed, heuristic(relaxed)):
+                frontier.put(neighbor, cost_so_far[neighbor] + estimate)
 
-    return construct_path(road_network, s_vid, e_vid, came_from)
+    return [cost_so_far, came_from, came_by]
+
+
+def _construct_path_by_edges(s_vid, e_vid, cost_so_far, came_from, came_by):
+    """
+    Reconstruct the path from the dicts of _search().
+
+    Unlike construct_path(), the edges and the length come from the search itself.
+
+    :param s_vid: int
+    :param e_vid: int
+    :param cost_so_far: dict[int, float]
+    :param came_from: dict[int, int]
+    :param came_by: dict[int, int]
+    :return: Path
+    """
+    if e_vid not in came_from:    # s_vid-->e_vid is unreachable
+        return Path([], [], 0.0)
+
+    current = e_vid
+    v_list = [current]
+    e_list = []
+    while current != s_vid:
+        e_list.append(came_by[current])
+        current = came_from[current]
+        v_list.append(current)
+    v_list.reverse()
+    e_list.reverse()
+    return Path(v_list, e_list, cost_so_far[e_vid])
+
+
+def bidirectional_dijkstra(road_network, s_vid, e_vid):
+    """
+    Return the shortest path from vertex s_vid to vertex e_vid using bidirectional Dijkstra's algorithm.
+
+    A forward search from s_vid and a backward search (on the reverse adjacency) from e_vid run alternately and stop
+    when they meet, so on a long trip each explores about a disc of half the radius of the plain Dijkstra. If
+    s_vid-->e_vid is unreachable, the Path is empty.
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :return: Path
+
+    The backward search follows the edges against their direction. On a one-way ring 0-->1-->2-->3-->0 with a spur
+    4-->0, every path goes round the ring the right way, the two halves are joined at the meeting vertex, and 4 cannot
+    be reached:
+
+    >>> ring = RoadNetwork()
+    >>> ring.add_vertices(range(5), [39.9, 39.9, 39.901, 39.901, 39.902], [116.3, 116.301, 116.301, 116.3, 116.3])
+    >>> ring.add_edges(range(5), [0, 1, 2, 3, 4], [1, 2, 3, 0, 0], [100.0] * 5)
+    >>> for search in [bidirectional_dijkstra, bidirectional_astar]:
+    ...     paths = [search(ring, s, e) for s, e in [(0, 3), (3, 0), (4, 2), (0, 4)]]
+    ...     print([(path.vertex_list, path.distance) for path in paths])
+    [((0, 1, 2, 3), 300.0), ((3, 0), 100.0), ((4, 0, 1, 2), 300.0), ((), 0.0)]
+    [((0, 1, 2, 3), 300.0), ((3, 0), 100.0), ((4, 0, 1, 2), 300.0), ((), 0.0)]
+
+    The distance-only search gives up on the targets beyond max_distance:
+
+    >>> [bidirectional_dijkstra_distance(ring, 0, e, max_distance=250.0) for e in range(5)]
+    [0.0, 100.0, 200.0, inf, inf]
+    """
+    return _bidirectional_path(road_network, s_vid, e_vid, _bidirectional_search(road_network, s_vid, e_vid))
+
+
+def bidirectional_astar(road_network, s_vid, e_vid, landmarks=None):
+    """
+    Return the shortest path from vertex s_vid to vertex e_vid using bidirectional A* algorithm.
+
+    Both searches use the average potential (h_to_e(v) - h_from_s(v)) / 2, which keeps them consistent with each other.
+    The heuristics are the straight-line distance by default, or the ALT lower bounds if landmarks is given (see
+    get_shortest_path()).
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :param landmarks: LandmarkTable
+    :return: Path
+    """
+    if landmarks is None:
+        def to_target(v_ids):
+            return [road_network.get_straight_distance(v_id, e_vid) for v_id in v_ids]
+
+        def from_source(v_ids):
+            return [road_network.get_straight_distance(s_vid, v_id) for v_id in v_ids]
+    else:
+        to_target = landmarks.lower_bound_to(e_vid)
+        from_source = landmarks.lower_bound_from(s_vid)
+
+    def potential(v_ids):
+        return [(h_to - h_from) / 2.0 for h_to, h_from in zip(to_target(v_ids), from_source(v_ids))]
+
+    meeting = _bidirectional_search(road_network, s_vid, e_vid, potential)
+    return _bidirectional_path(road_network, s_vid, e_vid, meeting)
+
+
+def bidirectional_dijkstra_distance(road_network, s_vid, e_vid, max_distance=float('inf')):
+    """
+    Return the length of the shortest path from vertex s_vid to vertex e_vid using bidirectional Dijkstra's algorithm,
+    without constructing the path.
+
+    With max_distance, the search gives up as soon as the path is known to be longer, which makes a check like "can
+    the taxi be there in time" much cheaper than a full search.
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :param max_distance: float
+    :return: the length, float('inf') if s_vid-->e_vid is unreachable or longer than max_distance
+    :rtype: float
+    """
+    distance = _bidirectional_search(road_network, s_vid, e_vid, max_distance=max_distance)[1]
+    return distance if distance <= max_distance else float('inf')
+
+
+def _bidirectional_search(road_network, s_vid, e_vid, potential=None, max_distance=float('inf')):
+    """
+    The bidirectional search behind bidirectional_dijkstra(), bidirectional_astar() and
+    bidirectional_dijkstra_distance().
+
+    The key of a vertex v is its distance plus potential(v) in the forward search and its distance minus potential(v)
+    in the backward search (0 without potential). The keys of a path through v then add up to its length, so no path
+    through the vertices left in the queues can be shorter than the sum of the two smallest keys, and the search stops
+    once that sum reaches the best path found so far (or max_distance).
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :param potential: a function which maps a list of vertex ids to their potentials
+    :param max_distance: float
+    :type potential: (list[int]) -> list[float]
+    :return: the meeting vertex (None if unreachable), the distance, and the "came from" and "came by" (the edge id)
+    dicts of the two directions, see _search()
+    :rtype: [int, float, list[dict[int, int]], list[dict[int, int]]]
+    """
+    road_network.pack()
+    graphs = [(road_network.offsets, road_network.targets, road_network.edge_ids, road_network.weights),
+              (road_network.r_offsets, road_network.sources, road_network.r_edge_ids, road_network.r_weights)]
+    signs = [1.0, -1.0]
+    potentials = dict()
+    if potential is not None:
+        potentials.update(zip([s_vid, e_vid], potential([s_vid, e_vid])))
+
+    cost_so_far = [{s_vid: 0.0}, {e_vid: 0.0}]
+    came_from = [{s_vid: None}, {e_vid: None}]
+    came_by = [{s_vid: None}, {e_vid: None}]
+    frontiers = [IndexedPriorityQueue(), IndexedPriorityQueue()]
+    frontiers[0].put(s_vid, potentials.get(s_vid, 0.0))
+    frontiers[1].put(e_vid, -potentials.get(e_vid, 0.0))
+
+    best = float('inf')
+    v_meet = None
+    if s_vid == e_vid:
+        best = 0.0
+        v_meet = s_vid
+
+    while not frontiers[0].empty() and not frontiers[1].empty():
+        [top_forward, top_backward] = [frontiers[0].elements[0][0], frontiers[1].elements[0][0]]
+        if top_forward + top_backward >= min(best, max_distance):
+            break
+        # Advance the direction with the smaller key.
+        k = 0 if top_forward <= top_backward else 1
+        current = frontiers[k].get()
+
+        [offsets, neighbors, edge_ids, weights] = graphs[k]
+        lo = offsets[current]
+        hi = offsets[current + 1]
+        current_cost = cost_so_far[k][current]
+        relaxed = []
+        for neighbor, e_id, weight in zip(neighbors[lo:hi].tolist(), edge_ids[lo:hi].tolist(),
+                                          weights[lo:hi].tolist()):
+            new_cost = current_cost + weight
+            if new_cost < cost_so_far[k].get(neighbor, float('inf')):
+                cost_so_far[k][neighbor] = new_cost    # relax
+                came_from[k][neighbor] = current
+                came_by[k][neighbor] = e_id
+                relaxed.append(neighbor)
+                other_cost = cost_so_far[1 - k].get(neighbor)
+                if other_cost is not None and new_cost + other_cost < best:
+                    best = new_cost + other_cost
+                    v_meet = neighbor
+
+        if potential is not None:
+            unknown = [v_id for v_id in relaxed if v_id not in potentials]
+            if len(unknown) != 0:
+                potentials.update(zip(unknown, potential(unknown)))
+        for neighbor in relaxed:
+            frontiers[k].put(neighbor, cost_so_far[k][neighbor] + signs[k] * potentials.get(neighbor, 0.0))
+
+    return [v_meet, best, came_from, came_by]
+
+
+def _bidirectional_path(road_network, s_vid, e_vid, meeting):
+    """
+    Join the two halves of a bidirectional search into a Path.
+
+    :param road_network: RoadNetwork
+    :param s_vid: int
+    :param e_vid: int
+    :param meeting: the result of _bidirectional_search()
+    :return: Path
+    """
+    [v_meet, _, [came_from, backward_came_from], [came_by, backward_came_by]] = meeting
+    if v_meet is None:
+        return construct_path_by_edges(road_network, s_vid, None)
+
+    # The edges from s_vid to the meeting vertex, and on from there, where the backward dicts point towards e_vid.
+    e_list = []
+    current = v_meet
+    while came_from[current] is not None:
+        e_list.append(came_by[current])
+        current = came_from[current]
+    e_list.reverse()
+    current = v_meet
+    while backward_came_from[current] is not None:
+        e_list.append(backward_came_by[current])
+        current = backward_came_from[current]
+    return construct_path_by_edges(road_network, s_vid, e_list)
 
 
 def floyd_warshall(road_network):
@@ -585,6 +1510,9 @@ def single_source_dijkstra(road_network, start):
     """
     Compute the shortest paths from a vertex, whose id is start, to all other vertices using Dijkstra's algorithm.
 
+    Every vertex is settled exactly once, see dijkstra(). If only the distances are needed, use
+    single_source_dijkstra_distance().
+
     :param road_network: RoadNetwork
     :param start: int
     :return: dict[int, int]
@@ -593,23 +1521,130 @@ def single_source_dijkstra(road_network, start):
     import time
     start_time = time.clock()
 
-    frontier = PriorityQueue()
-    frontier.put(start, 0)
-    came_from = dict()
-    cost_so_far = dict()
-    came_from[start] = None
-    cost_so_far[start] = 0
+    came_from = _search(road_network, start, None)[1]
+
+    print("Elapsed time is %f seconds." % (time.clock() - start_time))
+
+    return came_from
+
+
+def single_source_dijkstra_distance(road_network, start):
+    """
+    Compute the length of the shortest paths from a vertex, whose id is start, to all other vertices using Dijkstra's
+    algorithm.
+
+    Unlike single_source_dijkstra(), no "came from" array is kept and the search reads the CSR arrays directly, so it
+    is the kernel to use when only the distances are needed (e.g. the grid distance matrix).
+
+    :param road_network: RoadNetwork
+    :param start: int
+    :return: the distance array indexed by vertex id, float('inf') for unreachable vertices
+    :rtype: numpy.ndarray
+    """
+    road_network.pack()
+    return csr_dijkstra_distance(road_network.offsets, road_network.targets, road_network.weights, start)
+
+
+def csr_dijkstra_distance(offsets, targets, weights, start):
+    """
+    The distance-only Dijkstra of single_source_dijkstra_distance(), on a graph given by its CSR arrays.
+
+    Any graph in the CSR form of RoadNetwork can be searched, e.g. the reverse graph, whose distances are the lengths
+    of the shortest paths *to* start.
 
+    :param offsets: the out-edges of vertex v are in targets[offsets[v]:offsets[v + 1]]
+    :param targets: the heads of the edges
+    :param weights: the weights of the edges
+    :param start: int
+    :type offsets: numpy.ndarray
+    :type targets: numpy.ndarray
+    :type weights: numpy.ndarray
+    :type start: int
+    :return: the distance array indexed by vertex id, float('inf') for unreachable vertices
+    :rtype: numpy.ndarray
+    """
+    num_slot = len(offsets) - 1
+    cost_so_far = [float('inf')] * num_slot
+    cost_so_far[start] = 0.0
+
+    frontier = IndexedPriorityQueue()
+    frontier.put(start, 0.0)
     while not frontier.empty():
         current = frontier.get()
-        for neighbor in road_network.get_neighbors(current):
-            new_cost = cost_so_far[current] + road_network.get_weight(current, neighbor)
-            if neighbor not in cost_so_far or new_cost < cost_so_far[neighbor]:
+
+        lo = offsets[current]
+        hi = offsets[current + 1]
+        current_cost = cost_so_far[current]
+        for neighbor, weight in zip(targets[lo:hi].tolist(), weights[lo:hi].tolist()):
+            new_cost = current_cost + weight
+            if new_cost < cost_so_far[neighbor]:
                 cost_so_far[neighbor] = new_cost    # relax
-                priority = new_cost
-                frontier.put(neighbor, priority)
-                came_from[neighbor] = current
+                frontier.put(neighbor, new_cost)
 
-    print("Elapsed time is %f seconds." % (time.clock() - start_time))
+    return np.array(cost_so_far)
 
-    return came_from
+
+def one_to_many_distance(road_network, source, targets, max_distance=float('inf'), reverse=False):
+    """
+    Compute the length of the shortest paths from vertex source to each vertex of targets using Dijkstra's algorithm.
+
+    Unlike single_source_dijkstra_distance(), the search stops as soon as all the targets are settled, or once it is
+    beyond max_distance, so it only explores the part of the graph that is needed. With reverse, the search runs on
+    the reverse adjacency and the result is the length of the shortest paths from each target *to* source, e.g. from
+    the candidate taxis to a pickup location.
+
+    :param road_network: RoadNetwork
+    :param source: int
+    :param targets: the target vertex ids
+    :param max_distance: float
+    :param reverse: bool
+    :type targets: list[int] | numpy.ndarray
+    :return: the distances in the order of targets, float('inf') for the targets which are unreachable or beyond
+    max_distance
+    :rtype: numpy.ndarray
+
+    On a one-way ring 0 -> 1 -> 2 -> 3 -> 0 with a spur 4 -> 0, the forward search goes the long way round, the
+    reverse one the short way, and the spur can only be left. Repeated targets are allowed:
+
+    >>> ring = RoadNetwork()
+    >>> ring.add_vertices(range(5), [39.9, 39.9, 39.901, 39.901, 39.902], [116.3, 116.301, 116.301, 116.3, 116.3])
+    >>> ring.add_edges(range(5), [0, 1, 2, 3, 4], [1, 2, 3, 0, 0], [100.0] * 5)
+    >>> one_to_many_distance(ring, 0, [3, 1, 3, 0, 4]).tolist()
+    [300.0, 100.0, 300.0, 0.0, inf]
+    >>> one_to_many_distance(ring, 0, [3, 1, 3, 0, 4], reverse=True).tolist()
+    [100.0, 300.0, 100.0, 0.0, 100.0]
+    >>> one_to_many_distance(ring, 0, [3, 1, 3, 0, 4], max_distance=150.0).tolist()
+    [inf, 100.0, inf, 0.0, inf]
+    """
+    road_network.pack()
+    if reverse:
+        [offsets, neighbors, weights] = [road_network.r_offsets, road_network.sources, road_network.r_weights]
+    else:
+        [offsets, neighbors, weights] = [road_network.offsets, road_network.targets, road_network.weights]
+
+    targets = np.asarray(targets, dtype=np.int64).tolist()
+    remaining = set(targets)
+    num_slot = len(offsets) - 1
+    cost_so_far = [float('inf')] * num_slot
+    settled = [False] * num_slot
+    cost_so_far[source] = 0.0
+
+    frontier = IndexedPriorityQueue()
+    frontier.put(source, 0.0)
+    while not frontier.empty() and len(remaining) != 0:
+        current = frontier.get()
+        current_cost = cost_so_far[current]
+        if current_cost > max_distance:
+            break
+        settled[current] = True
+        remaining.discard(current)
+
+        lo = offsets[current]
+        hi = offsets[current + 1]
+        for neighbor, weight in zip(neighbors[lo:hi].tolist(), weights[lo:hi].tolist()):
+            new_cost = current_cost + weight
+            if new_cost < cost_so_far[neighbor]:
+                cost_so_far[neighbor] = new_cost    # relax
+                frontier.put(neighbor, new_cost)
+
+    return np.array([cost_so_far[v_id] if settled[v_id] else float('inf') for v_id in targets])
@@ -9,34 +9,54 @@ Description: This module contains the interfaces for taxi scheduling.
 """
 
 
-from location import Location, get_distance
+import os
+
+import numpy as np
+
+from location import Location, great_circle_distance_many
 from road_network import RoadNetwork
 from spatio_temporal_index import SpatioTemporalDatabase
+from vertex_index import VertexIndex
+from edge_index import EdgeIndex
+from snapshot import save_arrays, load_arrays
+
+
+MATCH_CACHE_VERSION = 1
 
 
 class ScheduleNode:
-    def __init__(self, query_id, is_origin, matched_vid):
+    def __init__(self, query_id, is_origin, matched_vid, e_id=None, offset=0.0):
         """
         Initialize a ScheduleNode.
 
+        A ScheduleNode matched to an edge (see EdgeIndex) lies offset meters along edge e_id, and its matched vertex is
+        the start vertex of the edge, i.e. the vertex the taxis are routed to before they drive into the edge.
+
         :param query_id: id of a query
         :param is_origin: bool param indicates that if the ScheduleNode is an origin of a query
         :param matched_vid: id of the matched vertex in the road network
+        :param e_id: id of the matched edge, None if the ScheduleNode is matched to a vertex
+        :param offset: the offset of the ScheduleNode from the start of edge e_id, in the unit of the edge weight
         :type query_id: int
         :type is_origin: bool
         :type matched_vid: int
+        :type e_id: int
+        :type offset: float
         :return: None
         """
         self.query_id = query_id
         self.is_origin = is_origin
         self.matched_vid = matched_vid
+        self.e_id = e_id
+        self.offset = offset
 
     def __str__(self):
-        return "ScheduleNode:\n- query id: {}\n- is origin: {}\n- matched vertex id:{}\n"\
-            .format(self.query_id, self.is_origin, self.matched_vid)
+        return "ScheduleNode:\n- query id: {}\n- is origin: {}\n- matched vertex id:{}\n- matched edge id:{}\n" \
+               "- offset:{}\n".format(self.query_id, self.is_origin, self.matched_vid, self.e_id, self.offset)
 
 
-def map_match(query_id, location, is_origin, road_network, database):
+def map_match(query_id, location, is_origin, road_network, database, vertex_mask=None, vertex_index=None,
+              edge_index=None):
     """
     Find the best matched vertex in the road network for the location of a query.
 
@@ -45,27 +65,147 @@ def map_match(query_id, location, is_origin, road_network, database):
     :param is_origin: bool param indicates that if the location is an origin of a query
     :param road_network: the road network
     :param database: the spatio-temporal database
+    :param vertex_mask: if given, only the vertices v with vertex_mask[v] are matched (unless there is none in the grid
+    cell), e.g. the vertices of the largest strongly connected component, see ComponentIndex.largest_component()
+    :param vertex_index: if given, the location is matched to the closest vertex in the whole road network by the
+    index (which has its own vertex mask), otherwise to the closest vertex in its grid cell
+    :param edge_index: if given, the location is matched to the closest point of the closest edge by the index, and
+    the vertex arguments are ignored
     :type query_id: int
     :type location: Location
     :type is_origin: bool
     :type road_network: RoadNetwork
     :type database: SpatioTemporalDatabase
+    :type vertex_mask: numpy.ndarray
+    :type vertex_index: VertexIndex
+    :type edge_index: EdgeIndex
     :return: a ScheduleNode
     :rtype: ScheduleNode
     """
-    geohash = location.geohash
+    if edge_index is not None:
+        matched = edge_index.nearest_edge(location.lat, location.lon)
+        if matched is None:
+            return ScheduleNode(query_id, is_origin, None)
+        return ScheduleNode(query_id, is_origin, road_network.get_edge(matched[0]).start_vid, matched[0], matched[1])
+    if vertex_index is not None:
+        return ScheduleNode(query_id, is_origin, vertex_index.nearest_vertex(location.lat, location.lon))
+
+    geohash = database.get_geohash(location)
     matched_vid = None
-    min_dis = float('inf')
 
-    # Scan all the vertex in the grid and pick the one closest to the location.
-    for v_id in database.grid[geohash].vertex_list:
-        vertex = road_network.get_vertex(v_id)
-        v_loc = vertex.location
-        dis = get_distance(v_loc, location)
-        if dis < min_dis:
-            matched_vid = v_id
-            min_dis = dis
+    # Score all the vertex in the grid at once and pick the one closest to the location.
+    grid_cell = database.grid.get(geohash)
+    v_ids = np.fromiter(grid_cell.vertex_list if grid_cell is not None else [], dtype=np.int64)
+    if vertex_mask is not None and vertex_mask[v_ids].any():
+        v_ids = v_ids[vertex_mask[v_ids]]
+    if len(v_ids) > 0:
+        [lats, lons] = road_network.get_coordinates(v_ids)
+        dis = great_circle_distance_many(location.lat, location.lon, lats, lons)
+        dis[np.isnan(dis)] = np.inf
+        k = int(np.argmin(dis))
+        if dis[k] < np.inf:
+            matched_vid = int(v_ids[k])
 
     # Create the ScheduleNode.
     schedule_node = ScheduleNode(query_id, is_origin, matched_vid)
     return schedule_node
+
+
+def map_match_many(lats, lons, vertex_index, cache_path=None):
+    """
+    Find the closest vertices of many locations at once, see VertexIndex.nearest_vertices().
+
+    The locations repeat heavily (the hot spots of the queries), so every distinct coordinate is matched only once. If
+    cache_path is given, the matched coordinates are saved in that directory (see snapshot.save_arrays()) and read
+    from it the next time, so the directory should be keyed by the road network, e.g. inside the road-network
+    snapshot (and by the content hash of the query files). Whenever some locations are not in the cache yet (e.g.
+    another time window of the same query files), it is rewritten with the old and the new coordinates.
+
+    :param lats: the latitudes of the locations
+    :param lons: the longitudes of the locations
+    :param vertex_index: the nearest-vertex index
+    :param cache_path: the directory of the cache of the matched coordinates
+    :type lats: list[float] | numpy.ndarray
+    :type lons: list[float] | numpy.ndarray
+    :type vertex_index: VertexIndex
+    :type cache_path: str
+    :return: the ids of the matched vertices, -1 if there is no vertex
+    :rtype: numpy.ndarray
+
+    Each distinct coordinate is looked up once, a second call is answered by the cache, and new coordinates are
+    looked up and added to it:
+
+    >>> import shutil
+    >>> import tempfile
+    >>> from road_network import make_grid_network
+    >>> road_network = make_grid_network(4, 4)
+    >>> class CountingIndex(VertexIndex):
+    ...     looked_up = 0
+    ...     def nearest_vertices(self, lats, lons):
+    ...         self.looked_up += len(lats)
+    ...         return VertexIndex.nearest_vertices(self, lats, lons)
+    >>> index = CountingIndex(road_network)
+    >>> v_ids = [0, 5, 0, 5, 10, 0]
+    >>> [lats, lons] = [road_network.v_lat[v_ids] + 0.0001, road_network.v_lon[v_ids] - 0.0001]
+    >>> path = os.path.join(tempfile.mkdtemp(), "matched")
+    >>> map_match_many(lats, lons, index, path).tolist(), index.looked_up
+    ([0, 5, 0, 5, 10, 0], 3)
+    >>> map_match_many(lats[::-1], lons[::-1], index, path).tolist(), index.looked_up
+    ([0, 10, 5, 0, 5, 0], 3)
+    >>> [lats, lons] = [np.append(lats, road_network.v_lat[15]), np.append(lons, road_network.v_lon[15])]
+    >>> map_match_many(lats, lons, index, path).tolist(), index.looked_up
+    ([0, 5, 0, 5, 10, 0, 15], 4)
+    >>> map_match_many(lats, lons, index, path).tolist(), index.looked_up
+    ([0, 5, 0, 5, 10, 0, 15], 4)
+    >>> shutil.rmtree(os.path.dirname(path))
+    """
+    coordinates = np.column_stack((np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)))
+    if len(coordinates) == 0:
+        return np.zeros(0, dtype=np.int64)
+    [unique, inverse] = np.unique(coordinates, axis=0, return_inverse=True)
+
+    matched_vids = np.full(len(unique), -1, dtype=np.int64)
+    todo = np.ones(len(unique), dtype=bool)
+    cached = dict()
+    if cache_path is not None and os.path.isdir(cache_path):
+        [arrays, meta] = load_arrays(cache_path, ('lats', 'lons', 'matched_vids'))
+        if meta['version'] == MATCH_CACHE_VERSION:
+            cached = dict(zip(zip(arrays['lats'].tolist(), arrays['lons'].tolist()), arrays['matched_vids'].tolist()))
+            for k, key in enumerate(zip(unique[:, 0].tolist(), unique[:, 1].tolist())):
+                if key in cached:
+                    matched_vids[k] = cached[key]
+                    todo[k] = False
+
+    if todo.any():
+        matched_vids[todo] = vertex_index.nearest_vertices(unique[todo, 0], unique[todo, 1])
+        if cache_path is not None:
+            cached.update(zip(zip(unique[todo, 0].tolist(), unique[todo, 1].tolist()), matched_vids[todo].tolist()))
+            keys = list(cached.keys())
+            save_arrays({'lats': np.array([key[0] for key in keys], dtype=np.float64),
+                         'lons': np.array([key[1] for key in keys], dtype=np.float64),
+                         'matched_vids': np.array([cached[key] for key in keys], dtype=np.int64)},
+                        {'version': MATCH_CACHE_VERSION}, cache_path, replace=True)
+    return matched_vids[inverse]
+
+
+def map_match_edges(lats, lons, edge_index):
+    """
+    Find the closest points of the road network to many locations at once, see EdgeIndex.nearest_edges(). Every
+    distinct coordinate is matched only once, as in map_match_many().
+
+    :param lats: the latitudes of the locations
+    :param lons: the longitudes of the locations
+    :param edge_index: the nearest-edge index
+    :type lats: list[float] | numpy.ndarray
+    :type lons: list[float] | numpy.ndarray
+    :type edge_index: EdgeIndex
+    :return: the ids of the matched edges (-1 if there is no edge), and the offsets of the points from the start of
+    the edges
+    :rtype: [numpy.ndarray, numpy.ndarray]
+    """
+    coordinates = np.column_stack((np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)))
+    if len(coordinates) == 0:
+        return [np.zeros(0, dtype=np.int64), np.zeros(0)]
+    [unique, inverse] = np.unique(coordinates, axis=0, return_inverse=True)
+    [e_ids, offsets, distances] = edge_index.nearest_edges(unique[:, 0], unique[:, 1])
+    return [e_ids[inverse], offsets[inverse]]
@@ -9,13 +9,25 @@ Description: This is the main module for taxi ride-sharing simulation.
 """
 
 
-from road_network import load_data
+import os
+
+from snapshot import load_or_compile, snapshot_path, data_hash
+from road_network import get_shortest_path, bidirectional_astar
+from contraction_hierarchy import ContractionHierarchy, CH_DIR
+from landmarks import LandmarkTable, LANDMARK_DIR
+from hub_labels import HubLabels, HUB_LABEL_DIR
+from compressed_graph import CompressedGraph, COMPRESSED_GRAPH_DIR
+from components import ComponentIndex, COMPONENT_DIR
+from vertex_index import VertexIndex
+from edge_index import EdgeIndex
+from path_cache import PathCache
 from spatio_temporal_index import SpatioTemporalDatabase
+from geohash_hierarchy import GeoHashHierarchy
 from query import load_query, init_schedule_node
 from taxi import gen_taxi
 from dispatcher import Dispatcher
 
-from constants import SIM_START_TIME, SIM_END_TIME, WAITING, CANCELLED
+from constants import SIM_START_TIME, SIM_END_TIME, WAITING, CANCELLED, PATIENCE, PRECISION
 from container import PriorityQueue
 
 import time
@@ -26,21 +38,97 @@ class Simulation:
     This is a class which is responsible for setting up and running a simulation.
     """
 
-    def __init__(self):
-        road_network = load_data()
+    def __init__(self, lazy_grid=False, routing="astar", dispatch_distance="straight", path_cache_size=0,
+                 largest_component_only=False, snap_to_edges=False, precision=PRECISION, geohash_hierarchy=False):
+        """
+        Initialize a Simulation.
+
+        :param lazy_grid: if the grid distance matrix is computed on demand, see SpatioTemporalDatabase
+        :param routing: the routing engine of the taxis, "astar" (road_network.get_shortest_path()), "bidirectional"
+        (road_network.bidirectional_astar()), "alt" (A* with the landmark heuristic, see LandmarkTable), "ch" (see
+        ContractionHierarchy) or "compressed" (A* on the road network with its degree-2 chains compressed, see
+        CompressedGraph). The preprocessed data of the engines are built on the first use and saved in the
+        road-network snapshot.
+        :param dispatch_distance: the distance by which the dispatcher picks the nearest taxi, "straight" (straight-line
+        distance), "search" (road distance, by a bounded search from the pickup location) or "hub_labels" (road
+        distance, answered by HubLabels, which are preprocessed on the first use and saved in the road-network
+        snapshot)
+        :param path_cache_size: the maximum number of routes cached by a PathCache in front of the routing engine, no
+        cache if 0
+        :param largest_component_only: if the queries are only matched to the vertices of the largest strongly
+        connected component of the road network, see ComponentIndex
+        :param snap_to_edges: if the queries are matched to the closest points of the edges (see EdgeIndex), so that
+        the taxis pick up and drop off in the middle of an edge, rather than to the closest vertices
+        :param precision: the length of the GeoHash of the grid cells of the spatio-temporal database
+        :param geohash_hierarchy: if the dispatcher searches the candidate taxis in a GeoHashHierarchy of their
+        locations rather than in the temporal grid lists, see SpatioTemporalDatabase
+        :type lazy_grid: bool
+        :type routing: str
+        :type dispatch_distance: str
+        :type path_cache_size: int
+        :type largest_component_only: bool
+        :type snap_to_edges: bool
+        :type precision: int
+        :type geohash_hierarchy: bool
+        :return: None
+        """
+        # The grid cells and their anchors come with the snapshot. The taxi searching never looks beyond PATIENCE, so
+        # the grid lists are truncated there.
+        hierarchy = GeoHashHierarchy() if geohash_hierarchy else None
+        [road_network, db] = load_or_compile(database=SpatioTemporalDatabase(lazy=lazy_grid, horizon=PATIENCE,
+                                                                             precision=precision, hierarchy=hierarchy))
         self.road_network = road_network
 
-        db = SpatioTemporalDatabase()
-        db.load_road_network(road_network)
         db.init_static_info(road_network)
-        self.taxi_set = gen_taxi(db, self.road_network)
+        cache_path = snapshot_path()
+
+        if routing == "astar":
+            router = get_shortest_path
+        elif routing == "bidirectional":
+            router = bidirectional_astar
+        elif routing == "alt":
+            landmarks = LandmarkTable.load_or_build(road_network, os.path.join(cache_path, LANDMARK_DIR))
+            router = landmarks.get_shortest_path
+        elif routing == "ch":
+            ch = ContractionHierarchy.load_or_build(road_network, os.path.join(cache_path, CH_DIR))
+            router = ch.get_shortest_path
+        elif routing == "compressed":
+            compressed_graph = CompressedGraph.load_or_build(road_network,
+                                                             os.path.join(cache_path, COMPRESSED_GRAPH_DIR))
+            router = compressed_graph.get_shortest_path
+        else:
+            raise ValueError("unknown routing engine: %s" % routing)
+        # An unreachable route is rejected before the engine explores the whole component of its source.
+        components = ComponentIndex.load_or_build(road_network, os.path.join(cache_path, COMPONENT_DIR))
+        router = components.filter_router(router)
+        if path_cache_size > 0:
+            router = PathCache(router, path_cache_size).get_shortest_path
+        self.taxi_set = gen_taxi(db, self.road_network, router)
         db.init_dynamic_info(self.taxi_set, SIM_START_TIME)
         self.db = db
 
         [self.query_set, self.query_queue] = load_query()
-        init_schedule_node(self.query_queue, self.road_network, self.db)
-
-        self.dispatcher = Dispatcher()
+        vertex_mask = components.largest_component() if largest_component_only else None
+        if snap_to_edges:
+            init_schedule_node(self.query_queue, self.road_network, self.db,
+                               edge_index=EdgeIndex(road_network, vertex_mask))
+        else:
+            vertex_index = VertexIndex(road_network, vertex_mask)
+            # The matched locations are cached in the snapshot, keyed by the query files.
+            query_files = [os.path.join("./data/queries", file_name)
+                           for file_name in sorted(os.listdir("./data/queries"))]
+            match_path = os.path.join(cache_path, "map_matching-%s%s" % (data_hash(query_files)[:16],
+                                                                         "-largest" if largest_component_only else ""))
+            init_schedule_node(self.query_queue, self.road_network, self.db, vertex_index=vertex_index,
+                               cache_path=match_path)
+
+        distance_oracle = None
+        if dispatch_distance == "hub_labels":
+            ch = ContractionHierarchy.load_or_build(road_network, os.path.join(cache_path, CH_DIR))
+            distance_oracle = HubLabels.load_or_build(road_network, os.path.join(cache_path, HUB_LABEL_DIR), ch)
+        elif dispatch_distance not in ("straight", "search"):
+            raise ValueError("unknown dispatch distance: %s" % dispatch_distance)
+        self.dispatcher = Dispatcher(road_distance=dispatch_distance != "straight", distance_oracle=distance_oracle)
 
     def run(self):
 
@@ -51,6 +139,8 @@ class Simulation:
 
         for timestamp in range(SIM_START_TIME, SIM_END_TIME+1):
             print("Time: %d" % timestamp)
+            self.db.expire_taxi_list(timestamp)
+
             # Catch the queries to be processed in this timestamp. The queries consists of two parts:
             # 1. queries that happened in this timestamp
             # 2. queries that stranded in previous timestamps
@@ -0,0 +1,394 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the compiled road-network snapshot, which makes the start-up of a simulation
+(almost) instant.
+
+A snapshot holds the packed arrays of the RoadNetwork together with the grid cells (and their anchors) of the
+SpatioTemporalDatabase, saved as one .npy file per array. Loading a snapshot memory-maps these files, so that several
+simulation processes on one machine share the same pages through the OS page cache instead of each parsing the csv
+files and holding a private copy.
+
+A snapshot is keyed by the content hash of the vertices and edges files (and by SNAPSHOT_VERSION), so it is
+re-compiled automatically whenever the road data changes. The grid cells of each GeoHash precision are kept in a
+directory of their own inside it (see GRID_DIR), so the road network and the preprocessed routing data kept next to
+them are shared by the databases of all precisions.
+
+=== Constants ===
+SNAPSHOT_VERSION: int
+    The version of the snapshot format. Increase it whenever the content of a snapshot changes.
+VERTICES_FILE: str
+    The default path of the vertices file.
+EDGES_FILE: str
+    The default path of the edges file.
+CACHE_DIR: str
+    The default directory in which the snapshots are stored.
+GRID_DIR: str
+    The name of the directory of the grid cells of a precision inside the snapshot, formatted with the precision.
+"""
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from road_network import RoadNetwork, load_data
+from spatio_temporal_index import SpatioTemporalDatabase, GridCell
+from constants import PRECISION
+
+
+SNAPSHOT_VERSION = 2
+VERTICES_FILE = "./data/vertices.csv"
+EDGES_FILE = "./data/edges.csv"
+CACHE_DIR = "./data/cache"
+GRID_DIR = "grid-p%d"
+
+GRID_ARRAY_NAMES = ('grid_geohash', 'grid_anchor', 'grid_offsets', 'grid_vertices')
+
+
+def data_hash(file_list):
+    """
+    Return the content hash of the given files.
+
+    :param file_list: paths of the files
+    :type file_list: list[str]
+    :return: hex digest
+    :rtype: str
+    """
+    sha1 = hashlib.sha1()
+    for file_name in file_list:
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+def snapshot_path(vertices_file=VERTICES_FILE, edges_file=EDGES_FILE, cache_dir=CACHE_DIR):
+    """
+    Return the directory of the snapshot of the given road data.
+
+    :param vertices_file: str
+    :param edges_file: str
+    :param cache_dir: str
+    :return: str
+    """
+    key = data_hash([vertices_file, edges_file])[:16]
+    return os.path.join(cache_dir, "road_network-v%d-%s" % (SNAPSHOT_VERSION, key))
+
+
+def compile_snapshot(road_network, database, path):
+    """
+    Write the road network and the grid cells of the database to a snapshot.
+
+    The snapshot is written to a temporary directory first and then renamed, so concurrent processes never see a
+    partially written snapshot.
+
+    :param road_network: the road network
+    :param database: the spatio-temporal database, whose anchors have been determined
+    :param path: the directory of the snapshot
+    :type road_network: RoadNetwork
+    :type database: SpatioTemporalDatabase
+    :type path: str
+    :return: None
+    """
+    save_arrays(road_network.to_arrays(), {'version': SNAPSHOT_VERSION}, path)
+    compile_grid(database, path)
+
+
+def compile_grid(database, path):
+    """
+    Write the grid cells of the database to the snapshot in directory path, next to the grid cells of the other
+    precisions.
+
+    :param database: the spatio-temporal database, whose anchors have been determined
+    :param path: the directory of the snapshot
+    :type database: SpatioTemporalDatabase
+    :type path: str
+    :return: None
+    """
+    # Group the vertices by grid cell, in CSR form.
+    arrays = dict()
+    grid_geohash = np.array(sorted(database.grid.keys()), dtype='U%d' % database.precision)
+    grid_anchor = np.array([database.grid[geohash].anchor for geohash in grid_geohash.tolist()], dtype=np.int64)
+    vertex_lists = [sorted(database.grid[geohash].vertex_list) for geohash in grid_geohash.tolist()]
+    arrays['grid_geohash'] = grid_geohash
+    arrays['grid_anchor'] = grid_anchor
+    arrays['grid_offsets'] = np.concatenate(([0], np.cumsum([len(item) for item in vertex_lists]))).astype(np.int64)
+    arrays['grid_vertices'] = np.array([v_id for item in vertex_lists for v_id in item], dtype=np.int64)
+
+    save_arrays(arrays, {'version': SNAPSHOT_VERSION, 'precision': database.precision},
+                os.path.join(path, GRID_DIR % database.precision))
+
+
+def save_arrays(arrays, meta, path, replace=False):
+    """
+    Save arrays to directory path, one .npy file per array, together with a meta.json file.
+
+    The files are written to a temporary directory first and then renamed, so concurrent processes never see a
+    partially written directory. This is the format of the snapshot and of the preprocessed routing data kept inside
+    it (e.g. the contraction hierarchy).
+
+    :param arrays: dict[str, numpy.ndarray]
+    :param meta: the JSON-serializable meta data, e.g. the version of the format
+    :param path: the directory
+    :param replace: if an existing directory is replaced, e.g. a cache that has grown; otherwise it is kept
+    :type meta: dict
+    :type path: str
+    :type replace: bool
+    :return: None
+    """
+    meta = dict(meta)
+    meta['arrays'] = sorted(arrays.keys())
+
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_path = tempfile.mkdtemp(dir=parent)
+    for name in arrays:
+        np.save(os.path.join(tmp_path, name + ".npy"), arrays[name])
+    with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:  # the directory exists, or another process has saved it in the meantime
+        if not replace:
+            shutil.rmtree(tmp_path)
+            return
+        # A directory cannot be renamed onto a non-empty one: move the old one aside first.
+        old_path = tmp_path + ".old"
+        try:
+            os.rename(path, old_path)
+            os.rename(tmp_path, path)
+        except OSError:  # another process has replaced it in the meantime
+            shutil.rmtree(tmp_path)
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+
+
+def load_arrays(path, names):
+    """
+    Load arrays saved by save_arrays(). The arrays are memory-mapped read-only.
+
+    :param path: the directory
+    :param names: the names of the arrays to load
+    :type path: str
+    :type names: list[str]
+    :return: the arrays and the meta data
+    :rtype: [dict[str, numpy.ndarray], dict]
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    arrays = dict()
+    for name in names:
+        # A plain ndarray view of the memory map: same pages, without the (slow) indexing of numpy.memmap.
+        arrays[name] = np.asarray(np.load(os.path.join(path, name + ".npy"), mmap_mode='r'))
+    return [arrays, meta]
+
+
+def load_or_build_arrays(path, names, version, build, message):
+    """
+    Load the arrays saved in directory path. If there are none, or they were saved in another version of the format,
+    build them with build() and save them there first.
+
+    This caches the preprocessed routing data (e.g. the contraction hierarchy) of a road network. Its directory is
+    placed inside the road-network snapshot, whose name is keyed by the road data, so the data is rebuilt whenever
+    the road network changes.
+
+    :param path: the directory
+    :param names: the names of the arrays
+    :param version: the version of the format
+    :param build: a function without arguments which returns the arrays, as a dict[str, numpy.ndarray]
+    :param message: what is built, for the progress message, e.g. "the contraction hierarchy"
+    :type path: str
+    :type names: list[str]
+    :type version: int
+    :type message: str
+    :return: dict[str, numpy.ndarray]
+
+    >>> path = os.path.join(tempfile.mkdtemp(), "squares")
+    >>> build = lambda: {'squares': np.arange(4) ** 2}
+    >>> load_or_build_arrays(path, ['squares'], 1, build, "the squares")['squares']  # doctest: +ELLIPSIS
+    Building the squares...
+    Done. Elapsed time is ... seconds.
+    array([0, 1, 4, 9])
+    >>> load_or_build_arrays(path, ['squares'], 1, build, "the squares")['squares']
+    array([0, 1, 4, 9])
+    >>> load_or_build_arrays(path, ['squares'], 2, build, "the squares")['squares']  # doctest: +ELLIPSIS
+    Building the squares...
+    Done. Elapsed time is ... seconds.
+    array([0, 1, 4, 9])
+    >>> shutil.rmtree(os.path.dirname(path))
+    """
+    if os.path.isdir(path):
+        [arrays, meta] = load_arrays(path, names)
+        if meta.get('version') == version:
+            return arrays
+        shutil.rmtree(path)  # an outdated format
+
+    print("Building %s..." % message)
+    start_time = time.clock()
+    save_arrays(build(), {'version': version}, path)
+    print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
+    return load_arrays(path, names)[0]
+
+
+def load_snapshot(path, database=None):
+    """
+    Load a snapshot written by compile_snapshot(). The arrays are memory-mapped read-only.
+
+    :param path: the directory of the snapshot
+    :param database: an empty database to restore the grid cells into, a new one is created if None
+    :type path: str
+    :type database: SpatioTemporalDatabase
+    :return: the road network and the database with its grid cells and anchors
+    :rtype: [RoadNetwork, SpatioTemporalDatabase]
+    """
+    if database is None:
+        database = SpatioTemporalDatabase()
+    [arrays, meta] = load_arrays(path, RoadNetwork.ARRAY_NAMES)
+    if meta['version'] != SNAPSHOT_VERSION:
+        raise ValueError("incompatible snapshot: %s" % path)
+    road_network = RoadNetwork.from_arrays(arrays)
+
+    grid_path = os.path.join(path, GRID_DIR % database.precision)
+    [arrays, meta] = load_arrays(grid_path, GRID_ARRAY_NAMES)
+    if meta['version'] != SNAPSHOT_VERSION or meta['precision'] != database.precision:
+        raise ValueError("incompatible snapshot: %s" % grid_path)
+    grid_offsets = arrays['grid_offsets']
+    grid_vertices = arrays['grid_vertices']
+    for i, geohash in enumerate(arrays['grid_geohash'].tolist()):
+        grid_cell = GridCell(str(geohash))
+        grid_cell.anchor = int(arrays['grid_anchor'][i])
+        grid_cell.vertex_list = set(grid_vertices[grid_offsets[i]:grid_offsets[i + 1]].tolist())
+        database.grid[grid_cell.geohash] = grid_cell
+        database.num_grid += 1
+
+    return [road_network, database]
+
+
+def load_or_compile(vertices_file=VERTICES_FILE, edges_file=EDGES_FILE, cache_dir=CACHE_DIR, database=None):
+    """
+    Load the snapshot of the given road data, compiling it first if it does not exist yet.
+
+    :param vertices_file: path of the vertices csv file
+    :param edges_file: path of the edges csv file
+    :param cache_dir: the directory in which the snapshots are stored
+    :param database: an empty database to restore the grid cells into, a new one is created if None; the grid cells
+    of its precision are compiled if the snapshot does not hold them yet
+    :type vertices_file: str
+    :type edges_file: str
+    :type cache_dir: str
+    :type database: SpatioTemporalDatabase
+    :return: the road network and the database with its grid cells and anchors
+    :rtype: [RoadNetwork, SpatioTemporalDatabase]
+
+    The snapshot restores the packed arrays, locations and shortest paths of the road network it was compiled from:
+
+    >>> import pandas as pd
+    >>> import snapshot
+    >>> from road_network import make_grid_network, dijkstra
+    >>> grid_network = make_grid_network(4, 5)
+    >>> grid_network.pack()
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> vertices_file = os.path.join(cache_dir, "vertices.csv")
+    >>> edges_file = os.path.join(cache_dir, "edges.csv")
+    >>> v_ids = np.flatnonzero(grid_network.v_exists)
+    >>> e_ids = np.flatnonzero(grid_network.e_exists)
+    >>> pd.DataFrame({'v_id': v_ids, 'lat': grid_network.v_lat[v_ids], 'lon': grid_network.v_lon[v_ids]}).to_csv(
+    ...     vertices_file, index=False)
+    >>> edges = pd.DataFrame({'e_id': e_ids, 'start_vid': grid_network.e_start[e_ids],
+    ...                       'end_vid': grid_network.e_end[e_ids], 'length': grid_network.e_weight[e_ids]})
+    >>> edges.to_csv(edges_file, index=False)
+    >>> road_network = load_data(vertices_file, edges_file)  # doctest: +ELLIPSIS
+    Loading data and create road network (a few seconds)...
+    ...
+    >>> [loaded, database] = load_or_compile(vertices_file, edges_file, cache_dir)  # doctest: +ELLIPSIS
+    Compiling the road network snapshot...
+    ...
+    Loading the road network snapshot...
+    Done. Elapsed time is ... seconds.
+    >>> all(np.array_equal(getattr(loaded, name), getattr(road_network, name))
+    ...     for name in ('offsets', 'targets', 'edge_ids', 'weights'))
+    True
+    >>> all(str(loaded.get_location(v_id)) == str(road_network.get_location(v_id)) for v_id in v_ids.tolist())
+    True
+    >>> [path, expected] = [dijkstra(loaded, 0, 19), dijkstra(road_network, 0, 19)]
+    >>> path.vertex_list == expected.vertex_list and path.distance == expected.distance
+    True
+    >>> expected = SpatioTemporalDatabase()
+    >>> expected.load_road_network(road_network)
+    >>> expected.determine_anchor(road_network)
+    >>> all(item.anchor == expected.grid[key].anchor and item.vertex_list == expected.grid[key].vertex_list
+    ...     for key, item in database.grid.items()) and len(database.grid) == len(expected.grid)
+    True
+
+    The second call loads the snapshot without compiling it again, while a new format version or changed road data
+    compile a new one:
+
+    >>> [loaded, database] = load_or_compile(vertices_file, edges_file, cache_dir)  # doctest: +ELLIPSIS
+    Loading the road network snapshot...
+    Done. Elapsed time is ... seconds.
+    >>> snapshot.SNAPSHOT_VERSION += 1
+    >>> [loaded, database] = snapshot.load_or_compile(vertices_file, edges_file, cache_dir)  # doctest: +ELLIPSIS
+    Compiling the road network snapshot...
+    ...
+    >>> snapshot.SNAPSHOT_VERSION -= 1
+
+    A database of another precision compiles only the grid cells of its precision, next to those of the others:
+
+    >>> database = SpatioTemporalDatabase(precision=PRECISION - 1)
+    >>> [loaded, database] = load_or_compile(vertices_file, edges_file, cache_dir, database)  # doctest: +ELLIPSIS
+    Compiling the grid cells of precision ...
+    Loading the road network snapshot...
+    Done. Elapsed time is ... seconds.
+    >>> names = os.listdir(snapshot_path(vertices_file, edges_file, cache_dir))
+    >>> GRID_DIR % PRECISION in names and GRID_DIR % (PRECISION - 1) in names
+    True
+    >>> expected = SpatioTemporalDatabase(precision=PRECISION - 1)
+    >>> expected.load_road_network(road_network)
+    >>> expected.determine_anchor(road_network)
+    >>> all(item.anchor == expected.grid[key].anchor and item.vertex_list == expected.grid[key].vertex_list
+    ...     for key, item in database.grid.items()) and len(database.grid) == len(expected.grid)
+    True
+    >>> edges.loc[0, 'length'] += 100.0
+    >>> edges.to_csv(edges_file, index=False)
+    >>> [loaded, database] = load_or_compile(vertices_file, edges_file, cache_dir)  # doctest: +ELLIPSIS
+    Compiling the road network snapshot...
+    ...
+    >>> round(loaded.e_weight[0] - road_network.e_weight[0], 6)
+    100.0
+    >>> shutil.rmtree(cache_dir)
+    """
+    precision = database.precision if database is not None else PRECISION
+    path = snapshot_path(vertices_file, edges_file, cache_dir)
+    if not os.path.isdir(path):
+        print("Compiling the road network snapshot...")
+        start_time = time.clock()
+        road_network = load_data(vertices_file, edges_file)
+        compiled = SpatioTemporalDatabase(precision=precision)
+        compiled.load_road_network(road_network)
+        compiled.determine_anchor(road_network)
+        compile_snapshot(road_network, compiled, path)
+        print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
+    elif not os.path.isdir(os.path.join(path, GRID_DIR % precision)):
+        print("Compiling the grid cells of precision %d..." % precision)
+        start_time = time.clock()
+        [arrays, meta] = load_arrays(path, RoadNetwork.ARRAY_NAMES)
+        road_network = RoadNetwork.from_arrays(arrays)
+        compiled = SpatioTemporalDatabase(precision=precision)
+        compiled.load_road_network(road_network)
+        compiled.determine_anchor(road_network)
+        compile_grid(compiled, path)
+        print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
+
+    print("Loading the road network snapshot...")
+    start_time = time.clock()
+    [road_network, database] = load_snapshot(path, database)
+    print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
+    return [road_network, database]
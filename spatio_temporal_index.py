@@ -6,15 +6,104 @@ Date of completion (1st time): 2016/12/16
 
 Description: This module contains the abstraction of the City-Grid (Spatio-Temporal Index).
 
+=== Constants ===
+GRID_DISTANCE_MATRIX_FILE: str
+    The path of the legacy grid distance matrix, pickled as a dict of dict of MatrixCell.
+GRID_DISTANCE_MATRIX_DIR: str
+    The directory of the dense grid distance matrix, see GridDistanceMatrix. The matrix of a database of another
+    precision than PRECISION is saved in this directory + "-p<precision>".
 """
 
 
+import bisect
+import math
+import os
 import pickle
+import shutil
+import tempfile
+
+import numpy as np
 
 from road_network import *
-from geohash import geo_decode
-from location import Location, get_distance
-from constants import AVERAGE_SPEED
+from geohash import geo_encode, geo_decode, geo_decode_many, geo_encode_many, geohash_to_str_many
+from location import Location, great_circle_distance_pairs
+from container import LRUCache, TimingWheel
+from geohash_hierarchy import GeoHashHierarchy
+from constants import AVERAGE_SPEED, GRID_ROW_CACHE_SIZE, ETA_EXPIRY_SLACK, PRECISION
+
+
+GRID_DISTANCE_MATRIX_FILE = "grid_distance_matrix"
+GRID_DISTANCE_MATRIX_DIR = "./data/grid_distance_matrix"
+
+
+class TaxiList:
+    """
+    The taxi list of a grid cell: the taxis which are in the grid cell or scheduled to enter it, ordered by their
+    arrival time (ETA).
+    """
+    def __init__(self):
+        """
+        Initialize a TaxiList.
+
+        :return: None
+        """
+        self.etas = dict()  # @type etas: dict[int, float], the ETA of each taxi
+        self.ordered = []   # @type ordered: list[(float, int)], (ETA, taxi id) sorted by ETA
+
+    def __len__(self):
+        return len(self.etas)
+
+    def __contains__(self, taxi_id):
+        return taxi_id in self.etas
+
+    def __iter__(self):
+        return iter([taxi_id for (eta, taxi_id) in self.ordered])
+
+    def __getitem__(self, taxi_id):
+        return self.etas[taxi_id]
+
+    def add(self, taxi_id, eta):
+        """
+        Add a taxi, or update its ETA if it is in the list.
+
+        :param taxi_id: int
+        :param eta: float
+        :return: None
+        """
+        self.remove(taxi_id)
+        self.etas[taxi_id] = eta
+        bisect.insort(self.ordered, (eta, taxi_id))
+
+    def remove(self, taxi_id):
+        """
+        Remove a taxi if it is in the list.
+
+        :param taxi_id: int
+        :return: None
+        """
+        if taxi_id not in self.etas:
+            return
+        eta = self.etas.pop(taxi_id)
+        i = bisect.bisect_left(self.ordered, (eta, taxi_id))
+        del self.ordered[i]
+
+    def arriving_before(self, late):
+        """
+        Return the taxis whose ETA is at most late, in the order of ETA.
+
+        :param late: float
+        :return: list[int]
+
+        >>> taxi_list = TaxiList()
+        >>> for taxi_id, eta in [(7, 30.0), (3, 10.0), (5, 30.0), (9, 45.0), (4, 20.0)]:
+        ...     taxi_list.add(taxi_id, eta)
+        >>> taxi_list.add(9, 5.0)
+        >>> taxi_list.remove(4)
+        >>> taxi_list.arriving_before(30.0), taxi_list.arriving_before(29.9), list(taxi_list)
+        ([9, 3, 5, 7], [9, 3], [9, 3, 5, 7])
+        """
+        i = bisect.bisect_right(self.ordered, (late, float('inf')))
+        return [taxi_id for (eta, taxi_id) in self.ordered[:i]]
 
 
 class GridCell:
@@ -32,7 +121,7 @@ class GridCell:
 
         self.spatial_grid_list = []
         self.temporal_grid_list = []
-        self.taxi_list = dict()
+        self.taxi_list = TaxiList()
 
     def __str__(self):
 
@@ -57,10 +146,10 @@ class GridCell:
         return len(self.taxi_list)
 
     def remove_taxi(self, taxi_id):
-        self.taxi_list.pop(taxi_id)
+        self.taxi_list.remove(taxi_id)
 
     def add_taxi(self, taxi_id, t_arrive):
-        self.taxi_list[taxi_id] = t_arrive
+        self.taxi_list.add(taxi_id, t_arrive)
 
 
 class MatrixCell:
@@ -85,19 +174,434 @@ class MatrixCell:
         return "({}, {})".format(self.d, self.t)
 
 
+class _MatrixRow:
+    """
+    A read-only, dict-like view of the row of a GridDistanceMatrix, mapping the geohash of grid[j] to MatrixCell(i, j).
+    """
+
+    def __init__(self, matrix, d_row, t_row):
+        self.matrix = matrix
+        self.d_row = d_row
+        self.t_row = t_row
+
+    def __len__(self):
+        return len(self.matrix.geohash_list)
+
+    def __contains__(self, geohash):
+        return geohash in self.matrix.index
+
+    def __iter__(self):
+        return iter(self.matrix.geohash_list)
+
+    def __getitem__(self, geohash):
+        j = self.matrix.index[geohash]
+        return MatrixCell(float(self.d_row[j]), float(self.t_row[j]))
+
+    def keys(self):
+        return list(self.matrix.geohash_list)
+
+    def items(self):
+        d_row = self.d_row.tolist()
+        t_row = self.t_row.tolist()
+        return [(geohash, MatrixCell(d_row[j], t_row[j])) for j, geohash in enumerate(self.matrix.geohash_list)]
+
+
+class GridDistanceMatrix:
+    """
+    The dense grid distance matrix.
+
+    The spatial distances d(i, j) and the temporal distances t(i, j) are stored in two (G, G) float32 arrays, whose
+    rows and columns follow geohash_list. On disk each array is a .npy file, which is memory-mapped when loaded.
+
+    grid_distance_matrix[i][j] returns MatrixCell(d(i, j), t(i, j)), as the former dict of dict did.
+    """
+
+    def __init__(self, geohash_list, d=None, t=None):
+        """
+        Initialize a GridDistanceMatrix.
+
+        :param geohash_list: the geohash of the grid cells, in the order of the rows
+        :param d: the spatial distance matrix, unit: m
+        :param t: the temporal distance matrix, unit: s
+        :type geohash_list: list[str]
+        :type d: numpy.ndarray
+        :type t: numpy.ndarray
+        :return: None
+        """
+        self.geohash_list = [str(geohash) for geohash in geohash_list]
+        self.index = {geohash: i for i, geohash in enumerate(self.geohash_list)}
+
+        num_grid = len(self.geohash_list)
+        if d is None:
+            d = np.zeros((num_grid, num_grid), dtype=np.float32)
+        if t is None:
+            t = np.zeros((num_grid, num_grid), dtype=np.float32)
+        self.d = d
+        self.t = t
+
+    def __len__(self):
+        return len(self.geohash_list)
+
+    def __contains__(self, geohash):
+        return geohash in self.index
+
+    def __iter__(self):
+        return iter(self.geohash_list)
+
+    def __getitem__(self, geohash):
+        i = self.index[geohash]
+        return _MatrixRow(self, self.d[i], self.t[i])
+
+    def keys(self):
+        return list(self.geohash_list)
+
+    def save(self, path):
+        """
+        Save the matrix to the directory path.
+
+        The files are written to a temporary directory first and then renamed, like snapshot.save_arrays(), so an
+        interrupted save never leaves a partially written matrix behind.
+
+        :param path: str
+        :return: None
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp_path = tempfile.mkdtemp(dir=parent)
+        np.save(os.path.join(tmp_path, "geohash.npy"), np.array(self.geohash_list))
+        np.save(os.path.join(tmp_path, "d.npy"), np.asarray(self.d, dtype=np.float32))
+        np.save(os.path.join(tmp_path, "t.npy"), np.asarray(self.t, dtype=np.float32))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:  # another process has saved the same directory in the meantime
+            shutil.rmtree(tmp_path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a matrix saved by save(), memory-mapping the distance arrays.
+
+        :param path: str
+        :return: GridDistanceMatrix
+        """
+        geohash_list = np.load(os.path.join(path, "geohash.npy")).tolist()
+        d = np.asarray(np.load(os.path.join(path, "d.npy"), mmap_mode='r'))
+        t = np.asarray(np.load(os.path.join(path, "t.npy"), mmap_mode='r'))
+        return cls(geohash_list, d, t)
+
+    @classmethod
+    def from_dict(cls, matrix_dict):
+        """
+        Convert the legacy dict of dict of MatrixCell into a GridDistanceMatrix.
+
+        :param matrix_dict: dict[str, dict[str, MatrixCell]]
+        :return: GridDistanceMatrix
+
+        The converted matrix, also after a save() and load() round trip, returns the same cells as the legacy dict:
+
+        >>> import random
+        >>> rng = random.Random(0)
+        >>> geohash_list = ['wx4g0%s' % c for c in 'bcfguvyz']
+        >>> matrix_dict = {geohash_i: {geohash_j: MatrixCell(rng.randint(0, 40000) / 4.0, rng.randint(0, 4000) / 4.0)
+        ...                            for geohash_j in geohash_list} for geohash_i in geohash_list}
+        >>> matrix = GridDistanceMatrix.from_dict(matrix_dict)
+        >>> path = os.path.join(tempfile.mkdtemp(), "matrix")
+        >>> matrix.save(path)
+        >>> os.listdir(os.path.dirname(path))
+        ['matrix']
+        >>> loaded = GridDistanceMatrix.load(path)
+        >>> sorted(loaded.keys()) == sorted(matrix_dict.keys())
+        True
+        >>> all((m[i][j].d, m[i][j].t) == (matrix_dict[i][j].d, matrix_dict[i][j].t)
+        ...     for m in (matrix, loaded) for i in geohash_list for j in geohash_list)
+        True
+        >>> shutil.rmtree(os.path.dirname(path))
+        """
+        matrix = cls(sorted(matrix_dict.keys()))
+        for i, geohash_i in enumerate(matrix.geohash_list):
+            for geohash_j, matrix_cell in matrix_dict[geohash_i].items():
+                j = matrix.index[geohash_j]
+                matrix.d[i, j] = matrix_cell.d
+                matrix.t[i, j] = matrix_cell.t
+        return matrix
+
+
+class LazyGridDistanceMatrix:
+    """
+    The grid distance matrix whose rows are computed on demand.
+
+    A row is computed (see distance_matrix.compute_rows()) the first time it is read, and kept in an LRU cache of
+    cache_size rows together with the spatial grid list and the temporal grid list derived from it. If row_store_dir
+    is given, every computed row is also saved there, so later simulations read it from disk instead.
+
+    grid_distance_matrix[i][j] returns MatrixCell(d(i, j), t(i, j)), as GridDistanceMatrix does.
+    """
+
+    def __init__(self, road_network, geohash_list, anchors, cache_size, row_store_dir=None, horizon=None):
+        """
+        Initialize a LazyGridDistanceMatrix.
+
+        :param road_network: the road network
+        :param geohash_list: the geohash of the grid cells, in the order of the rows
+        :param anchors: the anchors of the grid cells, in the order of the rows
+        :param cache_size: the maximum number of rows kept in memory
+        :param row_store_dir: the directory in which the computed rows are saved, None for no persistence
+        :param horizon: the time horizon of the grid lists, None for no limit
+        :type road_network: RoadNetwork
+        :type geohash_list: list[str]
+        :type anchors: list[int]
+        :type cache_size: int
+        :type row_store_dir: str
+        :type horizon: float
+        :return: None
+        """
+        from distance_matrix import shard_key
+
+        self.road_network = road_network
+        self.geohash_list = [str(geohash) for geohash in geohash_list]
+        self.index = {geohash: i for i, geohash in enumerate(self.geohash_list)}
+        self.anchors = np.array(anchors, dtype=np.int64)
+        self.horizon = horizon
+        self.rows = LRUCache(cache_size)
+
+        self.row_store_dir = None
+        if row_store_dir is not None:
+            self.row_store_dir = os.path.join(row_store_dir, shard_key(road_network, self.geohash_list, anchors))
+            if not os.path.isdir(self.row_store_dir):
+                os.makedirs(self.row_store_dir)
+
+    def __len__(self):
+        return len(self.geohash_list)
+
+    def __contains__(self, geohash):
+        return geohash in self.index
+
+    def __iter__(self):
+        return iter(self.geohash_list)
+
+    def __getitem__(self, geohash):
+        [d_row, t_row, spatial_grid_list, temporal_grid_list] = self.get_row(geohash)
+        return _MatrixRow(self, d_row, t_row)
+
+    def keys(self):
+        return list(self.geohash_list)
+
+    def get_row(self, geohash):
+        """
+        Return the row of grid[geohash], computing it if necessary.
+
+        :param geohash: str
+        :return: the spatial distance row, the temporal distance row, the spatial grid list and the temporal grid list
+        :rtype: [numpy.ndarray, numpy.ndarray, list[(str, float)], list[(str, float)]]
+
+        The rows equal those of the dense matrix, and only the cache_size most recently used ones stay in memory:
+
+        >>> import shutil, tempfile
+        >>> from distance_matrix import compute_rows
+        >>> road_network = make_grid_network(4, 5)
+        >>> geohash_list = ['wx4g%d' % k for k in range(7)]
+        >>> anchors = range(0, 20, 3)
+        >>> [d, t] = compute_rows(road_network, np.array(anchors), range(7))
+        >>> row_store_dir = tempfile.mkdtemp()
+        >>> matrix = LazyGridDistanceMatrix(road_network, geohash_list, anchors, 2, row_store_dir)
+        >>> all(np.array_equal(matrix.get_row(geohash)[0], d[i]) and np.array_equal(matrix.get_row(geohash)[1], t[i])
+        ...     for i, geohash in enumerate(geohash_list))
+        True
+        >>> [geohash for geohash in geohash_list if geohash in matrix.rows]
+        ['wx4g5', 'wx4g6']
+        >>> matrix.get_row('wx4g5') is matrix.get_row('wx4g5')
+        True
+        >>> matrix['wx4g0']['wx4g3'].t == float(t[0, 3])
+        True
+        >>> [geohash for geohash in geohash_list if geohash in matrix.rows]
+        ['wx4g0', 'wx4g5']
+
+        A new matrix on the same row store reads the saved rows instead of computing them again. Here a saved row is
+        doubled on disk, to tell it apart:
+
+        >>> row_file = os.path.join(matrix.row_store_dir, 'wx4g1.npy')
+        >>> np.save(row_file, 2 * np.load(row_file))
+        >>> reloaded = LazyGridDistanceMatrix(road_network, geohash_list, anchors, 2, row_store_dir)
+        >>> np.array_equal(reloaded.get_row('wx4g1')[1], 2 * t[1]), np.array_equal(reloaded.get_row('wx4g2')[1], t[2])
+        (True, True)
+        >>> shutil.rmtree(row_store_dir)
+        """
+        row = self.rows.get(geohash)
+        if row is not None:
+            return row
+
+        row_file = None
+        if self.row_store_dir is not None:
+            row_file = os.path.join(self.row_store_dir, geohash + ".npy")
+        if row_file is not None and os.path.isfile(row_file):
+            [d_row, t_row] = np.load(row_file)
+        else:
+            from distance_matrix import compute_rows
+
+            [d, t] = compute_rows(self.road_network, self.anchors, [self.index[geohash]])
+            [d_row, t_row] = [d[0], t[0]]
+            if row_file is not None:
+                tmp_file = row_file + ".tmp.npy"
+                np.save(tmp_file, np.array([d_row, t_row]))
+                os.rename(tmp_file, row_file)
+
+        row = [d_row, t_row, _sorted_grid_list(self.geohash_list, d_row, _spatial_limit(self.horizon)),
+               _sorted_grid_list(self.geohash_list, t_row, self.horizon)]
+        self.rows.put(geohash, row)
+        return row
+
+
+def _sorted_grid_list(geohash_list, row, limit=None):
+    """
+    Return the grid cells sorted by their distance in a row of the grid distance matrix.
+
+    Only the grid cells whose distance is at most limit are kept, so the size of the list (and the time to sort it)
+    depends on the size of the neighborhood rather than on the number of grid cells.
+
+    :param geohash_list: the geohash of the grid cells, in the order of the columns
+    :param row: a row of the spatial or temporal distance matrix
+    :param limit: the maximum distance, None for no limit
+    :type geohash_list: list[str]
+    :type row: numpy.ndarray
+    :type limit: float
+    :return: list of (geohash, distance)
+    :rtype: list[(str, float)]
+
+    A truncated list is the prefix of the full list up to the limit, both for the spatial distances (with the limit
+    horizon * AVERAGE_SPEED) and for the temporal distances (with the limit horizon):
+
+    >>> from distance_matrix import compute_rows
+    >>> road_network = make_grid_network(6, 6)
+    >>> geohash_list = ['wx4g%d' % k for k in range(9)]
+    >>> [d, t] = compute_rows(road_network, np.arange(0, 36, 4), range(9))
+    >>> horizon = 60.0
+    >>> all(_sorted_grid_list(geohash_list, row, limit) ==
+    ...     [item for item in _sorted_grid_list(geohash_list, row) if item[1] <= limit]
+    ...     for [matrix, limit] in [[d, _spatial_limit(horizon)], [t, horizon]] for row in matrix)
+    True
+    >>> [len(_sorted_grid_list(geohash_list, d[0], _spatial_limit(horizon))) < len(geohash_list),
+    ...  len(_sorted_grid_list(geohash_list, t[0], horizon)) < len(geohash_list)]
+    [True, True]
+    """
+    row = np.asarray(row)
+    if limit is None:
+        columns = np.arange(len(row))
+    else:
+        columns = np.flatnonzero(row <= limit)
+    columns = columns[np.argsort(row[columns], kind='mergesort')]
+    return list(zip([geohash_list[j] for j in columns.tolist()], row[columns].tolist()))
+
+
+def _spatial_limit(horizon):
+    """
+    Return the spatial distance corresponding to a time horizon.
+
+    A grid cell whose temporal distance is within the horizon is at most horizon * AVERAGE_SPEED meters away, since the
+    shortest path is never shorter than the straight line.
+
+    :param horizon: the time horizon, unit: s
+    :type horizon: float
+    :return: float
+    """
+    if horizon is None:
+        return None
+    return horizon * AVERAGE_SPEED
+
+
+def _grid_distance_matrix_dir(precision):
+    """
+    Return the directory of the dense grid distance matrix of the grid cells of a given precision.
+
+    :param precision: int
+    :return: str
+    """
+    if precision == PRECISION:
+        return GRID_DISTANCE_MATRIX_DIR
+    return "%s-p%d" % (GRID_DISTANCE_MATRIX_DIR, precision)
+
+
+def anchor_vertices(road_network, precision):
+    """
+    Return the anchors of the grid cells of a given precision: the vertex of each grid cell closest to its center.
+
+    All the vertices are processed at once: they are grouped by their integer GeoHash, their distances to the centers
+    of their grid cells are computed in one array kernel, and the closest vertex of every group is picked by a
+    segmented argmin (a sort by (cell, distance) and the first vertex of each cell). Grid cells at any precision can
+    therefore be re-anchored in a fraction of a second. Vertices without coordinates are never anchors.
+
+    :param road_network: the road network
+    :param precision: the length of the GeoHash of the grid cells
+    :type road_network: RoadNetwork
+    :type precision: int
+    :return: the GeoHash of the grid cells with a vertex, and their anchors
+    :rtype: [numpy.ndarray, numpy.ndarray]
+    """
+    road_network.pack()
+    v_ids = np.flatnonzero(road_network.v_exists & ~np.isnan(road_network.v_lat) & ~np.isnan(road_network.v_lon))
+    [lats, lons] = road_network.get_coordinates(v_ids)
+    cells = geo_encode_many(lats, lons, precision)
+    [center_lats, center_lons] = geo_decode_many(cells, precision)
+    dis = great_circle_distance_pairs(center_lats, center_lons, lats, lons)
+
+    order = np.lexsort((v_ids, dis, cells))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = cells[order][1:] != cells[order][:-1]
+    best = order[first]
+    return [geohash_to_str_many(cells[best], precision), v_ids[best]]
+
+
 class SpatioTemporalDatabase:
-    def __init__(self, grid=None, grid_distance_matrix=None):
+    def __init__(self, grid=None, grid_distance_matrix=None, lazy=False, cache_size=GRID_ROW_CACHE_SIZE,
+                 row_store_dir=None, horizon=None, precision=PRECISION, hierarchy=None):
         """
         Initialize a SpatioTemporalDatabase.
 
         SpatioTemporalDatabase is the abstraction data type of the spatio-temporal database.
 
+        In the lazy mode, the grid distance matrix is not pre-computed by init_static_info(). Instead, a row of the
+        matrix and the spatial/temporal grid lists of the corresponding grid cell are computed the first time they are
+        needed, see LazyGridDistanceMatrix. The grid lists must then be read through get_spatial_grid_list() and
+        get_temporal_grid_list().
+
+        With a time horizon, the temporal grid list of a grid cell only holds the grid cells that can be reached within
+        the horizon (and the spatial grid list those within horizon * AVERAGE_SPEED meters). Taxi searching never looks
+        beyond PATIENCE, so PATIENCE is a safe horizon for dispatching.
+
+        The grid cells are the GeoHash cells of the given precision, so several databases of different precisions can
+        live in one process. With a GeoHashHierarchy, the current locations of the taxis are also indexed by cells
+        adapted to their density, and the dispatcher searches the candidate taxis of a query in it instead of in the
+        temporal grid list (see Dispatcher).
+
         :param grid: a {key: value} Hash Map, with geohash str as the key, and GridCell
         the value
+        :param lazy: if the grid distance matrix is computed on demand
+        :param cache_size: the number of rows kept in memory in the lazy mode
+        :param row_store_dir: the directory in which the rows are saved in the lazy mode, None for no persistence
+        :param horizon: the time horizon of the grid lists, unit: s, None for no limit
+        :param precision: the length of the GeoHash of the grid cells
+        :param hierarchy: the multi-resolution index of the taxi locations, None for no such index
         :type grid: dict[str, GridCell]
+        :type lazy: bool
+        :type cache_size: int
+        :type row_store_dir: str
+        :type horizon: float
+        :type precision: int
+        :type hierarchy: GeoHashHierarchy
         :return: None
         """
         self.num_grid = 0
+        self.precision = precision
+        self.hierarchy = hierarchy
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self.row_store_dir = row_store_dir
+        self.horizon = horizon
+
+        # The scheduled (future) entries of the taxi lists: taxi id --> {geohash: ETA}. The entry of the grid cell a
+        # taxi is in is not part of it. Expired entries are collected by a timing wheel, see expire_taxi_list().
+        self.scheduled_grids = dict()
+        self.expiry_wheel = TimingWheel(1024)
 
         if grid is None:
             self.grid = dict()
@@ -111,7 +615,7 @@ class SpatioTemporalDatabase:
 
     def __str__(self):
 
-        return "SpatioTemporalDatabase:\n- num grid cell: {}".format(self.num_grid)
+        return "SpatioTemporalDatabase:\n- num grid cell: {}\n- precision: {}".format(self.num_grid, self.precision)
 
     def load_road_network(self, road_network):
         """
@@ -122,8 +626,7 @@ class SpatioTemporalDatabase:
         """
         # Scan all the vertices and create grid cells.
         for v_id in road_network.vertex_set:
-            vertex = road_network.get_vertex(v_id)
-            geohash = vertex.get_geohash()
+            geohash = self.get_vertex_geohash(road_network, v_id)
             if geohash not in self.grid:
                 new_grid_cell = GridCell(geohash)
                 new_grid_cell.vertex_list.add(v_id)
@@ -139,103 +642,124 @@ class SpatioTemporalDatabase:
         2. Compute the grid distance matrix.
         3. Construct the spatial grid list and the temporal grid list of all the grid cells.
 
+        In the lazy mode, only the anchors are determined here; steps 2 and 3 are carried out per grid cell on demand.
+
         :param road_network: RoadNetwork
         :return: None
         """
         import time
 
-        print("Determining the anchor nodes...")
-        start_time = time.clock()
-        self.__determine_anchor(road_network)
-        print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
+        if any(cell.anchor is None for cell in self.grid.values()):  # the anchors may be restored from a snapshot
+            print("Determining the anchor nodes...")
+            start_time = time.clock()
+            self.determine_anchor(road_network)
+            print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
+
+        if self.lazy:
+            geohash_list = sorted(self.grid.keys())
+            anchors = [self.grid[geohash].anchor for geohash in geohash_list]
+            self.grid_distance_matrix = LazyGridDistanceMatrix(road_network, geohash_list, anchors, self.cache_size,
+                                                               self.row_store_dir, self.horizon)
+            return
 
-        print("Computing the grid distance matrix (about 32 minutes)...")
         start_time = time.clock()
-        #self.__compute_distance_matrix(road_network)  # re-compute the grid distance matrix
-        # call the function pickle.load() and restore the grid distance through "byte stream deserialization"
-        f = open('grid_distance_matrix', 'rb')
-        self.grid_distance_matrix = pickle.load(f)
-        f.close()
+        matrix_dir = _grid_distance_matrix_dir(self.precision)
+        if os.path.isdir(matrix_dir):
+            print("Loading the grid distance matrix...")
+            self.grid_distance_matrix = GridDistanceMatrix.load(matrix_dir)
+        elif os.path.isfile(GRID_DISTANCE_MATRIX_FILE) and self.precision == PRECISION:
+            # Convert the legacy pickled matrix into the dense format once.
+            print("Converting the pickled grid distance matrix...")
+            f = open(GRID_DISTANCE_MATRIX_FILE, 'rb')
+            self.grid_distance_matrix = GridDistanceMatrix.from_dict(pickle.load(f))
+            f.close()
+            self.grid_distance_matrix.save(matrix_dir)
+        else:
+            print("Computing the grid distance matrix (a few minutes on a many-core machine)...")
+            self.__compute_distance_matrix(road_network, matrix_dir + ".shards")
+            self.grid_distance_matrix.save(matrix_dir)
+            shutil.rmtree(matrix_dir + ".shards")  # only once the matrix is saved
         print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
 
-        print("Constructing the spatial grid list and temporal grid list (about 8 seconds)...")
+        print("Constructing the spatial grid list and temporal grid list...")
         start_time = time.clock()
         self.__construct_static_list()
         print("Done. Elapsed time is %f seconds." % (time.clock() - start_time))
 
-    def __determine_anchor(self, road_network):
+    def determine_anchor(self, road_network):
         """
-        Determine the anchor of all grid cells.
+        Determine the anchor of all grid cells: the vertex of the grid cell closest to its center, see
+        anchor_vertices().
 
         :param road_network: RoadNetwork
         :return: None
         """
+        [geohashes, anchors] = anchor_vertices(road_network, self.precision)
+        anchor_of = dict(zip(geohashes.tolist(), anchors.tolist()))
         for geohash in self.grid:
-            center_location = self.grid[geohash].center_location
-            anchor = None
-            min_dis = float('inf')
-
-            # Scan all the vertexes in the grid and pick the one closest to the center location.
-            for v_id in self.grid[geohash].vertex_list:
-                vertex = road_network.get_vertex(v_id)
-                location = vertex.location
-                dis = get_distance(location, center_location)
-                if dis < min_dis:
-                    anchor = v_id
-                    min_dis = dis
-            self.grid[geohash].anchor = anchor
-
-    def __compute_distance_matrix(self, road_network):
+            self.grid[geohash].anchor = anchor_of.get(geohash)
+
+    def __compute_distance_matrix(self, road_network, shard_dir):
         """
         Compute the grid distance matrix.
 
+        The single-source searches from the anchors run in parallel, see distance_matrix.build_grid_distance_matrix().
+        The finished shards are kept in shard_dir until the matrix has been saved, so an interrupted computation (or
+        save) resumes where it stopped.
+
         :param road_network: RoadNetwork
+        :param shard_dir: str
         :return: None
         """
+        from distance_matrix import build_grid_distance_matrix
 
-        # Double-scan all the grid cells.
-        for i in self.grid:
-            anchor_i = self.grid[i].anchor
-            anchor_i_location = road_network.get_vertex(anchor_i).location
-            come_from = single_source_dijkstra(road_network, anchor_i)
-            self.grid_distance_matrix[i] = dict()
-            for j in self.grid:
-                anchor_j = self.grid[j].anchor
-                anchor_j_location = road_network.get_vertex(anchor_j).location
-                d = get_distance(anchor_i_location, anchor_j_location)  # the spatial distance
-                shortest_path = construct_path(road_network, anchor_i, anchor_j, come_from)
-                if len(shortest_path.vertex_list) == 0:
-                    t = d / AVERAGE_SPEED
-                else:
-                    t = shortest_path.distance / AVERAGE_SPEED  # the temporal distance
-
-                # Put (d, t) into the grid distance matrix.
-                matrix_cell = MatrixCell(d, t)
-                self.grid_distance_matrix[i][j] = matrix_cell
+        self.grid_distance_matrix = build_grid_distance_matrix(self, road_network, shard_dir)
 
     def __construct_static_list(self):
         """
         Construct the spatial grid list and the temporal grid list of all the grid cells, according to the grid
         distance matrix.
 
+        If self.horizon is set, a list only holds the grid cells within the horizon, see _sorted_grid_list().
+
         :return: None
         """
-        for i in self.grid:
+        matrix = self.grid_distance_matrix
+        spatial_limit = _spatial_limit(self.horizon)
+        for i, geohash in enumerate(matrix.geohash_list):
+            grid_cell = self.grid[geohash]
+            grid_cell.spatial_grid_list = _sorted_grid_list(matrix.geohash_list, matrix.d[i], spatial_limit)
+            grid_cell.temporal_grid_list = _sorted_grid_list(matrix.geohash_list, matrix.t[i], self.horizon)
+
+    def get_spatial_grid_list(self, geohash):
+        """
+        Return the spatial grid list of grid[geohash].
 
-            # spatial grid list
-            spatial_list = {key: value.d for key, value in self.grid_distance_matrix[i].items()}
-            spatial_grid_list = sorted(spatial_list.items(), lambda x, y: cmp(x[1], y[1]))
-            self.grid[i].spatial_grid_list = spatial_grid_list
+        :param geohash: str
+        :return: list of (geohash, spatial distance)
+        :rtype: list[(str, float)]
+        """
+        if self.lazy:
+            return self.grid_distance_matrix.get_row(geohash)[2]
+        return self.grid[geohash].spatial_grid_list
+
+    def get_temporal_grid_list(self, geohash):
+        """
+        Return the temporal grid list of grid[geohash].
 
-            # temporal grid list
-            temporal_list = {key: value.t for key, value in self.grid_distance_matrix[i].items()}
-            temporal_grid_list = sorted(temporal_list.items(), lambda x, y: cmp(x[1], y[1]))
-            self.grid[i].temporal_grid_list = temporal_grid_list
+        :param geohash: str
+        :return: list of (geohash, temporal distance)
+        :rtype: list[(str, float)]
+        """
+        if self.lazy:
+            return self.grid_distance_matrix.get_row(geohash)[3]
+        return self.grid[geohash].temporal_grid_list
 
     def init_dynamic_info(self, taxi_set, start_time):
         """
         Initialize the dynamic info of grid cells. Including:
         1. Initialize the taxi list of each grid cell.
+        2. Insert the taxis into the hierarchy, if any.
 
         :param taxi_set: the taxi set
         :param start_time: the start time of the simulation
@@ -246,12 +770,71 @@ class SpatioTemporalDatabase:
         for identifier in taxi_set:
             taxi = taxi_set[identifier]
             geohash = taxi.geohash
-            self.grid[geohash].taxi_list[identifier] = start_time
+            self.grid[geohash].add_taxi(identifier, start_time)
+            if self.hierarchy is not None:
+                self.hierarchy.move(identifier, taxi.location.lat, taxi.location.lon)
+
+    def get_geohash(self, location):
+        """
+        Return the GeoHash of the grid cell of a location.
+
+        :param location: Location
+        :return: str
+        """
+        if self.precision == PRECISION:
+            return location.geohash
+        return geo_encode(location.lat, location.lon, self.precision)
+
+    def get_vertex_geohash(self, road_network, v_id):
+        """
+        Return the GeoHash of the grid cell of vertex v_id.
+
+        A GeoHash is the prefix of the GeoHashes of higher precision inside its cell, so the GeoHash of the road network
+        only has to be re-encoded for a database of a higher precision.
+
+        :param road_network: RoadNetwork
+        :param v_id: int
+        :return: str
+        """
+        geohash = road_network.get_geohash(v_id)
+        if self.precision <= len(geohash):
+            return geohash[:self.precision]
+        location = road_network.get_location(v_id)
+        return geo_encode(location.lat, location.lon, self.precision)
+
+    def update_taxi_location(self, taxi_id, location):
+        """
+        Record the new location of a taxi in the hierarchy, if any. The grid cells are updated by move_taxi().
+
+        :param taxi_id: int
+        :param location: Location
+        :return: None
+        """
+        if self.hierarchy is not None:
+            self.hierarchy.move(taxi_id, location.lat, location.lon)
+
+    def move_taxi(self, taxi_id, from_geohash, to_geohash, timestamp):
+        """
+        Move a taxi from grid[from_geohash] to grid[to_geohash], which it enters at timestamp.
+
+        :param taxi_id: int
+        :param from_geohash: str
+        :param to_geohash: str
+        :param timestamp: int
+        :return: None
+        """
+        self.grid[from_geohash].remove_taxi(taxi_id)
+        self.scheduled_grids.get(taxi_id, dict()).pop(to_geohash, None)
+        self.grid[to_geohash].add_taxi(taxi_id, timestamp)
 
     def update_taxi_list(self, timestamp, taxi, route, road_network):
         """
         Update grid cell's taxi list according to a new route.
 
+        The entries of the previous route of the taxi are removed first, through the reverse index scheduled_grids.
+        The taxi is then scheduled to enter each grid cell on the route at its ETA (the earliest one, if the route
+        enters a grid cell several times).
+
         :param timestamp: the current time of the simulation system
         :param taxi: a Taxi instance
         :param route: a new route of a taxi
@@ -261,19 +844,80 @@ class SpatioTemporalDatabase:
         :type route: Path
         :type road_network: RoadNetwork
         :return: None
+
+        A taxi on its way from vertex 0 to vertex 3, each vertex in a grid cell of its own, is rerouted through vertex
+        4. The entries of the old route are removed and those of the new one replace them:
+
+        >>> from taxi import Taxi
+        >>> road_network = RoadNetwork()
+        >>> road_network.add_vertices(range(5), [39.90, 39.95, 40.00, 40.05, 39.95],
+        ...                           [116.3, 116.3, 116.3, 116.3, 116.4])
+        >>> road_network.add_edges(range(5), [0, 1, 2, 0, 4], [1, 2, 3, 4, 3], [7000.0] * 5)
+        >>> database = SpatioTemporalDatabase()
+        >>> database.load_road_network(road_network)
+        >>> taxi = Taxi(1, road_network.get_location(0))
+        >>> database.init_dynamic_info({1: taxi}, 0)
+        >>> def taxi_list_of(v_id):
+        ...     taxi_list = database.grid[road_network.get_geohash(v_id)].taxi_list
+        ...     return taxi_list[1] if 1 in taxi_list else None
+        >>> database.update_taxi_list(0, taxi, Path([0, 1, 2, 3], [0, 1, 2], 21000.0), road_network)
+        >>> [taxi_list_of(v_id) for v_id in range(5)]
+        [0, 1000.0, 2000.0, 3000.0, None]
+        >>> database.update_taxi_list(100, taxi, Path([0, 4, 3], [3, 4], 14000.0), road_network)
+        >>> [taxi_list_of(v_id) for v_id in range(5)]
+        [0, None, None, 2100.0, 1100.0]
+
+        The taxi enters the grid cell of vertex 4 in time, but never reaches that of vertex 3, so the latter entry
+        expires ETA_EXPIRY_SLACK seconds after its ETA (see expire_taxi_list()). The entries of the old route expire
+        without effect:
+
+        >>> database.move_taxi(1, road_network.get_geohash(0), road_network.get_geohash(4), 1150)
+        >>> database.expire_taxi_list(2100 + ETA_EXPIRY_SLACK - 1)
+        >>> [taxi_list_of(v_id) for v_id in range(5)]
+        [None, None, None, 2100.0, 1150]
+        >>> database.expire_taxi_list(2100 + ETA_EXPIRY_SLACK)
+        >>> [taxi_list_of(v_id) for v_id in range(5)]
+        [None, None, None, None, 1150]
+        >>> database.expire_taxi_list(4000)
+        >>> [taxi_list_of(v_id) for v_id in range(5)]
+        [None, None, None, None, 1150]
         """
+        for geohash in self.scheduled_grids.pop(taxi.id, dict()):
+            if geohash != taxi.geohash:
+                self.grid[geohash].remove_taxi(taxi.id)
+
         if route is None or len(route.edge_list) == 0:
             return
 
-        cur_vid = route.vertex_list[0]
-        cur_geohash = road_network.get_vertex(cur_vid).get_geohash()
+        scheduled = dict()
+        cur_geohash = self.get_vertex_geohash(road_network, route.vertex_list[0])
         dis = 0.0
         for e_id in route.edge_list:
             next_edge = road_network.get_edge(e_id)
-            end_vid = next_edge.end_vid
-            next_geohash = road_network.get_vertex(end_vid).get_geohash()
+            next_geohash = self.get_vertex_geohash(road_network, next_edge.end_vid)
             dis += next_edge.weight
             if next_geohash != cur_geohash:
-                self.grid[next_geohash].taxi_list[taxi.id] = timestamp + dis / AVERAGE_SPEED
-                cur_vid = end_vid
-                cur_geohash = road_network.get_vertex(cur_vid).get_geohash()
+                if next_geohash != taxi.geohash and next_geohash not in scheduled:
+                    eta = timestamp + dis / AVERAGE_SPEED
+                    scheduled[next_geohash] = eta
+                    self.grid[next_geohash].add_taxi(taxi.id, eta)
+                    self.expiry_wheel.schedule(math.ceil(eta + ETA_EXPIRY_SLACK), (taxi.id, next_geohash, eta))
+                cur_geohash = next_geohash
+        self.scheduled_grids[taxi.id] = scheduled
+
+    def expire_taxi_list(self, timestamp):
+        """
+        Remove the scheduled entries whose ETA has passed by more than ETA_EXPIRY_SLACK seconds.
+
+        Such a taxi has not entered the grid cell as planned (it would have been moved there by move_taxi() otherwise),
+        so it must not be found by the taxi searching any more.
+
+        :param timestamp: the current time of the simulation system
+        :type timestamp: int
+        :return: None
+        """
+        for (taxi_id, geohash, eta) in self.expiry_wheel.advance(timestamp):
+            scheduled = self.scheduled_grids.get(taxi_id)
+            if scheduled is not None and scheduled.get(geohash) == eta:  # not rescheduled in the meantime
+                scheduled.pop(geohash)
+                self.grid[geohash].remove_taxi(taxi_id)
@@ -10,7 +10,7 @@ Description: This module contains the abstraction of the taxi.
 
 
 from constants import AVERAGE_SPEED, TAXI_CAPACITY, NUM_TAXI, PRECISION, TIME_STEP, WAITING, RIDING, SATISFIED
-from geohash import geo_encode
+from geohash import geo_encode_int, geohash_to_str
 from location import Location, get_distance, bearing, end_pos
 from road_network import RoadNetwork, Path, get_shortest_path
 from spatio_temporal_index import SpatioTemporalDatabase
@@ -27,7 +27,9 @@ class Taxi:
                  num_riders=0,
                  schedule=None,
                  route=None,
-                 serving_queries=None):
+                 serving_queries=None,
+                 router=get_shortest_path,
+                 precision=PRECISION):
         """
         Initialize a Taxi.
 
@@ -40,6 +42,8 @@ class Taxi:
         :param schedule: the schedule of the taxi (a sequence of query.origin/destination that the taxi should finish)
         :param route: the route of the taxi to the first node of the schedule
         :param serving_queries: the current queries served by the taxi
+        :param router: the function which computes the route, with the signature of get_shortest_path()
+        :param precision: the length of the GeoHash of the grid cells of the spatio-temporal database
 
         :type identifier: int
         :type location: Location
@@ -50,6 +54,8 @@ class Taxi:
         :type schedule: list[ScheduleNode]
         :type route: Path
         :type serving_queries: dict[int, Query]
+        :type router: (RoadNetwork, int, int) -> Path
+        :type precision: int
 
         :return: None
         """
@@ -58,7 +64,9 @@ class Taxi:
         self.capacity = capacity
 
         self.location = location
-        self.geohash = geo_encode(location.lat, location.lon, PRECISION)
+        self.precision = precision
+        self.cell = geo_encode_int(location.lat, location.lon, precision)  # the integer form of self.geohash
+        self.geohash = geohash_to_str(self.cell, precision)
         self.num_riders = num_riders
 
         if schedule is None:
@@ -71,10 +79,13 @@ class Taxi:
             self.serving_queries = dict()
         else:
             self.serving_queries = serving_queries
+        self.router = router
 
         self.v_id = None       # the current vertex (id) that the taxi is on
         self.e_id = None      # the current edge (id) that the taxi is on
         self.__eid_index = None  # the index of e_id in route.edge_list
+        self.stop_offset = None  # the offset on the last edge of the route where the route ends, None at its end
+        self.parked_offset = None  # the offset on edge e_id where the taxi stands without a route, None on v_id
         self.driving_distance = 0.0
 
     def __str__(self):
@@ -116,19 +127,29 @@ class Taxi:
         self.driving_distance += d
 
         cur_edge = road_network.get_edge(self.e_id)
-        to_vertex = road_network.get_vertex(cur_edge.end_vid)
-        to_location = to_vertex.location
+        stops_on_edge = self.stop_offset is not None and self.__get_next_eid() is None
+        if stops_on_edge:  # The route ends in the middle of its last edge.
+            to_location = road_network.get_location_on_edge(self.e_id, self.stop_offset)
+        else:
+            to_location = road_network.get_location(cur_edge.end_vid)
 
         theta = bearing(self.location, to_location)
         next_pos = end_pos(self.location, theta, d)
 
-        e_start_vertex = road_network.get_vertex(cur_edge.start_vid)
-        edge_offset = get_distance(e_start_vertex.location, next_pos)
-        if edge_offset < cur_edge.weight:
+        if stops_on_edge:
+            arrived = get_distance(self.location, to_location) <= d
+        else:
+            arrived = get_distance(road_network.get_location(cur_edge.start_vid), next_pos) >= cur_edge.weight
+        if not arrived:
             self.__update_pos(timestamp, next_pos, database)
-        else:  # The taxi has arrived at the end of the current edge.
+        else:  # The taxi has arrived at the end of the current edge, or at the end of its route on the edge.
             self.__update_pos(timestamp, to_location, database)
-            self.v_id = road_network.get_edge(self.e_id).end_vid
+            if stops_on_edge:
+                self.v_id = cur_edge.start_vid
+                self.parked_offset = self.stop_offset
+            else:
+                self.v_id = cur_edge.end_vid
+                self.parked_offset = None
             next_eid = self.__get_next_eid()
             if next_eid is not None:
                 self.e_id = next_eid
@@ -163,6 +184,7 @@ class Taxi:
         If the taxi's geo-hash changes, we also need to update the grid's taxi list, including:
         1. Remove the taxi from the previous grid's taxi list.
         2. Insert the taxi into the newly entered grid's taxi list.
+        The location is also recorded in the hierarchy of the database, if any.
 
         :param timestamp: current timestamp of the simulation system
         :param new_pos: new position of the taxi
@@ -173,11 +195,13 @@ class Taxi:
         :return: None
         """
         self.location = new_pos
-        next_geohash = geo_encode(new_pos.lat, new_pos.lon, PRECISION)
-        if next_geohash != self.geohash:
-            database.grid[self.geohash].remove_taxi(self.id)
-            database.grid[next_geohash].add_taxi(self.id, timestamp)
+        database.update_taxi_location(self.id, new_pos)
+        next_cell = geo_encode_int(new_pos.lat, new_pos.lon, self.precision)
+        if next_cell != self.cell:
+            next_geohash = geohash_to_str(next_cell, self.precision)
+            database.move_taxi(self.id, self.geohash, next_geohash, timestamp)
             self.geohash = next_geohash
+            self.cell = next_cell
 
     def __get_next_eid(self):
         """
@@ -219,35 +243,128 @@ class Taxi:
     def update_route(self, road_network, schedule_node=None):
         """
         Update the route of a taxi.
+
+        A ScheduleNode matched to an edge is left and reached in the middle of its edge: the route then starts or ends
+        with the whole edge, and Taxi.stop_offset tells where the taxi stops on the last one.
+
         :param road_network: the road network
         :param schedule_node: the current ScheduleNode that the taxi is on
         :type road_network: RoadNetwork
         :type schedule_node: ScheduleNode
         :return: None
+
+        A point on a two-way street is matched to one of its two edges, here 1-->2, and is reached and left along
+        whichever of the two is shorter:
+
+        >>> road_network = RoadNetwork()
+        >>> road_network.add_vertices(range(4), [39.9] * 4, [116.3, 116.301, 116.302, 116.303])
+        >>> road_network.add_edges(range(6), [0, 1, 2, 1, 2, 3], [1, 2, 3, 0, 1, 2], [100.0] * 6)
+        >>> node = ScheduleNode(7, True, 1, e_id=1, offset=30.0)
+        >>> def plan(v_id, schedule_node, to_node):
+        ...     taxi = Taxi(1, road_network.get_location(v_id))
+        ...     [taxi.v_id, taxi.schedule] = [v_id, [to_node]]
+        ...     taxi.update_route(road_network, schedule_node)
+        ...     return list(taxi.route.edge_list), taxi.route.distance, taxi.stop_offset
+        >>> plan(0, None, node)    # from the west, along edge 1
+        ([0, 1], 130.0, 30.0)
+        >>> plan(3, None, node)    # from the east, along the opposite edge 4
+        ([5, 4], 170.0, 70.0)
+        >>> plan(1, node, ScheduleNode(8, False, 0))    # to the west, back along edge 4
+        ([4, 3], 130.0, None)
+        >>> plan(1, node, ScheduleNode(8, False, 3))    # to the east, on along edge 1
+        ([1, 2], 170.0, None)
         """
         if len(self.schedule) == 0:
             self.route = None
             return
 
-        if schedule_node is None:  # means that the taxi has the first ScheduleNode to be done
-            from_vid = self.v_id
-        else:
-            from_vid = schedule_node.matched_vid
-        to_vid = self.schedule[0].matched_vid
-        self.route = get_shortest_path(road_network, from_vid, to_vid)
+        if schedule_node is not None:
+            [from_vid, from_eid, from_offset] = [schedule_node.matched_vid, schedule_node.e_id, schedule_node.offset]
+        elif self.route is None and self.parked_offset is not None:  # the taxi stands in the middle of edge e_id
+            [from_vid, from_eid, from_offset] = [self.v_id, self.e_id, self.parked_offset]
+        else:  # means that the taxi has the first ScheduleNode to be done
+            [from_vid, from_eid, from_offset] = [self.v_id, None, 0.0]
+        to_node = self.schedule[0]
+        [self.route, self.stop_offset] = self.__plan(road_network, from_vid, from_eid, from_offset, to_node)
         if len(self.route.edge_list) != 0:
             self.e_id = self.route.edge_list[0]
             self.__eid_index = 0
 
-
-def gen_taxi(database, road_network):
+    def __plan(self, road_network, from_vid, from_eid, from_offset, to_node):
+        """
+        Return the route from vertex from_vid, or from the point from_offset along edge from_eid if it is given, to a
+        ScheduleNode, and the offset on its last edge where it ends (None at a vertex). The partial edges at both ends
+        are included as a whole, see Taxi.update_route().
+
+        The edge index holds a two-way road by one of its two edges only (see edge_index.EdgeIndex), so a point on a
+        two-way road is also left and reached along the opposite edge, whichever route is shorter.
+
+        :param road_network: RoadNetwork
+        :param from_vid: int
+        :param from_eid: int
+        :param from_offset: float
+        :param to_node: ScheduleNode
+        :return: the route and the offset on its last edge
+        :rtype: [Path, float]
+        """
+        if from_eid is None and to_node.e_id is None:  # vertex to vertex
+            return [self.router(road_network, from_vid, to_node.matched_vid), None]
+
+        def ways(e_id, offset):
+            """
+            The edges through the point offset along edge e_id, with the offsets of the point on them.
+            """
+            if e_id is None:
+                return [(None, None)]
+            edge = road_network.get_edge(e_id)
+            twin_eid = road_network.get_eid(edge.end_vid, edge.start_vid)
+            if twin_eid is None:
+                return [(e_id, offset)]
+            twin_weight = road_network.get_edge(twin_eid).weight
+            return [(e_id, offset), (twin_eid, (1.0 - offset / edge.weight) * twin_weight if edge.weight > 0 else 0.0)]
+
+        best = [Path([], [], 0.0), None]    # unreachable
+        best_distance = float('inf')
+        for d_eid, d_offset in ways(from_eid, from_offset):
+            for a_eid, a_offset in ways(to_node.e_id, to_node.offset):
+                if d_eid is not None and d_eid == a_eid and a_offset >= d_offset:  # further along the same edge
+                    edge = road_network.get_edge(d_eid)
+                    path = Path([edge.start_vid, edge.end_vid], [d_eid], a_offset - d_offset)
+                else:
+                    [vertex_list, edge_list, distance] = [[], [], 0.0]
+                    start_vid = from_vid
+                    if d_eid is not None:
+                        edge = road_network.get_edge(d_eid)
+                        [vertex_list, edge_list, distance] = [[edge.start_vid], [d_eid], edge.weight - d_offset]
+                        start_vid = edge.end_vid
+                    end_vid = to_node.matched_vid if a_eid is None else road_network.get_edge(a_eid).start_vid
+                    middle = self.router(road_network, start_vid, end_vid)
+                    if len(middle.vertex_list) == 0:  # unreachable
+                        continue
+                    vertex_list += list(middle.vertex_list)
+                    edge_list += list(middle.edge_list)
+                    distance += middle.distance
+                    if a_eid is not None:
+                        vertex_list.append(road_network.get_edge(a_eid).end_vid)
+                        edge_list.append(a_eid)
+                        distance += a_offset
+                    path = Path(vertex_list, edge_list, distance)
+                if path.distance < best_distance:
+                    best = [path, a_offset]
+                    best_distance = path.distance
+        return best
+
+
+def gen_taxi(database, road_network, router=get_shortest_path):
     """
     Generate entities of taxi.
 
     :param database: the spatio-temporal database
     :param road_network: the road network
+    :param router: the function which computes the route of the taxis, see Taxi
     :type database: SpatioTemporalDatabase
     :type road_network: RoadNetwork
+    :type router: (RoadNetwork, int, int) -> Path
     :return: a dictionary with key the id of a taxi and value the corresponding Taxi instance
     :rtype: dict[int, Taxi]
     """
@@ -271,8 +388,8 @@ def gen_taxi(database, road_network):
 
         cnt = 0
         for v_id in grid.vertex_list:
-            location = road_network.vertex_set[v_id].location
-            taxi = Taxi(identifier, location)
+            location = road_network.get_location(v_id)
+            taxi = Taxi(identifier, location, router=router, precision=database.precision)
             taxi.v_id = v_id
             taxi_set[identifier] = taxi
 
@@ -0,0 +1,254 @@
+"""
+Date of creation: 2026/10/16
+
+Description: This module contains the nearest-vertex index of the road network, which snaps a location to the closest
+vertex (map matching).
+
+The vertices are projected to meters (an equirectangular projection around the center of the city, accurate to well
+under a meter at the scale of a city block) and put into a uniform grid of square buckets. A query scans the bucket of
+the location and its neighbors, and then larger and larger squares of buckets around it, until no bucket outside the
+scanned square can hold a closer vertex. Unlike a lookup in the GeoHash cell of the location, it finds a vertex for
+every location and never misses a closer vertex just across a cell edge.
+
+=== Constants ===
+BUCKET_SIZE: float
+    The default side of a bucket in meters.
+CHUNK_SIZE: int
+    The number of locations of a bucket scored together by VertexIndex.nearest_vertices(), which bounds the size of
+    the distance matrices.
+"""
+
+
+import math
+
+import numpy as np
+
+from road_network import RoadNetwork
+from constants import R
+
+
+BUCKET_SIZE = 200.0
+CHUNK_SIZE = 1024
+
+
+class VertexIndex:
+    """
+    A bucket grid of the vertices of a road network, in projected meters.
+
+    The vertices of bucket b (row-major, b = iy * nx + ix) are vertices[offsets[b]:offsets[b + 1]], with their projected
+    coordinates at the same positions of xs and ys.
+
+    The vertices found are as close as those of a scan of all the vertices, also with a mask and for the locations
+    outside the city:
+
+    >>> from road_network import make_grid_network
+    >>> road_network = make_grid_network(6, 6, shape_points=1)
+    >>> rng = np.random.RandomState(0)
+    >>> lats = rng.uniform(39.895, 39.91, 500)
+    >>> lons = rng.uniform(116.295, 116.31, 500)
+    >>> num_vertex = road_network.num_vertex
+    >>> for vertex_mask in (None, np.arange(num_vertex) % 7 == 0):
+    ...     index = VertexIndex(road_network, vertex_mask, bucket_size=50.0)
+    ...     v_ids = np.arange(num_vertex) if vertex_mask is None else np.flatnonzero(vertex_mask)
+    ...     [xs, ys] = index.project(road_network.v_lat[v_ids], road_network.v_lon[v_ids])
+    ...     [qx, qy] = index.project(lats, lons)
+    ...     expected = np.hypot(qx[:, None] - xs[None, :], qy[:, None] - ys[None, :]).min(axis=1)
+    ...     found = index.nearest_vertices(lats, lons)
+    ...     [fx, fy] = index.project(road_network.v_lat[found], road_network.v_lon[found])
+    ...     print(bool(np.isin(found, v_ids).all()) and np.allclose(np.hypot(qx - fx, qy - fy), expected))
+    True
+    True
+    """
+
+    def __init__(self, road_network, vertex_mask=None, bucket_size=BUCKET_SIZE):
+        """
+        Build the index of the vertices of a road network.
+
+        :param road_network: the road network
+        :param vertex_mask: if given, only the vertices v with vertex_mask[v] are indexed, e.g. the vertices of the
+        largest strongly connected component, see ComponentIndex.largest_component()
+        :param bucket_size: the side of a bucket in meters
+        :type road_network: RoadNetwork
+        :type vertex_mask: numpy.ndarray
+        :type bucket_size: float
+        :return: None
+        """
+        road_network.pack()
+        exists = road_network.v_exists & ~np.isnan(road_network.v_lat) & ~np.isnan(road_network.v_lon)
+        if vertex_mask is not None:
+            exists = exists & vertex_mask[:len(exists)]
+        v_ids = np.flatnonzero(exists)
+        lats = road_network.v_lat[v_ids]
+        lons = road_network.v_lon[v_ids]
+
+        self.bucket_size = float(bucket_size)
+        self.lat0 = float(np.mean(lats)) if len(v_ids) != 0 else 0.0
+        self.lon0 = float(np.mean(lons)) if len(v_ids) != 0 else 0.0
+        [xs, ys] = self.project(lats, lons)
+        self.x_min = float(xs.min()) if len(v_ids) != 0 else 0.0
+        self.y_min = float(ys.min()) if len(v_ids) != 0 else 0.0
+        self.nx = int((xs.max() - self.x_min) // self.bucket_size) + 1 if len(v_ids) != 0 else 1
+        self.ny = int((ys.max() - self.y_min) // self.bucket_size) + 1 if len(v_ids) != 0 else 1
+
+        [ix, iy] = self.__bucket_of(xs, ys)
+        buckets = iy * self.nx + ix
+        order = np.argsort(buckets, kind='mergesort')
+        self.offsets = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=self.nx * self.ny), out=self.offsets[1:])
+        self.vertices = v_ids[order]
+        self.xs = xs[order]
+        self.ys = ys[order]
+
+    def __str__(self):
+        return "VertexIndex:\n- number of vertexes: {}\n- buckets: {} x {} of {} m"\
+            .format(len(self.vertices), self.nx, self.ny, self.bucket_size)
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def project(self, lats, lons):
+        """
+        Project locations to meters around the center of the indexed vertices, see project_to_meters().
+
+        :param lats: numpy.ndarray | float
+        :param lons: numpy.ndarray | float
+        :return: x (to the east) and y (to the north) in meters
+        :rtype: [numpy.ndarray, numpy.ndarray]
+        """
+        return project_to_meters(lats, lons, self.lat0, self.lon0)
+
+    def nearest_vertex(self, lat, lon):
+        """
+        Return the vertex closest to location (lat, lon).
+
+        :param lat: float
+        :param lon: float
+        :return: the id of the vertex, None if the index is empty
+        :rtype: int
+        """
+        vertex = self.nearest_vertices([lat], [lon])[0]
+        return int(vertex) if vertex >= 0 else None
+
+    def nearest_vertices(self, lats, lons):
+        """
+        Return the vertices closest to many locations at once.
+
+        The locations are grouped by bucket, and the vertices of the 3 x 3 buckets around each group are scored in
+        one distance matrix per CHUNK_SIZE locations. A location whose best distance is beyond the border of these 9
+        buckets (in a sparse area, or outside the city) falls back to the search in larger squares.
+
+        :param lats: the latitudes of the locations
+        :param lons: the longitudes of the locations
+        :type lats: list[float] | numpy.ndarray
+        :type lons: list[float] | numpy.ndarray
+        :return: the ids of the vertices, -1 if the index is empty
+        :rtype: numpy.ndarray
+        """
+        [xs, ys] = self.project(lats, lons)
+        xs = np.atleast_1d(xs)
+        ys = np.atleast_1d(ys)
+        result = np.full(len(xs), -1, dtype=np.int64)
+        if len(self.vertices) == 0 or len(xs) == 0:
+            return result
+
+        [ix, iy] = self.__bucket_of(xs, ys)
+        buckets = iy * self.nx + ix
+        order = np.argsort(buckets, kind='mergesort')
+        bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+        for group in np.split(order, bounds):
+            cx = int(ix[group[0]])
+            cy = int(iy[group[0]])
+            candidates = self.__square_positions(cx, cy, 1)
+            if len(candidates) == 0:
+                for k in group.tolist():
+                    result[k] = self.__search(xs[k], ys[k], cx, cy)
+                continue
+            for start in range(0, len(group), CHUNK_SIZE):
+                chunk = group[start:start + CHUNK_SIZE]
+                dx = xs[chunk][:, None] - self.xs[candidates][None, :]
+                dy = ys[chunk][:, None] - self.ys[candidates][None, :]
+                dis = np.hypot(dx, dy)
+                best = np.argmin(dis, axis=1)
+                best_dis = dis[np.arange(len(chunk)), best]
+                result[chunk] = self.vertices[candidates[best]]
+
+                # The vertices beyond the 3 x 3 buckets are at least this far away.
+                margin = self.__margin(xs[chunk], ys[chunk], cx, cy, 1)
+                for k in chunk[best_dis > margin].tolist():
+                    result[k] = self.__search(xs[k], ys[k], cx, cy)
+        return result
+
+    def __search(self, x, y, cx, cy):
+        """
+        The search for the projected location (x, y) in squares of buckets around bucket (cx, cy), doubling the
+        size of the square until no bucket outside it can hold a closer vertex.
+        """
+        best = -1
+        best_dis = float('inf')
+        r = 1
+        while True:
+            positions = self.__square_positions(cx, cy, r)
+            if len(positions) != 0:
+                dis = np.hypot(self.xs[positions] - x, self.ys[positions] - y)
+                k = int(np.argmin(dis))
+                best_dis = dis[k]
+                best = int(self.vertices[positions[k]])
+            covers_all = cx - r <= 0 and cy - r <= 0 and cx + r >= self.nx - 1 and cy + r >= self.ny - 1
+            if covers_all or best_dis <= self.__margin(x, y, cx, cy, r):
+                return best
+            r *= 2
+
+    def __square_positions(self, cx, cy, r):
+        """
+        Return the positions (in vertices) of the vertices of the buckets at Chebyshev distance at most r of bucket
+        (cx, cy). Each row of buckets in the square is a contiguous range of positions.
+
+        :rtype: numpy.ndarray
+        """
+        rows = np.arange(max(cy - r, 0), min(cy + r, self.ny - 1) + 1) * self.nx
+        lo = self.offsets[rows + max(cx - r, 0)]
+        hi = self.offsets[rows + min(cx + r, self.nx - 1) + 1]
+        lengths = hi - lo
+        starts = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum()) - np.repeat(starts - lo, lengths)
+
+    def __margin(self, xs, ys, cx, cy, r):
+        """
+        Return the distance from the projected locations to the border of the square of buckets at Chebyshev distance
+        at most r of bucket (cx, cy); negative if a location is outside the square.
+        """
+        left = self.x_min + (cx - r) * self.bucket_size
+        bottom = self.y_min + (cy - r) * self.bucket_size
+        right = self.x_min + (cx + r + 1) * self.bucket_size
+        top = self.y_min + (cy + r + 1) * self.bucket_size
+        return np.minimum(np.minimum(xs - left, right - xs), np.minimum(ys - bottom, top - ys))
+
+    def __bucket_of(self, xs, ys):
+        """
+        Return the bucket (ix, iy) of projected locations, clipped to the grid.
+        """
+        ix = np.clip(np.floor((xs - self.x_min) / self.bucket_size), 0, self.nx - 1).astype(np.int64)
+        iy = np.clip(np.floor((ys - self.y_min) / self.bucket_size), 0, self.ny - 1).astype(np.int64)
+        return [ix, iy]
+
+
+def project_to_meters(lats, lons, lat0, lon0):
+    """
+    Project locations to meters by the equirectangular projection around (lat0, lon0).
+
+    >>> [xs, ys] = project_to_meters([39.9, 39.91], [116.3, 116.3], 39.9, 116.29)
+    >>> np.round(xs).tolist(), np.round(ys).tolist()
+    ([853.0, 853.0], [0.0, 1112.0])
+
+    :param lats: numpy.ndarray | float
+    :param lons: numpy.ndarray | float
+    :param lat0: float
+    :param lon0: float
+    :return: x (to the east) and y (to the north) in meters
+    :rtype: [numpy.ndarray, numpy.ndarray]
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    xs = R * np.radians(lons - lon0) * math.cos(math.radians(lat0))
+    ys = R * np.radians(lats - lat0)
+    return [xs, ys]